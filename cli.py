@@ -66,8 +66,33 @@ def main():
     # extract values in the config file
     grammar_path = user_config.get("grammar")
     port = user_config.getint("port")
+    path = user_config.get("path", fallback="")
     ptt_mode = user_config.get("ptt_mode").lower()
     ptt_key = user_config.get("ptt_key")
+    queue_depth = user_config.getint("queue_depth", fallback=8)
+    queue_overflow = user_config.get("queue_overflow", fallback="drop_oldest").lower()
+    kana_fold = user_config.getboolean("kana_fold", fallback=False)
+    dedupe_window = user_config.getfloat("dedupe_window", fallback=0.0)
+    latency_trace = user_config.getboolean("latency_trace", fallback=False)
+    latency_dump_key = user_config.get("latency_dump_key", fallback="")
+    streaming = user_config.getboolean("streaming", fallback=False)
+    nbest = user_config.getboolean("nbest", fallback=False)
+    input_backend = user_config.get("input_backend", fallback="keyboard").lower()
+    listeners = []
+    if mode == "multi":
+        # "mode:port, mode:path, ..."
+        for listener in user_config.get("listeners", fallback="").split(","):
+            if listener.strip() == "":
+                continue
+            listener_mode, sep, listener_target = listener.partition(":")
+            listener_target = listener_target.strip()
+            if (sep == "") or (listener_target == ""):
+                print(f"ERROR: invalid listener('{listener.strip()}') given! (format: mode:port or mode:path)")
+                print("exit...")
+                return
+            if listener_target.isdigit():
+                listener_target = int(listener_target)
+            listeners.append((listener_mode.strip().lower(), listener_target))
 
     # normalize and check the grammar file path
     drive, directory = os.path.splitdrive(grammar_path)
@@ -80,7 +105,11 @@ def main():
         return
 
     # main process
-    sr2ctrl_main(grammar_path=grammar_path, port=port, mode=mode, test=args.test, ptt_mode=ptt_mode, ptt_key=ptt_key)
+    sr2ctrl_main(grammar_path=grammar_path, port=port, mode=mode, test=args.test, ptt_mode=ptt_mode, ptt_key=ptt_key,
+                 queue_depth=queue_depth, queue_overflow=queue_overflow, kana_fold=kana_fold,
+                 dedupe_window=dedupe_window, listeners=listeners, path=path,
+                 latency_trace=latency_trace, latency_dump_key=latency_dump_key, streaming=streaming, nbest=nbest,
+                 input_backend=input_backend)
     print("exit...")
 
 if __name__ == "__main__":
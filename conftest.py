@@ -0,0 +1,6 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# pytest puts the directory of this file (the repository root) on sys.path, so that the tests import sr2ctrl
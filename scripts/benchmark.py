@@ -0,0 +1,384 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# Micro benchmarks for developers. run from the repository root:
+#   python scripts/benchmark.py matcher
+#   python scripts/benchmark.py states
+#   python scripts/benchmark.py fuzzy
+#   python scripts/benchmark.py startup
+#   python scripts/benchmark.py commands --grammar sr2ctrl/grammar/Arma3.py
+#   python scripts/benchmark.py pipeline --size 200
+#   python scripts/benchmark.py keys
+#
+import io
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+import tempfile
+import contextlib
+import importlib.util
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, _root)
+
+from sr2ctrl import normalize
+from sr2ctrl import matcher
+from sr2ctrl import rules
+from sr2ctrl import fuzzy
+from sr2ctrl import compiled
+from sr2ctrl import dispatch
+from sr2ctrl import backend
+from sr2ctrl import keysched
+
+
+def load_module(path, name):
+	spec = importlib.util.spec_from_file_location(name, path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+def load_params(path):
+	return load_module(path, "benchmark_params")
+
+def keyword_groups(params):
+	# every kw_* dict of a params module, named without the "kw_" prefix
+	return {_name[3:]: _value for _name, _value in vars(params).items() if _name.startswith("kw_") and _name != "kw_sample"}
+
+def make_corpus(groups, size, seed=1):
+	# utterances made of 1-4 plain keywords (and a few words hitting nothing)
+	_words = sorted({_p for _words in groups.values() for _patterns in _words.values() for _p in _patterns
+					if _p and not any(_c in _p for _c in "[]()?*+|\\")})
+	_words += ["えーと", "あの", "ちょっと", "お願い"]
+	_random = random.Random(seed)
+	return ["".join(_random.choice(_words) for _ in range(_random.randint(1, 4))) for _ in range(size)]
+
+def time_per_call(func, texts, repeat):
+	# best of `repeat` rounds, in microseconds per text
+	_best = None
+	for _ in range(repeat):
+		_start = time.perf_counter_ns()
+		for _text in texts:
+			func(_text)
+		_elapsed = time.perf_counter_ns() - _start
+		if _best is None or _elapsed < _best:
+			_best = _elapsed
+	return _best / len(texts) / 1000
+
+
+# ##################################################
+# matcher: sequential regex searches vs one automaton scan
+# ##################################################
+def bench_matcher(args):
+	_normalizer = normalize.get_normalizer()
+	_groups = keyword_groups(load_params(args.params))
+	_texts = [_normalizer.normalize(_t) for _t in make_corpus(_groups, args.size)]
+	_start = time.perf_counter()
+	_regex = matcher.RegexMatcher(_groups, _normalizer)
+	_regex_build = time.perf_counter() - _start
+	_start = time.perf_counter()
+	_keyword = matcher.KeywordMatcher(_groups, _normalizer)
+	_keyword_build = time.perf_counter() - _start
+	_mismatch = sum(1 for _t in _texts if _regex.search_keys(_t) != _keyword.search_keys(_t))
+	print(f"params   : {args.params}")
+	print(f"groups   : {len(_keyword.keys)} (literals={_keyword.literal_count}, regex={_keyword.regex_count})")
+	print(f"corpus   : {len(_texts)} texts, avg {sum(map(len, _texts)) / len(_texts):.1f} chars")
+	print(f"mismatch : {_mismatch}")
+	print(f"{'matcher':<28}{'build ms':>10}{'us/text':>10}")
+	print(f"{'regex (search per group)':<28}{_regex_build * 1000:>10.2f}{time_per_call(_regex.search_keys, _texts, args.repeat):>10.2f}")
+	print(f"{'keyword automaton':<28}{_keyword_build * 1000:>10.2f}{time_per_call(_keyword.search_keys, _texts, args.repeat):>10.2f}")
+	print(f"{'keyword automaton (scan)':<28}{'':>10}{time_per_call(_keyword.scan, _texts, args.repeat):>10.2f}")
+
+
+# ##################################################
+# states: the whole rule table vs the subset of each grammar state
+# ##################################################
+def bench_states(args):
+	# the grammar loads its own params (run from the repository root)
+	with contextlib.redirect_stdout(io.StringIO()):
+		_grammar = load_module(args.grammar, "benchmark_grammar")
+		_owner = _grammar.SR2C(True)
+	_state_rules = _owner._rules
+	_table = _state_rules.table
+	# no step order timeout while measuring
+	_owner._so_timeout = float("inf")
+	_normalizer = normalize.get_normalizer()
+	_texts = [_normalizer.normalize(_t) for _t in make_corpus(_state_rules.groups, args.size)]
+	_full_matcher = matcher.KeywordMatcher(_state_rules.groups, _normalizer)
+	def full(text):
+		_order = {}
+		_table.evaluate(_full_matcher.search_keys(text), _order, _owner)
+		return _order
+	def subset(text):
+		_order = {}
+		_state_rules.evaluate(text, _order, _owner)
+		return _order
+	print(f"grammar  : {args.grammar}")
+	print(f"corpus   : {len(_texts)} texts, avg {sum(map(len, _texts)) / len(_texts):.1f} chars")
+	print(f"{'state':<8}{'rules':>7}{'keys':>7}{'literals':>10}{'mismatch':>10}{'full us':>10}{'state us':>10}")
+	print(f"{'(all)':<8}{len(_table.names):>7}{len(_full_matcher.keys):>7}{_full_matcher.literal_count:>10}")
+	for _state, (_subset, _matcher) in _state_rules.tables().items():
+		with contextlib.redirect_stdout(io.StringIO()):
+			setattr(_owner, _table.state_attr, _state)
+			_mismatch = sum(1 for _t in _texts if full(_t) != subset(_t))
+			_full_us = time_per_call(full, _texts, args.repeat)
+			_state_us = time_per_call(subset, _texts, args.repeat)
+		print(f"{_state!s:<8}{len(_subset.names):>7}{len(_matcher.keys):>7}{_matcher.literal_count:>10}{_mismatch:>10}{_full_us:>10.2f}{_state_us:>10.2f}")
+
+
+# ##################################################
+# fuzzy: pair index vs trying every keyword, as the vocabulary grows
+# ##################################################
+def bench_fuzzy(args):
+	_normalizer = normalize.get_normalizer()
+	_groups = keyword_groups(load_params(args.params))
+	_random = random.Random(1)
+	_kana = [chr(_c) for _c in range(0x30A2, 0x30F3)]
+	# misheard texts: one character of a corpus text replaced
+	_texts = []
+	for _t in make_corpus(_groups, args.size):
+		_t = _normalizer.normalize(_t)
+		_i = _random.randrange(len(_t))
+		_texts.append(_t[:_i] + _random.choice(_kana) + _t[_i + 1:])
+	print(f"params   : {args.params}")
+	print(f"corpus   : {len(_texts)} texts, avg {sum(map(len, _texts)) / len(_texts):.1f} chars, max distance {args.distance}")
+	print(f"{'vocabulary':<12}{'entries':>9}{'build ms':>10}{'hit rate':>10}{'mismatch':>10}{'index us':>10}{'brute us':>10}")
+	for _extra in (0, 1000, 10000):
+		# the keywords of the params, and random made-up words
+		_vocabulary = dict(_groups)
+		_vocabulary["extra"] = {f"w{_n}": ("".join(_random.choice(_kana) for _ in range(_random.randint(3, 6))),) for _n in range(_extra)}
+		_start = time.perf_counter()
+		_index = fuzzy.FuzzyIndex(_vocabulary, _normalizer, max_distance=args.distance)
+		_build = time.perf_counter() - _start
+		_hits = sum(1 for _t in _texts if _index.search(_t))
+		# trying every keyword is slow: a tenth of the corpus for it
+		_brute_texts = _texts[:max(1, len(_texts) // 10)]
+		_mismatch = sum(1 for _t in _brute_texts if dict(_index.search(_t)) != dict(_index.search_brute(_t)))
+		print(f"{'+' + str(_extra):<12}{len(_index):>9}{_build * 1000:>10.2f}{_hits / len(_texts):>10.1%}{_mismatch:>10}"
+			f"{time_per_call(_index.search, _texts, args.repeat):>10.2f}{time_per_call(_index.search_brute, _brute_texts, 1):>10.2f}")
+
+
+# ##################################################
+# startup: grammar construction with an empty (cold) and a filled (warm) compiled cache
+# ##################################################
+def bench_startup(args):
+	with tempfile.TemporaryDirectory() as _dir:
+		compiled.cache_dir = _dir
+		with contextlib.redirect_stdout(io.StringIO()):
+			_grammar = load_module(args.grammar, "benchmark_grammar")
+		print(f"grammar  : {args.grammar}")
+		print(f"{'fuzzy distance':<16}{'cold ms':>10}{'warm ms':>10}{'cache kB':>10}")
+		for _distance in (0, args.distance):
+			_grammar.params.fuzzy_max_distance = _distance
+			_cold = _warm = None
+			for _ in range(args.repeat):
+				for _file in os.listdir(_dir):
+					os.remove(os.path.join(_dir, _file))
+				with contextlib.redirect_stdout(io.StringIO()):
+					_start = time.perf_counter()
+					_grammar.SR2C(True)
+					_middle = time.perf_counter()
+					_grammar.SR2C(True)
+					_end = time.perf_counter()
+				_cold = min(_cold or _middle - _start, _middle - _start)
+				_warm = min(_warm or _end - _middle, _end - _middle)
+			_size = sum(os.path.getsize(os.path.join(_dir, _file)) for _file in os.listdir(_dir))
+			print(f"{_distance:<16}{_cold * 1000:>10.2f}{_warm * 1000:>10.2f}{_size / 1024:>10.1f}")
+
+
+# ##################################################
+# commands: a command table (e.g. arma3_commands) as it grows. the first command hit wins
+# ##################################################
+def bench_commands(args):
+	with contextlib.redirect_stdout(io.StringIO()):
+		_grammar = load_module(args.grammar, "benchmark_grammar")
+	_table = getattr(_grammar, args.table)
+	_normalizer = normalize.get_normalizer()
+	_random = random.Random(1)
+	_kana = [chr(_c) for _c in range(0x30A2, 0x30F3)]
+	print(f"grammar  : {args.grammar} ({args.table})")
+	print(f"{'commands':<10}{'build ms':>10}{'mismatch':>10}{'regex us':>10}{'engine us':>10}")
+	for _extra in (0, 100, 1000, 5000):
+		# the commands of the grammar, and made-up ones
+		_commands = dict(_table)
+		for _n in range(_extra):
+			_commands[f"made_up_{_n}"] = {"words": ("".join(_random.choice(_kana) for _ in range(_random.randint(3, 6))),), "keys": ("f1",)}
+		_groups, _rules = rules.command_rules(_commands)
+		_start = time.perf_counter()
+		_matcher = matcher.KeywordMatcher(_groups, _normalizer)
+		_rule_table = rules.RuleTable(_rules, keys=_matcher.keys)
+		_build = time.perf_counter() - _start
+		# the way a table is read without an engine: one regex per command, tried from the top
+		_regexes = [(_name, _normalizer.compile(_words)) for _name, _words in _groups["commands"].items()]
+		def regex(text):
+			return next((_name for _name, _reobj in _regexes if _reobj.search(text)), None)
+		def engine(text):
+			_order = {}
+			_rule_table.evaluate(_matcher.search_keys(text), _order)
+			return _order.get("command")
+		_texts = [_normalizer.normalize(_t) for _t in make_corpus(_groups, args.size)]
+		_mismatch = sum(1 for _t in _texts if regex(_t) != engine(_t))
+		print(f"{len(_regexes):<10}{_build * 1000:>10.2f}{_mismatch:>10}{time_per_call(regex, _texts, args.repeat):>10.2f}{time_per_call(engine, _texts, args.repeat):>10.2f}")
+
+
+# ##################################################
+# pipeline: text -> work queue -> dispatcher -> grammar -> key scheduler -> input backend, headless.
+# the keys go to a recording backend. each text waits for the keys of the one before
+# ##################################################
+def percentile(values, rate):
+	_sorted = sorted(values)
+	return _sorted[min(len(_sorted) - 1, int(len(_sorted) * rate))]
+
+def bench_pipeline(args):
+	_recorder = backend.RecordingBackend()
+	with contextlib.redirect_stdout(io.StringIO()):
+		_grammar = load_module(args.grammar, "benchmark_grammar")
+		_owner = _grammar.SR2C(False, input_backend=_recorder)
+	# holds are not measured: no 2 s waits between the texts
+	if hasattr(_owner, "_long_push_time"):
+		_owner._long_push_time = 0.0
+	_normalizer = normalize.get_normalizer()
+	_texts = make_corpus(_grammar.keyword_groups(), args.size)
+	_work_queue = dispatch.WorkQueue(depth=len(_texts))
+	_handled = threading.Semaphore(0)
+	def handler(text):
+		try:
+			_owner.on_recognition(text)
+		finally:
+			_handled.release()
+	_dispatcher = dispatch.Dispatcher(_work_queue, handler)
+	_dispatcher.start()
+	_first = [] # us from the text to its first key
+	with contextlib.redirect_stdout(io.StringIO()):
+		for _text in _texts:
+			_count = _recorder.count
+			_received = time.perf_counter_ns()
+			_work_queue.put(_normalizer.normalize(_text))
+			_handled.acquire()
+			_owner._scheduler.wait_idle()
+			_events = _recorder.events(_count)
+			if _events:
+				_first.append((_events[0][0] - _received) / 1000)
+		_dispatcher.stop(timeout=1)
+		_owner.close()
+	_keys = _owner.get_stats()["keys"]
+	print(f"grammar  : {args.grammar}")
+	print(f"{'texts':<8}{'acted':>7}{'events':>8}{'p50 us':>10}{'p99 us':>10}{'max us':>10}{'drift us':>10}")
+	if not _first:
+		print(f"{len(_texts):<8}{0:>7}{0:>8}")
+		return
+	print(f"{len(_texts):<8}{len(_first):>7}{_recorder.count:>8}{percentile(_first, 0.5):>10.1f}{percentile(_first, 0.99):>10.1f}"
+		  f"{max(_first):>10.1f}{_keys['drift_avg_ms'] * 1000:>10.1f}")
+
+
+# ##################################################
+# keys: the per-key work of pushing a command: keys resolved on every push vs compiled key plans.
+# the injection itself (the OS call) is left out
+# ##################################################
+# command lists of ReadyOrNot
+_key_commands = (
+	["yell"],
+	["long_interact"],
+	["cmd_menu", "cmd_1", "cmd_4"],
+	["red", "cmd_menu", "cmd_2", "cmd_3"],
+	["cmd_hold", "gold", "cmd_menu", "cmd_1", "cmd_5"],
+)
+
+def bench_keys(args):
+	# hotkeys are parsed by the keyboard module when it works here (keyboard.send() parses them on every key)
+	try:
+		_backend = backend.KeyboardBackend()
+		_backend.resolve("shift+f1", False)
+		_parsing = "keyboard.parse_hotkey"
+	except Exception:
+		_backend = backend.NullBackend()
+		_parsing = "none (keyboard module not available)"
+	with contextlib.redirect_stdout(io.StringIO()):
+		_grammar = load_module(args.grammar, "benchmark_grammar")
+		_owner = _grammar.SR2C(True, input_backend=_backend)
+	if not hasattr(_owner, "_compile_plan") or not hasattr(_owner, "_ingame_key_bindings"):
+		print(f"ERROR: {args.grammar} has no key bindings to compile!")
+		return
+	_bindings = _owner._ingame_key_bindings
+	_resolve = _backend.resolve
+	def inject(kind, key, is_mouse):
+		pass
+	def resolved_every_time(command):
+		# the way the keys were pushed before the plans were compiled
+		_hold_key = ""
+		_hold_is_mouse = False
+		_timeline = keysched.Timeline(command)
+		for cmd in command:
+			_is_long = "long_" in cmd
+			_cmd = cmd.replace("long_", "")
+			_key = _bindings[_cmd]
+			_is_mouse = False
+			if "mouse_" in _key:
+				_is_mouse = True
+				_key = _key.replace("mouse_", "")
+			if _is_long:
+				_timeline.press(_key, _is_mouse).wait(_owner._long_push_time)
+				_timeline.release(_key, _is_mouse).wait(0.06)
+				continue
+			if _cmd == "cmd_hold":
+				_hold_key = _key
+				_hold_is_mouse = _is_mouse
+				_timeline.press(_key, _is_mouse).wait(0.06)
+				continue
+			_timeline.tap(_key, _is_mouse).wait(0.06)
+		if _hold_key != "":
+			_timeline.release(_hold_key, _hold_is_mouse)
+		for _offset, _kind, _key, _is_mouse in _timeline.events:
+			inject(_kind, _resolve(_key, _is_mouse), _is_mouse)
+	def compiled_plan(command):
+		_plan_key = (tuple(command), 0)
+		_timeline = _owner._plans.get(_plan_key)
+		if _timeline is None:
+			_timeline = _owner._plans[_plan_key] = _owner._compile_plan(_plan_key[0], 0)
+		for _offset, _kind, _key, _is_mouse in _timeline.events:
+			inject(_kind, _key, _is_mouse)
+	print(f"grammar  : {args.grammar}")
+	print(f"parsing  : {_parsing}")
+	print(f"{'command':<44}{'events':>7}{'before ns':>11}{'after ns':>10}   (per key event)")
+	for _command in _key_commands:
+		_events = len(_owner._compile_plan(tuple(_command), 0).events)
+		_items = [_command] * args.size
+		_before = time_per_call(resolved_every_time, _items, args.repeat) * 1000 / _events
+		_after = time_per_call(compiled_plan, _items, args.repeat) * 1000 / _events
+		print(f"{' '.join(_command):<44}{_events:>7}{_before:>11.0f}{_after:>10.0f}")
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("benchmark", choices=["matcher", "states", "fuzzy", "startup", "commands", "pipeline", "keys"], help="benchmark to run")
+	parser.add_argument("--params", default=os.path.join(_root, "sr2ctrl", "grammar", "ReadyOrNot_params.py"),
+						help="keyword params module")
+	parser.add_argument("--grammar", default=os.path.join(_root, "sr2ctrl", "grammar", "ReadyOrNot.py"),
+						help="grammar module (states, startup, commands, pipeline, keys)")
+	parser.add_argument("--table", default="arma3_commands", help="command table of the grammar (commands)")
+	parser.add_argument("--distance", type=int, default=1, help="max edit distance (fuzzy)")
+	parser.add_argument("--size", type=int, default=5000, help="number of texts in the corpus")
+	parser.add_argument("--repeat", type=int, default=5, help="rounds (the best one is reported)")
+	args = parser.parse_args()
+	match args.benchmark:
+		case "matcher":
+			bench_matcher(args)
+		case "states":
+			bench_states(args)
+		case "fuzzy":
+			bench_fuzzy(args)
+		case "startup":
+			bench_startup(args)
+		case "commands":
+			bench_commands(args)
+		case "pipeline":
+			bench_pipeline(args)
+		case "keys":
+			bench_keys(args)
+
+if __name__ == "__main__":
+	main()
@@ -71,6 +71,7 @@ include_files.append(("licenses/pkg_licenses_summary.md", "licenses/pkg_licenses
 include_files.append(("sr2ctrl/settings/SR2Control_settings.ini", "sr2ctrl/settings/SR2Control_settings.ini"))
 include_files.append(("sr2ctrl/settings/SR2Control_settings_KeyNameCheck.ini", "sr2ctrl/settings/SR2Control_settings_KeyNameCheck.ini"))
 include_files.append(("sr2ctrl/settings/SR2Control_settings_ReadyOrNot.ini", "sr2ctrl/settings/SR2Control_settings_ReadyOrNot.ini"))
+include_files.append(("sr2ctrl/settings/SR2Control_timing.ini", "sr2ctrl/settings/SR2Control_timing.ini"))
 include_files.append("launchers/_Start_KeyNameCheck.cmd")
 include_files.append("launchers/_Start_RoN_Default.cmd")
 include_files.append("launchers/_Start_RoN_Test.cmd")
@@ -78,13 +79,15 @@ include_files.append("launchers/_Start_RoN_Test.cmd")
 # Dependencies are automatically detected, but it might need fine tuning.
 build_exe_options = {
     "packages": [],
+    # modules imported only by grammars (grammars are loaded from source at runtime)
+    "includes": ["sr2ctrl.matcher", "sr2ctrl.rules", "sr2ctrl.cache", "sr2ctrl.fuzzy", "sr2ctrl.compiled", "sr2ctrl.keysched", "sr2ctrl.backend", "sr2ctrl.timing"],
     "include_files": include_files,
     "bin_path_excludes": "C:/Program Files/",
     "excludes": ["tkinter", 
                  "sqlite3",
-                 "asyncio",
+                 # "asyncio",
                  # "collections",
-                 "concurrent",
+                 # "concurrent",
                  "email",
                  # "encodings",
                  # "html",
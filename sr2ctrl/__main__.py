@@ -5,36 +5,54 @@
 #
 import os
 import sys
-import re
 import datetime
-import socket
+import time
 import importlib.util
 import requests
 import winreg
 import keyboard
 
-def main(grammar_path, port, mode, test, ptt_mode, ptt_key):
+from sr2ctrl import receiver
+from sr2ctrl import dispatch
+from sr2ctrl import normalize
+from sr2ctrl import latency
+from sr2ctrl import backend
+
+def main(grammar_path, port, mode, test, ptt_mode, ptt_key, queue_depth=8, queue_overflow="drop_oldest", kana_fold=False, dedupe_window=0.0,
+		 listeners=None, path=None, latency_trace=False, latency_dump_key="", streaming=False, nbest=False,
+		 input_backend="keyboard"):
 	print(datetime.datetime.now().strftime(r"%Y.%m.%d %H:%M:%S"))
 	print(r"(press [ctrl] + [pause/break] to exit)")
 	if test:
 		print("")
 		print(r"(!) Test Mode Enabled")
 
-	path = os.path.abspath(grammar_path)
+	# latency trace. enabled before the grammar is loaded
+	if latency_trace:
+		latency.enable()
+
+	# text normalization stage. configured before the grammar compiles its keywords with it
+	normalizer = normalize.configure(kana_fold=kana_fold)
+
+	# not `path`: that is the file path of the local receive modes
+	grammar_abspath = os.path.abspath(grammar_path)
 	name = os.path.basename(grammar_path).split(".")[0]
 	try:
-		spec = importlib.util.spec_from_file_location(name, path)
+		spec = importlib.util.spec_from_file_location(name, grammar_abspath)
 		my_grammar = importlib.util.module_from_spec(spec)
 		sys.modules[name] = my_grammar
 		spec.loader.exec_module(my_grammar)
-		my_obj = my_grammar.SR2C(test=test)
+		if input_backend == "keyboard":
+			my_obj = my_grammar.SR2C(test=test)
+		else:
+			# only for a grammar which takes an input backend (see sr2ctrl/backend.py)
+			my_obj = my_grammar.SR2C(test=test, input_backend=backend.get_backend(input_backend))
 	except Exception as e:
 		print("ERROR: grammar import failed!")
 		print(e)
 		return
 
 	host_address = "127.0.0.1"
-	local_address = (host_address, port)
 
 	# PTT
 	# grobal listening state manager object
@@ -170,93 +188,261 @@ def main(grammar_path, port, mode, test, ptt_mode, ptt_key):
 	txt_start_listen = "Start to listen..."
 	txt_stop_running = "Stop running..."
 
-	omit_chars = r"[ 　,.，．、。]*"
+	# work queue. the receive engine only normalizes and enqueues, the dispatcher runs the grammar
+	try:
+		work_queue = dispatch.WorkQueue(depth=queue_depth, overflow=queue_overflow)
+	except ValueError as e:
+		print(f"WARNING: {e} continue with default values(8, 'drop_oldest')")
+		work_queue = dispatch.WorkQueue()
 
-	# UDP mode
-	def recv_udp():
-		my_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-		my_socket.bind(local_address)
-		my_socket.settimeout(0.5)
-		print("")
-		print(txt_start_listen)
-		try:
-			while True:
-				try:
-					message_bytes = my_socket.recv(4096)
-					if (message_bytes != b""):
-						message_text = message_bytes.decode(encoding="utf-8", errors="replace")
-						message_text = re.sub(omit_chars, "", message_text)
-						if message_text != "":
-							if not lsmgr.is_bt:
-								my_obj.on_recognition(message_text)
-							elif lsmgr.get_state():
-								my_obj.on_recognition(message_text)
-				except socket.timeout:
-					continue
-				except KeyboardInterrupt:
-					raise
-				except Exception:
-					raise
-		except KeyboardInterrupt:
-			pass
-		except Exception as e:
-			print(e)
-		finally:
-			print(txt_stop_running)
-			my_socket.close()
-			keyboard.unhook_all()
+	# dedupe stage. drops repeated texts and interim versions within the window (0 = off)
+	dedupe = None
+	intake = work_queue
+	if dedupe_window > 0:
+		dedupe = dispatch.DuplicateFilter(work_queue, window=dedupe_window)
+		intake = dedupe
 
-	# YNC Bouyomi mode
-	def recv_ync_bouyomi():
-		my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		my_socket.bind(local_address)
-		my_socket.listen()
+	# json messages (see dispatch.parse_message). plain texts are still taken as they are
+	json_messages = streaming or nbest
+	# streaming stage. partial and final texts of one utterance (see dispatch.StreamGate)
+	stream = None
+	if streaming:
+		stream = dispatch.StreamGate(work_queue, partials=hasattr(my_obj, "on_partial"))
+		if not hasattr(my_obj, "on_partial"):
+			print("WARNING: the grammar has no on_partial method! partial texts are ignored")
+	# n-best stage. the hypotheses of one utterance go to the grammar together
+	if nbest and not hasattr(my_obj, "on_nbest"):
+		print("WARNING: the grammar has no on_nbest method! only the best hypothesis is used")
+
+	# text or hypotheses of a json message, normalized. "" when nothing is left
+	def normalize_body(_body):
+		if isinstance(_body, str):
+			return normalizer.normalize(_body)
+		_hypotheses = [(normalizer.normalize(_text), _confidence) for _text, _confidence in _body]
+		_hypotheses = [(_text, _confidence) for _text, _confidence in _hypotheses if _text != ""]
+		if not _hypotheses:
+			return ""
+		if not nbest:
+			return _hypotheses[0][0]
+		return dispatch.Hypotheses(_hypotheses)
+
+	# same as on_texts below, with json messages. traces: the latency trace of each text or None
+	def on_json_texts(message_texts, traces):
+		_batch = []
+		_batch_tags = []
+		_messages = []
+		_message_tags = []
+		_items = []
+		_item_tags = []
+		for _i, message_text in enumerate(message_texts):
+			_tag = None if traces is None else traces[_i]
+			_message = dispatch.parse_message(message_text)
+			if _message is None:
+				_seq, _final, _body = None, True, normalizer.normalize(message_text)
+			else:
+				_seq, _final, _body = _message[0], _message[1], normalize_body(_message[2])
+			if _tag is not None:
+				_tag.mark("normalize")
+			if _body == "":
+				continue
+			if stream is not None and _seq is not None:
+				_messages.append((_seq, _final, _body))
+				_message_tags.append(_tag)
+			elif not _final:
+				# a partial text without streaming mode
+				continue
+			elif isinstance(_body, str):
+				_batch.append(_body)
+				_batch_tags.append(_tag)
+			else:
+				# hypotheses skip the dedupe stage
+				_items.append(_body)
+				_item_tags.append(_tag)
+		if _batch:
+			intake.put_many(_batch, _batch_tags)
+		if _messages:
+			stream.put_many(_messages, _message_tags)
+		if _items:
+			work_queue.put_many(_items, _item_tags)
+
+	# receive handler. be called from the receive engine with the texts arrived in one wakeup
+	def on_texts(message_texts, received_ns):
+		if not latency_trace:
+			if lsmgr.is_bt and not lsmgr.get_state():
+				return
+			if json_messages:
+				on_json_texts(message_texts, None)
+				return
+			_batch = []
+			for message_text in message_texts:
+				message_text = normalizer.normalize(message_text)
+				if message_text != "":
+					_batch.append(message_text)
+			intake.put_many(_batch)
+			return
+		# same as above, with a latency trace for each text
+		_decoded_ns = time.perf_counter_ns()
+		_traces = []
+		for message_text in message_texts:
+			_trace = latency.start(received_ns)
+			_trace.mark("decode", _decoded_ns)
+			_traces.append(_trace)
+		if lsmgr.is_bt and not lsmgr.get_state():
+			return
+		_ptt_ns = time.perf_counter_ns()
+		for _trace in _traces:
+			_trace.mark("ptt", _ptt_ns)
+		if json_messages:
+			on_json_texts(message_texts, _traces)
+			return
+		_batch = []
+		_batch_traces = []
+		for message_text, _trace in zip(message_texts, _traces):
+			message_text = normalizer.normalize(message_text)
+			_trace.mark("normalize")
+			if message_text != "":
+				_batch.append(message_text)
+				_batch_traces.append(_trace)
+		intake.put_many(_batch, _batch_traces)
+
+	def on_ready():
 		print("")
 		print(txt_start_listen)
-		try:
-			while True:
-				try:
-					conn, addr = my_socket.accept()
-					del addr
-					conn.settimeout(5)
-					message_bytes = conn.recv(4096)
-					if (message_bytes != b""):
-						message_text = message_bytes[15:].decode(encoding="utf-8", errors="replace")
-						message_text = re.sub(omit_chars, "", message_text)
-						if message_text != "":
-							if not lsmgr.is_bt:
-								my_obj.on_recognition(message_text)
-							elif lsmgr.get_state():
-								my_obj.on_recognition(message_text)
-					conn.close() # require to close connection in each receiving (due to bouyomi-chan spec)
-				except socket.timeout:
-					continue
-				except KeyboardInterrupt:
-					raise
-				except Exception:
-					raise
-		except KeyboardInterrupt:
-			pass
-		except Exception as e:
-			print(e)
-		finally:
-			print(txt_stop_running)
-			my_socket.close()
-			keyboard.unhook_all()
+
+	engine = receiver.ReceiveEngine(on_texts)
+
+	# an error in the grammar stops running
+	def on_dispatch_error(e):
+		print(e)
+		engine.request_stop()
+
+	# n-best results of one utterance
+	def on_hypotheses(hypotheses):
+		if hasattr(my_obj, "on_nbest"):
+			my_obj.on_nbest(hypotheses)
+		else:
+			my_obj.on_recognition(hypotheses.best)
+
+	# dispatch handler with json messages. a partial text may execute the order before the utterance is over
+	def on_json_item(item):
+		if isinstance(item, str):
+			my_obj.on_recognition(item)
+			return
+		if isinstance(item, dispatch.Hypotheses):
+			on_hypotheses(item)
+			return
+		if not stream.take(item):
+			return
+		_seq, _final, _body = item
+		if _final:
+			if isinstance(_body, str):
+				my_obj.on_recognition(_body)
+			else:
+				on_hypotheses(_body)
+		elif my_obj.on_partial(_body if isinstance(_body, str) else _body.best):
+			stream.commit(_seq)
+
+	dispatcher = dispatch.Dispatcher(work_queue, on_json_item if json_messages else my_obj.on_recognition, on_error=on_dispatch_error)
+
+	# latency summary on demand
+	if latency_trace and latency_dump_key != "":
+		keyboard.add_hotkey(latency_dump_key, lambda: print(latency.summary()))
 
 	# switch by mode
 	txt_receive_mode = "RECEIVE MODE: "
+	txt_mode_names = {
+		"udp": "UDP",
+		"ync_bouyomi": "YNC Bouyomi",
+		"unix_dgram": "Unix Datagram",
+		"unix_stream": "Unix Stream",
+		"shm_ring": "Shared Memory Ring",
+	}
+	# port number for the network modes, file path for the local ones
+	def endpoint_address(_mode, _target):
+		if _mode in receiver.path_modes:
+			if not isinstance(_target, str) or _target == "":
+				raise ValueError(f"receive mode('{_mode}') needs a file path!")
+			return _target
+		if not isinstance(_target, int):
+			raise ValueError(f"receive mode('{_mode}') needs a port number!")
+		return (host_address, _target)
 	match mode:
-		case "udp":
+		case "multi":
+			# every listener feeds the same queue and the same grammar instance
 			print("")
-			print(txt_receive_mode + "UDP")
-			recv_udp()
-		case "ync_bouyomi":
+			print(txt_receive_mode + "Multi")
+			if not listeners:
+				print("ERROR: no listeners given for receive mode('multi')!")
+				return
+			for _listener_mode, _target in listeners:
+				if _listener_mode not in txt_mode_names:
+					print(f"ERROR: invalid receive mode('{_listener_mode}') given in listeners!")
+					return
+				try:
+					engine.add_endpoint(_listener_mode, endpoint_address(_listener_mode, _target))
+				except ValueError as e:
+					print(f"ERROR: {e}")
+					return
+				print(f"  {txt_mode_names[_listener_mode]} ({_target})")
+		case _ if mode in txt_mode_names:
 			print("")
-			print(txt_receive_mode + "YNC Bouyomi")
-			recv_ync_bouyomi()
+			print(txt_receive_mode + txt_mode_names[mode])
+			try:
+				engine.add_endpoint(mode, endpoint_address(mode, path if mode in receiver.path_modes else port))
+			except ValueError as e:
+				print(f"ERROR: {e}")
+				return
 		case _:
 			print(f"ERROR: invalid receive mode('{mode}') given!")
+			return
+
+	dispatcher.start()
+	try:
+		engine.run(on_ready=on_ready)
+	except KeyboardInterrupt:
+		pass
+	except Exception as e:
+		print(e)
+	finally:
+		print(txt_stop_running)
+		dispatcher.stop(timeout=5)
+		if hasattr(my_obj, "close"):
+			my_obj.close()
+		keyboard.unhook_all()
+		_stats = work_queue.get_stats()
+		print(f"QUEUE: dispatched={_stats['dispatched']} dropped={_stats['dropped']} coalesced={_stats['coalesced']}"
+			f" wait avg={_stats['wait_avg_ms']:.1f}ms max={_stats['wait_max_ms']:.1f}ms")
+		if dedupe is not None:
+			_stats = dedupe.get_stats()
+			print(f"DEDUP: duplicates={_stats['duplicates']} interims={_stats['interims']} coalesced={_stats['coalesced']}")
+		if stream is not None:
+			_stats = stream.get_stats()
+			print(f"STREAM: partials={_stats['partials']} finals={_stats['finals']} superseded={_stats['superseded']}"
+				f" committed early={_stats['committed']} suppressed={_stats['suppressed']}")
+		_stats = engine.get_stats()
+		if len(_stats["received"]) > 1:
+			print("RECV : " + " ".join(f"{_label}={_count}" for _label, _count in _stats["received"].items()))
+		if _stats["udp_datagrams"] or _stats["udp_oversized"]:
+			print(f"UDP  : datagrams={_stats['udp_datagrams']} batches={_stats['udp_batches']} oversized={_stats['udp_oversized']}")
+		if _stats["shm_texts"]:
+			print(f"SHM  : texts={_stats['shm_texts']} batches={_stats['shm_batches']} doorbell wakeups={_stats['shm_wakeups']}")
+		if hasattr(my_obj, "get_stats"):
+			_grammar_stats = my_obj.get_stats()
+			_stats = _grammar_stats.get("order_cache")
+			if _stats is not None:
+				print(f"CACHE: hits={_stats['hits']} misses={_stats['misses']} evictions={_stats['evictions']} entries={_stats['entries']}/{_stats['size']}")
+			_stats = _grammar_stats.get("nbest")
+			if _stats is not None and _stats["utterances"]:
+				print(f"NBEST: utterances={_stats['utterances']} rescued={_stats['rescued']}")
+			_stats = _grammar_stats.get("keys")
+			if _stats is not None and _stats["timelines"]:
+				print(f"INPUT: commands={_stats['timelines']} queued={_stats['queued']} events={_stats['events']} late={_stats['late']}"
+					f" drift avg={_stats['drift_avg_ms']:.2f}ms max={_stats['drift_max_ms']:.2f}ms")
+				if _stats.get("preemptions"):
+					print(f"PREEMPT: count={_stats['preemptions']} cut={_stats['preempted']} released={_stats['released']}"
+						f" avg={_stats['preempt_avg_ms']:.2f}ms max={_stats['preempt_max_ms']:.2f}ms")
+		if latency_trace:
+			print(latency.summary())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,423 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# Keyword table analyzer. checks the keywords and check rules of a grammar without running it:
+#   - rules which can never fire
+#   - keywords which an earlier rule always captures
+#   - the expected matching cost of each pattern
+# run from the repository root, e.g. after saving the params file:
+#   python -m sr2ctrl.analyzer
+#   python -m sr2ctrl.analyzer --params path/to/ReadyOrNot_params.py
+#   python -m sr2ctrl.analyzer --grammar sr2ctrl/grammar/Arma3.py --table arma3_commands
+# exits with 1 when a rule is shadowed by earlier rules.
+#
+# keywords hit by substring, and rules are tried from the top. so when a stopping rule hits on "伏",
+# a later rule never sees the texts containing its word "伏せろ": the word is captured.
+# a word is enumerated as the literals of its pattern (matcher.literals()). a regex with leading literals
+# is captured when each of them contains a captured literal, other regexes are never taken as captured.
+# a grammar with states (and "call" rules which may change the state) is checked along every path of rules
+# a text can take; a keyword counts as captured only when it is captured on every path.
+#
+import os
+import io
+import re
+import sys
+import ast
+import time
+import ntpath
+import random
+import argparse
+import contextlib
+import collections
+import importlib.util
+
+from sr2ctrl import normalize
+from sr2ctrl import matcher
+from sr2ctrl import rules
+
+_corpus_size = 300
+_fillers = ("えーと", "あの", "ちょっと", "お願い")
+
+
+# ##################################################
+# Patterns
+# ##################################################
+class Pattern(object):
+	# kind: "literal" (a small finite language, found by the automaton), "gated" (a regex tried where the
+	# automaton found one of its leading literals), "regex" (searched in every text) or "always" (hits every text)
+	__slots__ = ("key", "pattern", "kind", "literals", "prefixes")
+
+	def targets(self):
+		# strings one of which is in every text the pattern hits, or None
+		if self.kind == "literal":
+			return self.literals
+		if self.kind == "gated":
+			return self.prefixes
+		return None
+
+def keyword_patterns(groups, normalizer):
+	# {"group.word": [Pattern, ...]}
+	_patterns = {}
+	for _group, _words in groups.items():
+		for _word, _items in _words.items():
+			_key = f"{_group}.{_word}"
+			if isinstance(_items, str):
+				_items = (_items,)
+			_patterns[_key] = []
+			for _item in _items:
+				_p = Pattern()
+				_p.key = _key
+				_p.pattern = normalizer.pattern(_item)
+				_p.literals = matcher.literals(_p.pattern)
+				_p.prefixes = None
+				if _p.literals is not None:
+					_p.kind = "always" if "" in _p.literals else "literal"
+				else:
+					_p.prefixes = matcher.leading_literals(_p.pattern)
+					_p.kind = "regex" if _p.prefixes is None else "gated"
+				_patterns[_key].append(_p)
+	return _patterns
+
+
+# ##################################################
+# Rule paths
+# ##################################################
+def rule_paths(table, states):
+	# [(label, [compiled rule, ...])]: the rules a text can go through, in order.
+	# a "call" rule may change the state: the rest of the path is the subset of another state after it
+	_paths = []
+	_subsets = {_state: table.subset(_state).rules for _state in states}
+	for _state, _rules in _subsets.items():
+		_paths.append((f"state {_state}", list(_rules)))
+		if _state is None:
+			continue
+		for _call in (_rule for _rule in _rules if _rule.call is not None):
+			for _other, _other_rules in _subsets.items():
+				if _other == _state:
+					continue
+				_path = [_rule for _rule in _rules if _rule.index <= _call.index] + [_rule for _rule in _other_rules if _rule.index > _call.index]
+				_paths.append((f"state {_state}->{_other} at '{_call.name}'", _path))
+	return _paths
+
+def _substrings(text):
+	return {text[_i:_j] for _i in range(len(text)) for _j in range(_i + 1, len(text) + 1)}
+
+def check_path(path, patterns, normalizer):
+	# {(rule index, key, target): None (free), "impossible" or (capturing rule, its key, its literal)}
+	# and the rule indexes which have an uncapturable pattern
+	_results = {}
+	_open = set()
+	_capturing = {} # literal -> (capturing rule, key, position in the path)
+	for _pos, _rule in enumerate(path):
+		for _key in sorted(_rule.when or ()):
+			for _p in patterns.get(_key, ()):
+				_targets = _p.targets()
+				if _targets is None:
+					_open.add(_rule.index)
+					continue
+				for _target in _targets:
+					if normalizer.normalize(_target) != _target:
+						# e.g. "，": removed from every recognition text
+						_results[(_rule.index, _key, _target)] = "impossible"
+						continue
+					_found = [_capturing[_s] + (_s,) for _s in _substrings(_target) if _s in _capturing]
+					if _found:
+						_by, _by_key, _by_pos, _literal = min(_found, key=lambda _item: _item[2])
+						_results[(_rule.index, _key, _target)] = (_by, _by_key, _literal)
+					else:
+						_results[(_rule.index, _key, _target)] = None
+		if _rule.stop and _rule.call is None and _rule.when is not None:
+			# any of its literals in a text stops the check here
+			for _key in _rule.when:
+				for _p in patterns.get(_key, ()):
+					if _p.kind == "literal":
+						for _literal in _p.literals:
+							_capturing.setdefault(_literal, (_rule, _key, _pos))
+	return _results, _open
+
+
+# ##################################################
+# Analysis
+# ##################################################
+class Report(object):
+	def __init__(self, groups, check_rules, states=None, normalizer=None):
+		self.normalizer = normalizer or normalize.get_normalizer()
+		self.table = rules.RuleTable(check_rules, keys=[f"{_group}.{_word}" for _group, _words in groups.items() for _word in _words])
+		self.states = tuple(states) if states else (None,)
+		self.patterns = keyword_patterns(groups, self.normalizer)
+		self.groups = groups
+		self.paths = rule_paths(self.table, self.states)
+		self._check()
+
+	def _check(self):
+		_by_rule = collections.defaultdict(list) # rule index -> [(results, open)] of the paths it is on
+		for _label, _path in self.paths:
+			_results, _open = check_path(_path, self.patterns, self.normalizer)
+			for _rule in _path:
+				_by_rule[_rule.index].append((
+					{(_key, _target): _r for (_index, _key, _target), _r in _results.items() if _index == _rule.index},
+					_rule.index in _open,
+				))
+		self.unreachable = [] # rules on no path
+		self.dead = [] # (rule, reason)
+		self.captured = collections.defaultdict(list) # (rule, key, capturing rule name, its key) -> [(target, literal)]
+		self.impossible = collections.defaultdict(list) # key -> [target]
+		for _rule in self.table.rules:
+			_on = _by_rule.get(_rule.index)
+			if not _on:
+				self.unreachable.append(_rule)
+				continue
+			if _rule.when is None:
+				continue
+			# a target is captured only when it is captured (or impossible) on every path
+			_seen = collections.defaultdict(list)
+			for _results, _o in _on:
+				for _item, _r in _results.items():
+					_seen[_item].append(_r)
+			_targets = {}
+			for _item, _rs in _seen.items():
+				if None in _rs:
+					_targets[_item] = None
+				else:
+					_targets[_item] = next((_r for _r in _rs if _r != "impossible"), "impossible")
+			for (_key, _target), _r in _targets.items():
+				if _r == "impossible":
+					if _target not in self.impossible[_key]:
+						self.impossible[_key].append(_target)
+				elif _r is not None:
+					self.captured[(_rule, _key, _r[0].name, _r[1])].append((_target, _r[2]))
+			if any(_o for _results, _o in _on) or any(_r is None for _r in _targets.values()):
+				continue
+			if any(_r not in (None, "impossible") for _r in _targets.values()):
+				self.dead.append((_rule, "shadowed"))
+			else:
+				self.dead.append((_rule, "disabled"))
+		_used = self.table.keys
+		self.unused = [_key for _key in self.patterns if _key not in _used]
+		self.always = [_p for _ps in self.patterns.values() for _p in _ps if _p.kind == "always"]
+
+	@property
+	def shadowed(self):
+		return [_rule for _rule, _reason in self.dead if _reason == "shadowed"]
+
+	# ##################################################
+	# matching cost
+	# ##################################################
+	def corpus(self, size=_corpus_size, seed=1):
+		# utterances made of 1-4 words of the table (and a few words hitting nothing)
+		_words = sorted({_literal for _ps in self.patterns.values() for _p in _ps if _p.kind == "literal" for _literal in _p.literals})
+		_words += list(_fillers)
+		_random = random.Random(seed)
+		return [self.normalizer.normalize("".join(_random.choice(_words) for _ in range(_random.randint(1, 4)))) for _ in range(size)]
+
+	def costs(self, texts, repeat=3):
+		# [(Pattern, regex calls per text, microseconds per text)] of the patterns which are regexes.
+		# literal patterns cost nothing on their own: all of them are found in the one automaton scan
+		_costs = []
+		for _ps in self.patterns.values():
+			for _p in _ps:
+				if _p.kind == "gated":
+					_reobj = re.compile(_p.pattern)
+					_calls = [(_text, _i) for _text in texts for _prefix in _p.prefixes for _i in _find_all(_text, _prefix)]
+					def run(calls=_calls, reobj=_reobj):
+						for _text, _i in calls:
+							reobj.match(_text, _i)
+					_count = len(_calls)
+				elif _p.kind == "regex":
+					try:
+						_reobj = re.compile(_p.pattern)
+					except re.error:
+						continue
+					def run(reobj=_reobj):
+						for _text in texts:
+							reobj.search(_text)
+					_count = len(texts)
+				else:
+					continue
+				_best = None
+				for _ in range(repeat):
+					_start = time.perf_counter_ns()
+					run()
+					_elapsed = time.perf_counter_ns() - _start
+					_best = _elapsed if _best is None else min(_best, _elapsed)
+				_costs.append((_p, _count / len(texts), _best / len(texts) / 1000))
+		_costs.sort(key=lambda _item: -_item[2])
+		return _costs
+
+	def scan_cost(self, texts, repeat=3):
+		# microseconds per text of a whole KeywordMatcher scan
+		_matcher = matcher.KeywordMatcher(self.groups, self.normalizer, keys=self.table.keys)
+		_best = None
+		for _ in range(repeat):
+			_start = time.perf_counter_ns()
+			for _text in texts:
+				_matcher.search_keys(_text)
+			_elapsed = time.perf_counter_ns() - _start
+			_best = _elapsed if _best is None else min(_best, _elapsed)
+		return _best / len(texts) / 1000
+
+	# ##################################################
+	# output
+	# ##################################################
+	def show(self, verbose=False, cost=True, file=None):
+		_out = file or sys.stdout
+		def say(*args):
+			print(*args, file=_out)
+		_literal_count = sum(len(_p.literals) for _ps in self.patterns.values() for _p in _ps if _p.kind == "literal")
+		_kinds = collections.Counter(_p.kind for _ps in self.patterns.values() for _p in _ps)
+		_states = "" if self.states == (None,) else f" (states {', '.join(map(str, self.states))}, {len(self.paths)} paths)"
+		say(f"rules    : {len(self.table.rules)}{_states}")
+		say(f"keywords : {len(self.patterns)} words, {sum(_kinds.values())} patterns "
+			f"(literal={_kinds['literal']} -> {_literal_count} literals, gated regex={_kinds['gated']}, regex={_kinds['regex']}, always={_kinds['always']})")
+		say("")
+		say(f"rules which never fire: {len(self.unreachable) + len(self.dead)}")
+		for _rule in self.unreachable:
+			say(f"  {_rule.name}: not tried in any state (e.g. after a rule which always stops)")
+		for _rule, _reason in self.dead:
+			if _reason == "shadowed":
+				say(f"  {_rule.name}: every word is captured by an earlier rule")
+			else:
+				say(f"  {_rule.name}: no word can appear in a recognition text")
+		say("")
+		say(f"words captured by an earlier rule: {sum(len(_v) for _v in self.captured.values())}")
+		for (_rule, _key, _by, _by_key), _items in self.captured.items():
+			_total = sum(len(_p.targets()) for _p in self.patterns[_key] if _p.targets() is not None)
+			_shown = _items if verbose else _items[:3]
+			_examples = ", ".join(f"'{_target}' ⊃ '{_literal}'" for _target, _literal in _shown)
+			if len(_shown) < len(_items):
+				_examples += f", ... (+{len(_items) - len(_shown)})"
+			say(f"  {_rule.name} {_key} <- {_by} {_by_key}: {len(_items)}/{_total} ({_examples})")
+		if self.always:
+			say("")
+			say(f"patterns which hit every text: {len(self.always)}")
+			for _p in self.always:
+				say(f"  {_p.key}: {_p.pattern!r}")
+		if self.impossible:
+			say("")
+			say(f"words which can't appear in a recognition text: {sum(len(_v) for _v in self.impossible.values())}")
+			for _key, _targets in self.impossible.items():
+				say(f"  {_key}: {', '.join(repr(_t) for _t in _targets)}")
+		if self.unused:
+			say("")
+			say(f"words no rule looks at: {len(self.unused)}")
+			say("  " + ", ".join(self.unused))
+		if not cost:
+			return
+		_texts = self.corpus()
+		_costs = self.costs(_texts)
+		say("")
+		say(f"matching cost ({len(_texts)} texts made of the words, avg {sum(map(len, _texts)) / len(_texts):.1f} chars): "
+			f"{self.scan_cost(_texts):.2f} us/text for the whole scan, literal patterns share its automaton pass")
+		say(f"  {'word':<24}{'kind':<7}{'calls':>7}{'us/text':>9}  pattern")
+		for _p, _calls, _us in (_costs if verbose else _costs[:15]):
+			say(f"  {_p.key:<24}{_p.kind:<7}{_calls:>7.2f}{_us:>9.3f}  {_p.pattern}")
+		if not verbose and len(_costs) > 15:
+			say(f"  ... (+{len(_costs) - 15}, --verbose to show all)")
+
+def _find_all(text, literal):
+	# start positions of the literal in the text
+	_i = text.find(literal)
+	while _i >= 0:
+		yield _i
+		_i = text.find(literal, _i + 1)
+
+
+# ##################################################
+# Loading
+# ##################################################
+def load_module(path, name):
+	spec = importlib.util.spec_from_file_location(name, path)
+	module = importlib.util.module_from_spec(spec)
+	sys.modules[name] = module
+	spec.loader.exec_module(module)
+	return module
+
+def load_grammar(path, params_path=None):
+	# the grammar module, with the params module given (or its own one)
+	_messages = io.StringIO()
+	with contextlib.redirect_stdout(_messages):
+		_grammar = load_module(path, "analyzer_grammar")
+	if params_path is None and not _params_loaded(_grammar) and hasattr(_grammar, "params_path"):
+		# the grammar loads its params relative to the working directory: try next to the grammar
+		_guess = os.path.join(os.path.dirname(os.path.abspath(path)), ntpath.basename(_grammar.params_path))
+		if os.path.isfile(_guess):
+			params_path = _guess
+	if params_path is not None:
+		_grammar.params = load_module(params_path, "analyzer_params")
+	elif not _params_loaded(_grammar):
+		print(_messages.getvalue(), end="")
+	return _grammar
+
+def _params_loaded(grammar):
+	# True also for a grammar which keeps its keywords in itself (no params module)
+	if not hasattr(grammar, "params_path") and not hasattr(grammar, "params"):
+		return True
+	_params = getattr(grammar, "params", None)
+	return _params is not None and os.path.isfile(getattr(_params, "__file__", None) or "")
+
+def duplicate_keys(path, name):
+	# [(key, line numbers)] of a dict literal assigned to `name` in the source: the earlier entries are lost
+	with open(path, "rt", encoding="utf-8") as f:
+		_tree = ast.parse(f.read())
+	_duplicates = []
+	for _node in ast.walk(_tree):
+		if not (isinstance(_node, ast.Assign) and isinstance(_node.value, ast.Dict)):
+			continue
+		if not any(isinstance(_target, ast.Name) and _target.id == name for _target in _node.targets):
+			continue
+		_lines = collections.defaultdict(list)
+		for _key in _node.value.keys:
+			if isinstance(_key, ast.Constant):
+				_lines[_key.value].append(_key.lineno)
+		_duplicates.extend((_key, _l) for _key, _l in _lines.items() if len(_l) > 1)
+	return _duplicates
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m sr2ctrl.analyzer", description="keyword table analyzer")
+	parser.add_argument("--grammar", default=os.path.join(os.path.dirname(__file__), "grammar", "ReadyOrNot.py"), help="grammar module")
+	parser.add_argument("--params", default=None, help="params module instead of the one of the grammar")
+	parser.add_argument("--table", default=None, help="a command table of the grammar ({name: {\"words\": ...}}) instead of its check rules")
+	parser.add_argument("--no-cost", action="store_true", help="skip the matching cost")
+	parser.add_argument("--verbose", action="store_true", help="every captured word and every regex pattern")
+	args = parser.parse_args(argv)
+	_start = time.perf_counter()
+	_grammar = load_grammar(args.grammar, args.params)
+	print(f"grammar  : {args.grammar}")
+	if args.table is not None:
+		_commands = getattr(_grammar, args.table)
+		_groups, _rules = rules.command_rules(_commands)
+		_states = None
+		print(f"table    : {args.table} ({len(_commands)} commands, the first one hit is the order)")
+		_duplicates = duplicate_keys(args.grammar, args.table)
+		_empty = [_name for _name, _spec in _commands.items() if not _spec.get("words")]
+	else:
+		if not _params_loaded(_grammar):
+			print("ERROR: params module not loaded! (give --params)")
+			return 2
+		_groups = _grammar.keyword_groups()
+		_rules = _grammar.check_rules
+		_states = getattr(_grammar, "check_states", None)
+		if hasattr(_grammar, "params"):
+			print(f"params   : {_grammar.params.__file__}")
+		_duplicates = []
+		_empty = []
+	_report = Report(_groups, _rules, _states)
+	_report.show(verbose=args.verbose, cost=not args.no_cost)
+	if _duplicates:
+		print("")
+		print(f"commands defined twice (only the last one is used): {len(_duplicates)}")
+		for _key, _lines in _duplicates:
+			print(f"  {_key}: lines {', '.join(map(str, _lines))}")
+	if _empty:
+		print("")
+		print(f"commands without words: {len(_empty)}")
+		print("  " + ", ".join(_empty))
+	print("")
+	print(f"analyzed in {(time.perf_counter() - _start) * 1000:.0f} ms")
+	return 1 if _report.shadowed or _duplicates else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
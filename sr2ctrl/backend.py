@@ -0,0 +1,229 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# Input backends. send the key events of the key scheduler to the system (or keep them).
+#
+# a backend has inject(kind, key, is_mouse), called on the injection thread:
+#   kind:     keysched.TAP, PRESS or RELEASE
+#   key:      a hotkey of the keyboard module ("f1", "shift+f1") or a mouse button ("left", "right", "x")
+#   is_mouse: True for a mouse button
+# and close() and get_stats().
+# resolve(key, is_mouse) turns a key into what inject() of the backend takes fastest (e.g. scan codes):
+# a grammar resolves its key bindings once when it compiles its key plans. inject() still takes key names.
+# resolve() raises ValueError for a key the backend doesn't know.
+#
+#   keyboard: the keyboard and mouse modules. the default
+#   uinput:   a virtual keyboard and mouse of the Linux kernel (/dev/uinput). needs python-evdev
+#   record:   keeps the events and their time in a preallocated array. nothing is injected
+#   null:     drops the events
+# with record or null, the whole pipeline from the receiver to the injection runs headless (benchmarks).
+#
+import time
+import array
+
+from sr2ctrl import keysched
+
+names = ("keyboard", "uinput", "record", "null")
+
+
+def get_backend(name, **options):
+	# the backend of a name in `names`. options go to its constructor
+	match name:
+		case "keyboard":
+			return KeyboardBackend(**options)
+		case "uinput":
+			return UinputBackend(**options)
+		case "record":
+			return RecordingBackend(**options)
+		case "null":
+			return NullBackend(**options)
+	raise ValueError(f"invalid input backend('{name}') given! (use one of {', '.join(names)})")
+
+
+# ##################################################
+# keyboard / mouse modules
+# ##################################################
+class KeyboardBackend(object):
+	def __init__(self):
+		import keyboard
+		import mouse
+		self._keyboard = keyboard
+		# the os layer of the keyboard module, which presses a scan code as it is
+		self._os_keyboard = keyboard._os_keyboard
+		self._mouse = mouse
+		self._buttons = (mouse.LEFT, mouse.RIGHT, mouse.MIDDLE, mouse.X, mouse.X2)
+		self._events = 0
+
+	def resolve(self, key, is_mouse):
+		# a hotkey is parsed into its steps of scan code alternatives, which inject() presses as they are.
+		# not through keyboard.send(): it takes a parsed hotkey of one step for a single key ("shift+f1" -> shift)
+		if is_mouse:
+			if key not in self._buttons:
+				raise ValueError(f"unknown mouse button '{key}'")
+			return key
+		return self._keyboard.parse_hotkey(key)
+
+	def inject(self, kind, key, is_mouse):
+		self._events += 1
+		if is_mouse:
+			match kind:
+				case keysched.PRESS:
+					self._mouse.press(button=key)
+				case keysched.RELEASE:
+					self._mouse.release(button=key)
+				case _:
+					self._mouse.click(button=key)
+		elif isinstance(key, str):
+			self._keyboard.send(hotkey=key, do_press=kind != keysched.RELEASE, do_release=kind != keysched.PRESS)
+		else:
+			self._send_steps(key, kind != keysched.RELEASE, kind != keysched.PRESS)
+
+	def _send_steps(self, steps, do_press, do_release):
+		# keyboard.send() of a parsed hotkey: each step is pressed, then released in the opposite order
+		self._keyboard._listener.is_replaying = True
+		try:
+			for _step in steps:
+				if do_press:
+					for _codes in _step:
+						self._os_keyboard.press(_codes[0])
+				if do_release:
+					for _codes in reversed(_step):
+						self._os_keyboard.release(_codes[0])
+		finally:
+			self._keyboard._listener.is_replaying = False
+
+	def close(self):
+		pass
+
+	def get_stats(self):
+		return {"backend": "keyboard", "events": self._events}
+
+
+# ##################################################
+# Linux uinput
+# ##################################################
+# key names of the keyboard module which are not "KEY_" + the name in upper case (spaces dropped)
+_uinput_aliases = {
+	"ctrl": "LEFTCTRL", "left ctrl": "LEFTCTRL", "right ctrl": "RIGHTCTRL",
+	"shift": "LEFTSHIFT", "left shift": "LEFTSHIFT", "right shift": "RIGHTSHIFT",
+	"alt": "LEFTALT", "left alt": "LEFTALT", "right alt": "RIGHTALT", "alt gr": "RIGHTALT",
+	"windows": "LEFTMETA", "left windows": "LEFTMETA", "right windows": "RIGHTMETA",
+	"escape": "ESC", "return": "ENTER", "del": "DELETE", "ins": "INSERT",
+	"-": "MINUS", "=": "EQUAL", "[": "LEFTBRACE", "]": "RIGHTBRACE", ";": "SEMICOLON", "'": "APOSTROPHE",
+	"`": "GRAVE", "\\": "BACKSLASH", ",": "COMMA", ".": "DOT", "/": "SLASH", "plus": "KPPLUS",
+}
+_uinput_buttons = {"left": "BTN_LEFT", "right": "BTN_RIGHT", "middle": "BTN_MIDDLE", "x": "BTN_SIDE", "x2": "BTN_EXTRA"}
+
+
+class UinputBackend(object):
+	def __init__(self, name="SR2Control"):
+		try:
+			import evdev
+		except ImportError:
+			raise RuntimeError("uinput input backend needs python-evdev! (pip install evdev)")
+		self._ecodes = evdev.ecodes
+		_keys = [_code for _name, _code in evdev.ecodes.ecodes.items()
+				 if _name.startswith("KEY_") and _code < evdev.ecodes.KEY_MAX and _name not in ("KEY_MAX", "KEY_CNT")]
+		_buttons = [evdev.ecodes.ecodes[_button] for _button in _uinput_buttons.values()]
+		# relative axes make it a mouse for the desktop, so that its buttons are taken as clicks
+		self._device = evdev.UInput(
+			{evdev.ecodes.EV_KEY: sorted(set(_keys + _buttons)), evdev.ecodes.EV_REL: [evdev.ecodes.REL_X, evdev.ecodes.REL_Y]},
+			name=name,
+		)
+		self._codes = {} # (key, is_mouse) -> key codes, in press order
+		self._events = 0
+
+	def resolve(self, key, is_mouse):
+		# the key codes, in press order
+		_codes = self._codes.get((key, is_mouse))
+		if _codes is None:
+			if is_mouse:
+				_names = [_uinput_buttons.get(key)]
+			else:
+				_names = ["KEY_" + _uinput_aliases.get(_part, _part.upper().replace(" ", "")) for _part in key.lower().split("+")]
+			if None in _names or any(_name not in self._ecodes.ecodes for _name in _names):
+				raise ValueError(f"unknown key '{key}' for uinput")
+			_codes = tuple(self._ecodes.ecodes[_name] for _name in _names)
+			self._codes[(key, is_mouse)] = _codes
+		return _codes
+
+	def inject(self, kind, key, is_mouse):
+		self._events += 1
+		_codes = self.resolve(key, is_mouse) if isinstance(key, str) else key
+		if kind != keysched.RELEASE:
+			for _code in _codes:
+				self._device.write(self._ecodes.EV_KEY, _code, 1)
+			self._device.syn()
+		if kind != keysched.PRESS:
+			for _code in reversed(_codes):
+				self._device.write(self._ecodes.EV_KEY, _code, 0)
+			self._device.syn()
+
+	def close(self):
+		self._device.close()
+
+	def get_stats(self):
+		return {"backend": "uinput", "events": self._events}
+
+
+# ##################################################
+# Recording
+# ##################################################
+class RecordingBackend(object):
+	def __init__(self, capacity=65536):
+		# the arrays are allocated once: recording an event costs no allocation.
+		# events after `capacity` are counted as dropped
+		self.capacity = capacity
+		self._times = array.array("q", bytes(8 * capacity)) # perf_counter_ns of each event
+		self._events = [None] * capacity # (kind, key, is_mouse) of each event
+		self.count = 0
+		self.dropped = 0
+
+	def resolve(self, key, is_mouse):
+		# the key names are recorded
+		return key
+
+	def inject(self, kind, key, is_mouse):
+		_i = self.count
+		if _i >= self.capacity:
+			self.dropped += 1
+			return
+		self._times[_i] = time.perf_counter_ns()
+		self._events[_i] = (kind, key, is_mouse)
+		self.count = _i + 1
+
+	def events(self, start=0):
+		# [(perf_counter_ns, kind, key, is_mouse), ...] recorded from the index `start`
+		return [(self._times[_i], *self._events[_i]) for _i in range(start, self.count)]
+
+	def clear(self):
+		self.count = 0
+		self.dropped = 0
+
+	def close(self):
+		pass
+
+	def get_stats(self):
+		return {"backend": "record", "events": self.count, "dropped": self.dropped}
+
+
+# ##################################################
+# Null
+# ##################################################
+class NullBackend(object):
+	def __init__(self):
+		self._events = 0
+
+	def resolve(self, key, is_mouse):
+		return key
+
+	def inject(self, kind, key, is_mouse):
+		self._events += 1
+
+	def close(self):
+		pass
+
+	def get_stats(self):
+		return {"backend": "null", "events": self._events}
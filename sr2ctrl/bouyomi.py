@@ -0,0 +1,121 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+import struct
+import collections
+
+# bouyomi-chan TCP command layout (little endian)
+#   int16 command, int16 speed, int16 tone, int16 volume, int16 voice,
+#   int8 encoding, int32 length, then `length` bytes of text
+CMD_TALK = 0x0001
+# commands without any following field
+CMD_NO_BODY = (
+	0x0010, # pause
+	0x0020, # resume
+	0x0030, # skip
+	0x0040, # clear
+	0x0110, # get pause state
+	0x0120, # get now playing state
+	0x0130, # get remaining task count
+)
+_command_struct = struct.Struct("<h")
+_talk_struct = struct.Struct("<hhhhbi") # speed, tone, volume, voice, encoding, length
+_encodings = {0: "utf-8", 1: "utf-16-le", 2: "cp932"}
+_max_length = 1 << 20
+
+BouyomiTalk = collections.namedtuple("BouyomiTalk", ("speed", "tone", "volume", "voice", "encoding", "text"))
+
+
+class BouyomiError(ValueError):
+	pass
+
+
+# ##################################################
+# Streaming parser. feed it with every chunk received on a connection.
+# ##################################################
+class BouyomiParser(object):
+	_header_size = _command_struct.size + _talk_struct.size
+
+	def __init__(self):
+		self._header = bytearray(self._header_size)
+		self._header_view = memoryview(self._header)
+		self._header_filled = 0
+		self._fields = None # unpacked talk header while collecting its payload
+		self._payload = None
+		self._payload_view = None
+		self._payload_filled = 0
+
+	def is_idle(self):
+		# True when no command is partially received
+		return self._header_filled == 0 and self._fields is None
+
+	def feed(self, data):
+		# returns the list of commands completed by this chunk.
+		# each item is a BouyomiTalk, or the command number for a non-talk command
+		_done = []
+		_view = memoryview(data)
+		_pos = 0
+		_end = len(_view)
+		while _pos < _end:
+			if self._fields is None:
+				_pos = self._read_header(_view, _pos, _end, _done)
+			else:
+				_pos = self._read_payload(_view, _pos, _end, _done)
+		return _done
+
+	def _read_header(self, view, pos, end, done):
+		# the command field decides how much header follows
+		_need = _command_struct.size if self._header_filled < _command_struct.size else self._header_size
+		_n = min(_need - self._header_filled, end - pos)
+		self._header_view[self._header_filled:self._header_filled + _n] = view[pos:pos + _n]
+		self._header_filled += _n
+		pos += _n
+		if self._header_filled < _need:
+			return pos
+		(_command,) = _command_struct.unpack_from(self._header_view, 0)
+		if _need == _command_struct.size:
+			if _command in CMD_NO_BODY:
+				# skip non-talk commands before anything is decoded
+				self._header_filled = 0
+				done.append(_command)
+			elif _command != CMD_TALK:
+				raise BouyomiError(f"unknown bouyomi command({_command:#06x})")
+			return pos
+		_speed, _tone, _volume, _voice, _encoding, _length = _talk_struct.unpack_from(self._header_view, _command_struct.size)
+		if _encoding not in _encodings:
+			raise BouyomiError(f"unknown bouyomi text encoding({_encoding})")
+		if not (0 <= _length <= _max_length):
+			raise BouyomiError(f"invalid bouyomi text length({_length})")
+		self._header_filled = 0
+		self._fields = (_speed, _tone, _volume, _voice, _encoding, _length)
+		self._payload_filled = 0
+		if _length == 0:
+			self._complete(b"", done)
+		elif end - pos >= _length:
+			# whole text in this chunk: decode straight from the received buffer
+			self._complete(view[pos:pos + _length], done)
+			pos += _length
+		else:
+			self._payload = bytearray(_length)
+			self._payload_view = memoryview(self._payload)
+		return pos
+
+	def _read_payload(self, view, pos, end, done):
+		_length = self._fields[5]
+		_n = min(_length - self._payload_filled, end - pos)
+		self._payload_view[self._payload_filled:self._payload_filled + _n] = view[pos:pos + _n]
+		self._payload_filled += _n
+		pos += _n
+		if self._payload_filled == _length:
+			self._complete(self._payload_view, done)
+			self._payload = None
+			self._payload_view = None
+		return pos
+
+	def _complete(self, payload, done):
+		_speed, _tone, _volume, _voice, _encoding, _length = self._fields
+		self._fields = None
+		_text = str(payload, _encodings[_encoding], "replace")
+		done.append(BouyomiTalk(_speed, _tone, _volume, _voice, _encoding, _text))
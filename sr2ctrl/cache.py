@@ -0,0 +1,53 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# LRU cache. keeps the most recently used entries up to a fixed size.
+# grammars use it to remember the order of a recognition text (players repeat the same few phrases).
+#
+import collections
+
+
+class LRUCache(object):
+	def __init__(self, size=256):
+		# size: max number of entries. 0 disables the cache
+		if size < 0:
+			raise ValueError(f"invalid cache size({size}) given!")
+		self._size = size
+		self._entries = collections.OrderedDict()
+		# counters
+		self._hits = 0
+		self._misses = 0
+		self._evictions = 0
+
+	def get(self, key):
+		# the value of the key, or None
+		_value = self._entries.get(key)
+		if _value is None:
+			self._misses += 1
+			return None
+		self._entries.move_to_end(key)
+		self._hits += 1
+		return _value
+
+	def put(self, key, value):
+		if self._size == 0:
+			return
+		self._entries[key] = value
+		self._entries.move_to_end(key)
+		if len(self._entries) > self._size:
+			self._entries.popitem(last=False)
+			self._evictions += 1
+
+	def clear(self):
+		self._entries.clear()
+
+	def get_stats(self):
+		return {
+			"size": self._size,
+			"entries": len(self._entries),
+			"hits": self._hits,
+			"misses": self._misses,
+			"evictions": self._evictions,
+		}
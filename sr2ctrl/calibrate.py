@@ -0,0 +1,262 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# Timing calibration. finds the smallest interval after each key of a grammar which still delivers every key
+# event, in order, to a capture target, and writes it to the timing profile of the grammar (sr2ctrl/timing.py).
+# run from the repository root:
+#   python -m sr2ctrl.calibrate --grammar sr2ctrl/grammar/ReadyOrNot.py
+#   python -m sr2ctrl.calibrate --grammar sr2ctrl/grammar/ReadyOrNot.py --sequence "cmd_menu cmd_1 cmd_4" --save
+#   python -m sr2ctrl.calibrate --grammar sr2ctrl/grammar/Arma3.py --target simulate --min-gap 0.033
+#
+# a sequence is a command list of the grammar (ReadyOrNot: "cmd_menu cmd_1 cmd_4", Arma3: command names).
+# for each key of the sequences, its interval is lowered by --step from the current one, and every sequence
+# waiting for it is replayed --repeat times. the last interval at which every replay was captured complete
+# and in order is the interval of the key. the keys already calibrated keep their new interval.
+# the grammar needs the timing methods (get_timing, set_timing, timing_sequences, timing_keys, compile_sequence).
+#
+# targets:
+#   keyboard: a child process hooks the keyboard and mouse (keyboard and mouse modules) and reports the events.
+#             the keys are really pushed: focus a window which ignores them (or the game, to see it react)
+#   simulate: takes an event only when it comes at least --min-gap after the last one taken, as a game which
+#             reads the input once per frame. nothing is pushed (a dry run)
+#
+import io
+import sys
+import time
+import queue
+import argparse
+import contextlib
+import importlib.util
+import multiprocessing
+
+from sr2ctrl import keysched
+from sr2ctrl import backend
+from sr2ctrl import timing
+
+
+# ##################################################
+# Capture targets
+# ##################################################
+def _capture_main(events, ready, stop):
+	# the capture process: every key and mouse button event, in order
+	import keyboard
+	import mouse
+	def on_key(event):
+		events.put(("key", event.event_type, event.scan_code))
+	def on_mouse(event):
+		if isinstance(event, mouse.ButtonEvent):
+			# a second click soon after the first one comes as "double"
+			events.put(("mouse", "up" if event.event_type == mouse.UP else "down", event.button))
+	keyboard.hook(on_key)
+	mouse.hook(on_mouse)
+	ready.set()
+	stop.wait()
+	keyboard.unhook_all()
+	mouse.unhook_all()
+
+
+class HookTarget(object):
+	settle = 0.1 # seconds to wait for the last events of a replay
+	rest = 0.1 # seconds between two replays
+
+	def __init__(self):
+		self.backend = backend.KeyboardBackend()
+		self._events = multiprocessing.Queue()
+		self._ready = multiprocessing.Event()
+		self._stop = multiprocessing.Event()
+		self._process = multiprocessing.Process(target=_capture_main, args=(self._events, self._ready, self._stop), daemon=True)
+
+	def start(self, timeout=10):
+		self._process.start()
+		if not self._ready.wait(timeout):
+			raise RuntimeError("capture process not started!")
+
+	def expected(self, timeline):
+		# the events the hooks report for the timeline. keys are parsed hotkeys: steps of scan code alternatives
+		_expected = []
+		for _offset, _kind, _key, _is_mouse in timeline.events:
+			if _is_mouse:
+				if _kind != keysched.RELEASE:
+					_expected.append(("mouse", "down", _key))
+				if _kind != keysched.PRESS:
+					_expected.append(("mouse", "up", _key))
+				continue
+			for _step in _key:
+				if _kind != keysched.RELEASE:
+					_expected += [("key", "down", _codes[0]) for _codes in _step]
+				if _kind != keysched.PRESS:
+					_expected += [("key", "up", _codes[0]) for _codes in reversed(_step)]
+		return _expected
+
+	def captured(self):
+		# the events since the last call
+		_captured = []
+		while True:
+			try:
+				_captured.append(self._events.get_nowait())
+			except queue.Empty:
+				return _captured
+
+	def stop(self):
+		self._stop.set()
+		self._process.join(2)
+
+
+class SimulatedTarget(object):
+	settle = 0.0
+
+	def __init__(self, min_gap=0.016):
+		self.min_gap_ns = int(min_gap * 1e9)
+		self.rest = min_gap
+		self.backend = self # events are "injected" into the target itself
+		self._taken = []
+		self._last = 0
+
+	def start(self):
+		pass
+
+	def resolve(self, key, is_mouse):
+		return key
+
+	def inject(self, kind, key, is_mouse):
+		_now = time.perf_counter_ns()
+		if _now - self._last >= self.min_gap_ns:
+			self._taken.append((kind, key, is_mouse))
+			self._last = _now
+
+	def expected(self, timeline):
+		return [(_kind, _key, _is_mouse) for _offset, _kind, _key, _is_mouse in timeline.events]
+
+	def captured(self):
+		_captured = self._taken
+		self._taken = []
+		return _captured
+
+	def stop(self):
+		pass
+
+	# the rest of the input backend interface
+	def close(self):
+		pass
+
+	def get_stats(self):
+		return {"backend": "simulate", "events": len(self._taken)}
+
+
+# ##################################################
+# Calibration
+# ##################################################
+def replay(owner, scheduler, target, sequence, repeat):
+	# True when every replay of the sequence was captured complete and in order
+	_timeline = owner.compile_sequence(sequence)
+	_expected = target.expected(_timeline)
+	_relevant = set(_expected)
+	for _ in range(repeat):
+		target.captured()
+		scheduler.submit(_timeline)
+		scheduler.wait_idle()
+		time.sleep(target.settle)
+		# events of other keys (e.g. typed by the user) don't count
+		_captured = [_event for _event in target.captured() if _event in _relevant]
+		time.sleep(target.rest)
+		if _captured != _expected:
+			return False
+	return True
+
+def calibrate(owner, scheduler, target, sequences, step=0.005, minimum=0.0, repeat=3):
+	# the timing profile with the smallest interval of each key of the sequences
+	_profile = owner.get_timing().copy()
+	_keys = list(dict.fromkeys(_key for _sequence in sequences for _key in owner.timing_keys(_sequence)))
+	print(f"{'key':<20}{'from ms':>9}{'to ms':>9}")
+	for _key in _keys:
+		_uses = [_sequence for _sequence in sequences if _key in owner.timing_keys(_sequence)]
+		def passes(interval):
+			_trial = _profile.copy()
+			_trial.keys[_key] = interval
+			owner.set_timing(_trial)
+			return all(replay(owner, scheduler, target, _sequence, repeat) for _sequence in _uses)
+		_current = _profile.interval_after(_key)
+		if not passes(_current):
+			print(f"{_key:<20}{_current * 1000:>9.0f}  events lost! kept as it is (give a longer interval)")
+			continue
+		_best = _current
+		_candidate = round(_current - step, 6)
+		while _candidate >= minimum and passes(_candidate):
+			_best = _candidate
+			_candidate = round(_candidate - step, 6)
+		_profile.keys[_key] = _best
+		print(f"{_key:<20}{_current * 1000:>9.0f}{_best * 1000:>9.0f}")
+	owner.set_timing(_profile)
+	return _profile
+
+
+def load_grammar(path, target):
+	spec = importlib.util.spec_from_file_location("calibrate_grammar", path)
+	module = importlib.util.module_from_spec(spec)
+	with contextlib.redirect_stdout(io.StringIO()):
+		spec.loader.exec_module(module)
+		# test mode: the grammar itself pushes nothing. the keys go to the target through its backend
+		_owner = module.SR2C(True, input_backend=target.backend)
+	return _owner
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m sr2ctrl.calibrate", description="key timing calibration")
+	parser.add_argument("--grammar", required=True, help="grammar module")
+	parser.add_argument("--target", choices=["keyboard", "simulate"], default="keyboard", help="capture target")
+	parser.add_argument("--min-gap", type=float, default=0.016, help="seconds between two events the simulated target takes")
+	parser.add_argument("--sequence", action="append", default=None, help="a command list to replay (space separated). repeatable")
+	parser.add_argument("--step", type=float, default=0.005, help="seconds the interval is lowered by")
+	parser.add_argument("--minimum", type=float, default=0.0, help="the smallest interval tried")
+	parser.add_argument("--repeat", type=int, default=3, help="replays of each sequence per interval")
+	parser.add_argument("--save", action="store_true", help="write the result to the timing profile")
+	parser.add_argument("--profile", default=timing.profile_path, help="timing profile file")
+	args = parser.parse_args(argv)
+	timing.profile_path = args.profile
+	if args.target == "keyboard":
+		_target = HookTarget()
+	else:
+		_target = SimulatedTarget(args.min_gap)
+	_owner = load_grammar(args.grammar, _target)
+	for _name in ("get_timing", "set_timing", "timing_sequences", "timing_keys", "compile_sequence"):
+		if not hasattr(_owner, _name):
+			print(f"ERROR: the grammar has no {_name} method! (not calibratable)")
+			return 2
+	_sequences = [tuple(_s.split()) for _s in args.sequence] if args.sequence else list(_owner.timing_sequences())
+	print(f"grammar  : {args.grammar} (profile [{_owner.get_timing().name}] in {args.profile})")
+	print(f"target   : {args.target}")
+	print(f"sequences: {len(_sequences)}")
+	for _sequence in _sequences:
+		print("  " + " ".join(_sequence))
+	if args.target == "keyboard":
+		print("(!) the keys are really pushed. focus a window which ignores them: starting in 5 seconds")
+		time.sleep(5)
+	_scheduler = keysched.KeyScheduler(_target.backend.inject)
+	_target.start()
+	try:
+		_profile = calibrate(_owner, _scheduler, _target, _sequences, step=args.step, minimum=args.minimum, repeat=args.repeat)
+	except KeyboardInterrupt:
+		print("interrupted! nothing saved")
+		return 1
+	finally:
+		_scheduler.stop(timeout=5)
+		_target.stop()
+		_owner.close()
+	_stats = _scheduler.get_stats()
+	print(f"replayed {_stats['timelines']} times, {_stats['events']} events, late {_stats['late']} (drift max {_stats['drift_max_ms']:.2f} ms)")
+	if args.save:
+		timing.save_profile(_profile, args.profile)
+		print(f"saved [{_profile.name}] to {args.profile}")
+	else:
+		print("")
+		print(f"[{_profile.name}]")
+		print(f"interval\t=\t{_profile.interval:g}")
+		for _key, _value in sorted(_profile.keys.items()):
+			print(f"{_key}\t=\t{_value:g}")
+		print("(give --save to write it)")
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,111 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# Compiled cache. keeps the built keyword structures of a grammar (matchers, fuzzy index) on disk,
+# so that the next start reads them with one file read instead of building them again.
+#
+# the cache file is keyed by a sha256 of the grammar and params files (and of the modules which build
+# the structures or shape their input, and the normalizer settings). when any of them changes, the structures are built
+# again and the old file of the grammar is replaced.
+# an object goes into the cache by to_data() (plain data for marshal) and comes out by cls.from_data().
+#
+import os
+import sys
+import marshal
+import hashlib
+
+from sr2ctrl import normalize
+from sr2ctrl import matcher
+from sr2ctrl import rules
+from sr2ctrl import fuzzy
+
+format_version = 1
+# directory of the cache files. None: the user cache directory
+cache_dir = None
+
+
+def default_cache_dir():
+	if sys.platform == "win32":
+		_base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), "AppData", "Local")
+		return os.path.join(_base, "SR2Control", "cache")
+	_base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+	return os.path.join(_base, "sr2control")
+
+def _read(path):
+	try:
+		with open(path, "rb") as f:
+			return f.read()
+	except OSError:
+		# e.g. a module inside the frozen library
+		return b""
+
+
+# ##################################################
+# Store of one grammar
+# ##################################################
+class Store(object):
+	def __init__(self, name, sources, extra=()):
+		# name: prefix of the cache file (the grammar name).
+		# sources: files whose content keys the cache (the grammar and its params).
+		# extra: other values which change the built structures (settings)
+		_hash = hashlib.sha256()
+		_hash.update(repr((format_version, sys.version, tuple(extra))).encode("utf-8"))
+		# the cached patterns are normalized: the fold tables key the cache too
+		for _path in (*sources, normalize.__file__, matcher.__file__, rules.__file__, fuzzy.__file__):
+			_hash.update(_read(_path))
+		self.key = _hash.hexdigest()
+		self.name = name
+		self.dir = cache_dir or default_cache_dir()
+		self.path = os.path.join(self.dir, f"{name}-{self.key[:16]}.bin")
+		self._items = self._load()
+		self._dirty = False
+		# counters
+		self.hits = 0
+		self.builds = 0
+
+	def _load(self):
+		try:
+			with open(self.path, "rb") as f:
+				_data = marshal.loads(f.read())
+		except (OSError, ValueError, EOFError, TypeError):
+			return {}
+		if not isinstance(_data, dict) or _data.get("key") != self.key:
+			return {}
+		return _data["items"]
+
+	def get(self, name, cls, build):
+		# the cached object, or build() it (and keep it for save())
+		_data = self._items.get(name)
+		if _data is not None:
+			try:
+				_obj = cls.from_data(_data)
+				self.hits += 1
+				return _obj
+			except (KeyError, TypeError, ValueError):
+				# broken or from another layout: build again
+				pass
+		_obj = build()
+		self._items[name] = _obj.to_data()
+		self._dirty = True
+		self.builds += 1
+		return _obj
+
+	def save(self):
+		# write the cache file if anything was built. never fails the grammar
+		if not self._dirty:
+			return
+		try:
+			os.makedirs(self.dir, exist_ok=True)
+			_tmp = self.path + ".tmp"
+			with open(_tmp, "wb") as f:
+				f.write(marshal.dumps({"key": self.key, "items": self._items}))
+			os.replace(_tmp, self.path)
+			# the files of older grammar / params versions
+			for _file in os.listdir(self.dir):
+				if _file.startswith(self.name + "-") and _file.endswith(".bin") and os.path.join(self.dir, _file) != self.path:
+					os.remove(os.path.join(self.dir, _file))
+		except OSError as e:
+			print(f"WARNING: compiled cache not saved! ({e})")
+		self._dirty = False
@@ -0,0 +1,362 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+import json
+import time
+import threading
+import collections
+
+from sr2ctrl import latency
+
+
+# ##################################################
+# Work queue. bounded FIFO between the receive engine and the dispatcher.
+# ##################################################
+class WorkQueue(object):
+	overflow_policies = ("drop_oldest", "drop_newest", "coalesce")
+
+	def __init__(self, depth=8, overflow="drop_oldest"):
+		if depth < 1:
+			raise ValueError(f"invalid queue depth({depth}) given!")
+		if overflow not in self.overflow_policies:
+			raise ValueError(f"invalid overflow policy('{overflow}') given!")
+		self._depth = depth
+		self._overflow = overflow
+		self._items = collections.deque()
+		self._cond = threading.Condition()
+		self._closed = False
+		# counters
+		self._enqueued = 0
+		self._dequeued = 0
+		self._dropped = 0
+		self._coalesced = 0
+		self._wait_total = 0.0
+		self._wait_max = 0.0
+
+	def put(self, item, tag=None):
+		# never blocks. returns False when the item was discarded.
+		# tag travels with the item to the dispatcher (the latency trace)
+		with self._cond:
+			return self._put(item, tag)
+
+	def put_many(self, items, tags=None):
+		# enqueue a batch under one lock and one wakeup
+		with self._cond:
+			if tags is None:
+				for _item in items:
+					self._put(_item, None)
+			else:
+				for _item, _tag in zip(items, tags):
+					self._put(_item, _tag)
+
+	def _put(self, item, tag):
+		if self._closed:
+			return False
+		if len(self._items) >= self._depth:
+			match self._overflow:
+				case "drop_oldest":
+					self._items.popleft()
+					self._dropped += 1
+				case "drop_newest":
+					self._dropped += 1
+					return False
+				case "coalesce":
+					# the same item is already waiting: this one is dropped (nothing merged)
+					# otherwise the newest waiting item is superseded by this one
+					if any(_item == item for _item, _t, _tag in self._items):
+						self._dropped += 1
+						return False
+					self._items.pop()
+					self._coalesced += 1
+		self._items.append((item, time.perf_counter(), tag))
+		self._enqueued += 1
+		self._cond.notify()
+		return True
+
+	def replace(self, old_item, new_item):
+		# swap a still waiting item for a newer version of it. returns False when it was already taken
+		with self._cond:
+			for _i in range(len(self._items) - 1, -1, -1):
+				_item, _t, _tag = self._items[_i]
+				if _item == old_item:
+					self._items[_i] = (new_item, _t, _tag)
+					return True
+			return False
+
+	def get(self):
+		# block until an item arrives. returns None after close()
+		_entry = self.get_tagged()
+		return None if _entry is None else _entry[0]
+
+	def get_tagged(self):
+		# same as get(), but returns (item, tag)
+		with self._cond:
+			while not self._items and not self._closed:
+				self._cond.wait()
+			if self._closed:
+				return None
+			_item, _t, _tag = self._items.popleft()
+			_wait = time.perf_counter() - _t
+			self._dequeued += 1
+			self._wait_total += _wait
+			if _wait > self._wait_max:
+				self._wait_max = _wait
+			return (_item, _tag)
+
+	def close(self):
+		# waiting items are discarded, not to inject keys after stop
+		with self._cond:
+			self._closed = True
+			self._items.clear()
+			self._cond.notify_all()
+
+	def get_stats(self):
+		with self._cond:
+			return {
+				"enqueued": self._enqueued,
+				"dispatched": self._dequeued,
+				"dropped": self._dropped,
+				"coalesced": self._coalesced,
+				"waiting": len(self._items),
+				"wait_avg_ms": (self._wait_total / self._dequeued * 1000) if self._dequeued else 0.0,
+				"wait_max_ms": self._wait_max * 1000,
+			}
+
+
+# ##################################################
+# Duplicate filter. suppresses repeated texts and interim versions of one utterance. off by default (dedupe_window = 0)
+# ##################################################
+class DuplicateFilter(object):
+	def __init__(self, work_queue, window=1.0, max_entries=16):
+		self._queue = work_queue
+		self._window = window
+		# recent texts passed to the queue: (text, time)
+		self._recent = collections.deque(maxlen=max_entries)
+		# counters
+		self._duplicates = 0
+		self._interims = 0
+		self._coalesced = 0
+
+	def put_many(self, texts, tags=None):
+		_now = time.monotonic()
+		while self._recent and (_now - self._recent[0][1]) > self._window:
+			self._recent.popleft()
+		if tags is None:
+			tags = (None,) * len(texts)
+		_batch = []
+		_batch_tags = []
+		for _text, _tag in zip(texts, tags):
+			_previous = None
+			for _recent_text, _t in reversed(self._recent):
+				if _recent_text.startswith(_text):
+					# the same text again, or an older (shorter) interim version arrived late
+					_previous = _recent_text
+					break
+				if _text.startswith(_recent_text):
+					# a grown version of a recent text
+					_previous = _recent_text
+					break
+			if _previous is None:
+				_batch.append(_text)
+				_batch_tags.append(_tag)
+			elif _previous == _text:
+				# a repeated order within the window too: shown, not to drop it silently
+				self._duplicates += 1
+				print(f"(!) DEDUP: '{_text}' dropped (repeated within {self._window:g}s)")
+				continue
+			elif _previous.startswith(_text):
+				self._interims += 1
+				print(f"(!) DEDUP: '{_text}' dropped (interim of '{_previous}')")
+				continue
+			elif _previous in _batch:
+				_batch[_batch.index(_previous)] = _text
+				self._coalesced += 1
+			elif self._queue.replace(_previous, _text):
+				self._coalesced += 1
+			else:
+				# the shorter version is already dispatched: the grown one may carry a new order
+				_batch.append(_text)
+				_batch_tags.append(_tag)
+			self._recent.append((_text, _now))
+		self._queue.put_many(_batch, _batch_tags)
+
+	def get_stats(self):
+		return {
+			"duplicates": self._duplicates,
+			"interims": self._interims,
+			"coalesced": self._coalesced,
+		}
+
+
+# ##################################################
+# Json messages. a recognizer may send a json object instead of a plain text:
+#   {"text": recognition text}
+#   {"hypotheses": [{"text": ..., "confidence": 0.0-1.0}, ...]}  n-best results of one utterance
+# with "seq": utterance id and "final": true/false in streaming mode (see StreamGate).
+# ##################################################
+class Hypotheses(tuple):
+	# ranked ((text, confidence), ...) of one utterance, best first. a queue item in n-best mode
+	__slots__ = ()
+
+	@property
+	def best(self):
+		return self[0][0]
+
+def parse_message(message):
+	# (seq or None, final, text or Hypotheses), or None when the message is a plain text
+	if not message.startswith("{"):
+		return None
+	try:
+		_obj = json.loads(message)
+		_seq = _obj.get("seq")
+		if not (_seq is None or isinstance(_seq, (int, str))):
+			return None
+		_final = bool(_obj.get("final", True))
+		if "hypotheses" not in _obj:
+			return (_seq, _final, str(_obj["text"]))
+		_hypotheses = []
+		for _item in _obj["hypotheses"]:
+			if isinstance(_item, str):
+				_hypotheses.append((_item, None))
+			else:
+				_confidence = _item.get("confidence")
+				_hypotheses.append((str(_item["text"]), None if _confidence is None else float(_confidence)))
+		if not _hypotheses:
+			return None
+		if all(_confidence is not None for _text, _confidence in _hypotheses):
+			_hypotheses.sort(key=lambda _item: -_item[1])
+		return (_seq, _final, Hypotheses(_hypotheses))
+	except (ValueError, KeyError, TypeError, AttributeError):
+		return None
+
+
+# ##################################################
+# Stream gate. streaming mode: the recognizer sends partial texts of an utterance while it is spoken.
+# a message is a json object {"seq": utterance id, "final": true/false, "text": recognition text}
+# (or "hypotheses" instead of "text"). items put into the queue are (seq, final, text or Hypotheses).
+# ##################################################
+class StreamGate(object):
+	def __init__(self, work_queue, partials=True, max_utterances=32):
+		# partials: False when the grammar can't take partial texts (they are dropped)
+		self._queue = work_queue
+		self._partials = partials
+		self._lock = threading.Lock()
+		# utterances which are over: seq -> "final" or "committed" (executed on a partial)
+		self._closed = collections.OrderedDict()
+		self._max_utterances = max_utterances
+		# the item of each utterance put last, to supersede it while it is waiting
+		self._waiting = {}
+		# counters
+		self._partial_count = 0
+		self._final_count = 0
+		self._superseded = 0
+		self._suppressed = 0
+		self._committed = 0
+
+	def put_many(self, messages, tags=None):
+		# messages: [(seq, final, text or Hypotheses)]
+		if tags is None:
+			tags = (None,) * len(messages)
+		_batch = []
+		_batch_tags = []
+		with self._lock:
+			for _message, _tag in zip(messages, tags):
+				_seq, _final, _body = _message
+				if _final:
+					self._final_count += 1
+				else:
+					self._partial_count += 1
+				if _seq in self._closed:
+					# the utterance was executed on a partial already, or a partial arrived after the final
+					self._suppressed += 1
+					continue
+				if not (_final or self._partials):
+					continue
+				if _final:
+					self._close(_seq, "final")
+				_previous = self._waiting.pop(_seq, None)
+				if _previous is not None:
+					# a newer version of the utterance supersedes the waiting one
+					if _previous in _batch:
+						_batch[_batch.index(_previous)] = _message
+						self._superseded += 1
+						self._waiting[_seq] = _message
+						continue
+					if self._queue.replace(_previous, _message):
+						self._superseded += 1
+						self._waiting[_seq] = _message
+						continue
+				_batch.append(_message)
+				_batch_tags.append(_tag)
+				self._waiting[_seq] = _message
+		self._queue.put_many(_batch, _batch_tags)
+
+	def take(self, message):
+		# be called by the dispatcher before the grammar gets the message. False when it is too late for it
+		with self._lock:
+			_seq, _final, _body = message
+			if self._waiting.get(_seq) == message:
+				del self._waiting[_seq]
+			return self._closed.get(_seq) != "committed"
+
+	def commit(self, seq):
+		# the grammar executed the order on a partial text: the rest of the utterance is dropped
+		with self._lock:
+			self._close(seq, "committed")
+			self._committed += 1
+
+	def _close(self, seq, reason):
+		self._closed[seq] = reason
+		self._closed.move_to_end(seq)
+		while len(self._closed) > self._max_utterances:
+			self._closed.popitem(last=False)
+
+	def get_stats(self):
+		with self._lock:
+			return {
+				"partials": self._partial_count,
+				"finals": self._final_count,
+				"superseded": self._superseded,
+				"suppressed": self._suppressed,
+				"committed": self._committed,
+			}
+
+
+# ##################################################
+# Dispatcher. runs the grammar on a worker thread.
+# ##################################################
+class Dispatcher(object):
+	def __init__(self, work_queue, handler, on_error=None):
+		self._queue = work_queue
+		self._handler = handler
+		self._on_error = on_error
+		self._thread = None
+
+	def start(self):
+		self._thread = threading.Thread(target=self._run, name="sr2c-dispatcher", daemon=True)
+		self._thread.start()
+
+	def stop(self, timeout=None):
+		self._queue.close()
+		if self._thread is not None:
+			self._thread.join(timeout)
+			self._thread = None
+
+	def _run(self):
+		while True:
+			_entry = self._queue.get_tagged()
+			if _entry is None:
+				break
+			_item, _tag = _entry
+			latency.begin(_tag)
+			try:
+				self._handler(_item)
+			except Exception as e:
+				if self._on_error is None:
+					print(e)
+				else:
+					self._on_error(e)
+			finally:
+				latency.end()
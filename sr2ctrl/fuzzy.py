@@ -0,0 +1,143 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# Fuzzy keyword index. finds keywords which sound like a part of the recognition text.
+#
+# keywords and texts are compared by their reading: katakana is folded to hiragana and the long vowel
+# mark is dropped ("レッド" -> "れっど"). kanji are read with pykakasi when it is installed ("別途" -> "べっと"),
+# otherwise they are compared as they are.
+# a keyword hits when some part of the text is within its edit distance: max_distance, but at most
+# a third of the reading, so that short keywords ("ワン") never hit fuzzily.
+# candidates come from an index of character pairs (neighbours and every second character, so that one edit
+# always leaves a pair of the keyword in the text), then the edit distance is computed for them only.
+# grammars use it as a fallback when the exact matcher found no keyword in the text.
+#
+import collections
+
+from sr2ctrl import matcher
+
+try:
+	import pykakasi
+	_kakasi = pykakasi.kakasi()
+except ImportError: # optional: kanji keep no reading
+	_kakasi = None
+
+# True when kanji are read (readings, and so built indexes, differ)
+kanji_reading = _kakasi is not None
+
+# katakana -> hiragana, long vowel mark dropped
+_reading_table = {_code: chr(_code - 0x60) for _code in range(0x30A1, 0x30F7)}
+_reading_table[ord("ー")] = None
+
+
+def reading(text):
+	# the kana reading of a normalized text
+	if _kakasi is not None and any("一" <= _char <= "鿿" for _char in text):
+		text = "".join(_item["hira"] for _item in _kakasi.convert(text))
+	return text.translate(_reading_table)
+
+def _pairs(text):
+	# "れっど" -> {"れっ", "っど", "れど"}
+	return {text[_i:_i + 2] for _i in range(len(text) - 1)} | {text[_i] + text[_i + 2] for _i in range(len(text) - 2)}
+
+def _has_piece(keyword, allowed, text):
+	# cut into allowed + 1 pieces, a keyword within `allowed` edits of a part of the text
+	# has one of its pieces in the text as it is. a str search, much cheaper than the edit distance
+	_length = len(keyword)
+	_cuts = [_length * _i // (allowed + 1) for _i in range(allowed + 2)]
+	return any(keyword[_cuts[_i]:_cuts[_i + 1]] in text for _i in range(allowed + 1))
+
+def substring_distance(pattern, text):
+	# the smallest edit distance between the pattern and any part of the text
+	_previous = [0] * (len(text) + 1)
+	for _i, _p in enumerate(pattern, 1):
+		_current = [_i]
+		for _j, _t in enumerate(text, 1):
+			_current.append(min(_previous[_j - 1] + (_p != _t), _previous[_j] + 1, _current[_j - 1] + 1))
+		_previous = _current
+	return min(_previous)
+
+
+# ##################################################
+# Fuzzy index
+# ##################################################
+class FuzzyIndex(object):
+	def __init__(self, groups, normalizer=None, max_distance=1, keys=None, max_bucket=32):
+		# groups: the keyword groups of the grammar, as for matcher.KeywordMatcher.
+		# patterns which are not a small set of literals (lookarounds, repeats ...) are not indexed.
+		# max_bucket: the most keywords listed under one character pair, so that a common pair never makes
+		# a long candidate list. a keyword is listed under its other pairs, or under its least common one
+		# when all of them are full (in a large vocabulary, a fuzzy hit through a full pair may be missed)
+		self.max_distance = max_distance
+		self._entries = [] # (key, reading, allowed distance)
+		self._index = collections.defaultdict(list) # character pair -> indexes of self._entries
+		_seen = set()
+		for _group, _words in groups.items():
+			for _word, _patterns in _words.items():
+				_key = f"{_group}.{_word}"
+				if keys is not None and _key not in keys:
+					continue
+				if isinstance(_patterns, str):
+					_patterns = (_patterns,)
+				for _pattern in _patterns:
+					if normalizer is not None:
+						_pattern = normalizer.pattern(_pattern)
+					for _literal in matcher.literals(_pattern) or ():
+						_reading = reading(_literal)
+						_allowed = min(max_distance, len(_reading) // 3)
+						if _allowed == 0 or (_key, _reading) in _seen:
+							continue
+						_seen.add((_key, _reading))
+						_buckets = [self._index[_pair] for _pair in sorted(_pairs(_reading))]
+						_open = [_bucket for _bucket in _buckets if len(_bucket) < max_bucket]
+						for _bucket in _open or [min(_buckets, key=len)]:
+							_bucket.append(len(self._entries))
+						self._entries.append((_key, _reading, _allowed))
+
+	def __len__(self):
+		return len(self._entries)
+
+	def to_data(self):
+		# the built index as plain data (see sr2ctrl/compiled.py)
+		return {"max_distance": self.max_distance, "entries": self._entries, "index": dict(self._index)}
+
+	@classmethod
+	def from_data(cls, data):
+		_index = cls.__new__(cls)
+		_index.max_distance = data["max_distance"]
+		_index._entries = data["entries"]
+		_index._index = collections.defaultdict(list, data["index"])
+		return _index
+
+	def search(self, text):
+		# [(key, score)], best first. score = 1 - distance / length of the keyword reading
+		_reading = reading(text)
+		_candidates = set()
+		for _pair in _pairs(_reading):
+			_candidates.update(self._index.get(_pair, ()))
+		_scores = {}
+		for _index in _candidates:
+			_key, _keyword, _allowed = self._entries[_index]
+			if not _has_piece(_keyword, _allowed, _reading):
+				continue
+			_distance = substring_distance(_keyword, _reading)
+			if _distance > _allowed:
+				continue
+			_score = 1 - _distance / len(_keyword)
+			if _score > _scores.get(_key, 0):
+				_scores[_key] = _score
+		return sorted(_scores.items(), key=lambda _item: -_item[1])
+
+	def search_brute(self, text):
+		# search() without the bigram index. the reference for tests and benchmarks
+		_reading = reading(text)
+		_scores = {}
+		for _key, _keyword, _allowed in self._entries:
+			_distance = substring_distance(_keyword, _reading)
+			if _distance <= _allowed:
+				_score = 1 - _distance / len(_keyword)
+				if _score > _scores.get(_key, 0):
+					_scores[_key] = _score
+		return sorted(_scores.items(), key=lambda _item: -_item[1])
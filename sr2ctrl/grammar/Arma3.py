@@ -36,15 +36,17 @@
 # ０．準備
 # #######################
 # ライブラリ／モジュール読み込み（ここはあまり気にしなくてよいです）
-import os
-import sys
-import time
 import datetime
-import re
-import copy
-import importlib.util
-import keyboard
-import mouse
+from sr2ctrl import normalize
+from sr2ctrl import matcher
+from sr2ctrl import rules
+from sr2ctrl import cache
+from sr2ctrl import fuzzy
+from sr2ctrl import compiled
+from sr2ctrl import latency
+from sr2ctrl import keysched
+from sr2ctrl import backend
+from sr2ctrl import timing
 
 
 # #######################
@@ -62,6 +64,50 @@ import mouse
 
 #変数名
 arma3_commands = {
+	#---メニュー番号---
+	#ユニット選択のワード（"2"など）を含むので、ユニット選択より上に置く（上にあるコマンドが優先される）
+	#コマンドの書き方は、下の"unit_all"の解説を参照
+	"menu_1": { #メニュー１を選択
+		"words": (r"(いち|イチ|[一壱1])(ばん|バン|[番版晩])",),
+		"keys": ("1",),
+	},
+	"menu_2": { #メニュー２を選択
+		"words": (r"[にニ二弐2](ばん|バン|[番版晩])",),
+		"keys": ("2",),
+	},
+	"menu_3": { #メニュー３を選択
+		"words": (r"(さん|サン|[三参3])(ばん|バン|[番版晩])",),
+		"keys": ("3",),
+	},
+	"menu_4": { #メニュー４を選択
+		"words": (r"(よん|ヨン|[よヨ四4夜])(ばん|バン|[番版晩])",),
+		"keys": ("4",), 
+	},
+	"menu_5": { #メニュー５を選択
+		"words": (r"[ごゴ5五御後語](ばん|バン|[番版晩])", "碁盤", "誤(バン|BAN|Ban|ban)",),
+		"keys": ("5",), 
+	},
+	"menu_6": { #メニュー６を選択
+		"words": (r"(ろく|ロク|[六6禄録鹿])(ばん|バン|[番版晩])", ),
+		"keys": ("6",), 
+	},
+	"menu_7": { #メニュー７を選択
+		"words": (r"(なな|ナナ|[七7]|奈々|菜奈|菜々)(ばん|バン|[番版晩])", ),
+		"keys": ("7",), 
+	},
+	"menu_8": { #メニュー８を選択
+		"words": (r"(はち|ハチ|[八8鉢蜂])(ばん|バン|[番版晩])", ),
+		"keys": ("8",), 
+	},
+	"menu_9": { #メニュー９を選択
+		"words": (r"(きゅう|キュウ|[九9急休級旧救宮Qq])(ばん|バン|[番版晩])", "(吸盤|旧盤)",),
+		"keys": ("9",), 
+	},
+	"menu_10": { #メニュー１０（あるいは０）を選択
+		"words": (r"(じゅう|ジュウ|10|ぜろ|ゼロ|ZERO|Zero|zero|[拾十中重獣銃零〇])(ばん|バン|[番版晩])", "(重絆|重盤|重判)",),
+		"keys": ("0",), 
+	},
+
 	#---ユニット選択---
 	#コマンド名
 	#プログラム内で識別できれば何でも好きな名前でよい
@@ -78,141 +124,101 @@ arma3_commands = {
 		),
 		#キー名（押す順に並べる）
 		"keys": ("com_shift", "space",), #同時押しの場合、先に押すキー名の先頭に"com_"をつける
+		#"priority"（省略可、省略時は0）を書くと、キー入力中の優先度の低いコマンドを打ち切って先に実行する
+		#（下の"cmd_stop"などを参照）
 	},
 	"unit_1": { #隊員１を選択
 		"words": (
 			#全て一つの要素にまとめてもよいが、見やすさ／編集しやすさのためにある程度別の要素に分けるのもよいかもしれない
 			r"(わん|ワン)",
-			r"[１1](?![０0])", #英数字は念の為全角半角の両方を入れておく。"10"と区別するために後に"0"が続かないことを明示する
+			r"1(?!0)", #英数字の全角半角は自動で半角に揃えられるので、半角だけ書けばよい。"10"と区別するために後に"0"が続かないことを明示する
 			r"[湾椀碗王]",
 		),
 		"keys": ("f1",),
 	},
 	#以下、行数を節約して表記
 	"unit_2": { #隊員２を選択
-		"words": (r"(つー|ツー|つう)", r"[２2]", r"[通痛]",),
+		"words": (r"(つー|ツー|つう)", "2", r"[通痛]",),
 		"keys": ("f2",),
 	},
 	"unit_3": { #隊員３を選択
-		"words": ("スリ", r"[３3]", r"[摺刷擦]",),
+		"words": ("スリ", "3", r"[摺刷擦]",),
 		"keys": ("f3",),
 	},
 	"unit_4": { #隊員４を選択
-		"words": ("フォ", r"[４4]", "ほう",),
+		"words": ("フォ", "4", "ほう",),
 		"keys": ("f4",),
 	},
 	"unit_5": { #隊員５を選択
-		"words": ("(ファイブ|ファイル)", r"[５5]", r"(ハイブ|背部|廃部)", "入る",),
+		"words": ("(ファイブ|ファイル)", "5", r"(ハイブ|背部|廃部)", "入る",),
 		"keys": ("f5",),
 	},
 	"unit_6": { #隊員６を選択
-		"words": ("シックス", r"[６6]",),
+		"words": ("シックス", "6",),
 		"keys": ("f6",),
 	},
 	"unit_7": { #隊員７を選択
-		"words": ("セブン", r"[７7]", r"(瀬文|世文)",),
+		"words": ("セブン", "7", r"(瀬文|世文)",),
 		"keys": ("f7",),
 	},
 	"unit_8": { #隊員８を選択
-		"words": (r"(エイト|エイ|えい)", r"[８8]", r"(栄都|英都|瑛人)",),
+		"words": (r"(エイト|エイ|えい)", "8", r"(栄都|英都|瑛人)",),
 		"keys": ("f8",),
 	},
 	"unit_9": { #隊員９を選択
-		"words": (r"(ナイン|ない|無い|内|ナイナー)", r"[９9]",),
+		"words": (r"(ナイン|ない|無い|内|ナイナー)", "9",),
 		"keys": ("f9",),
 	},
 	"unit_10": { #隊員１０を選択
-		"words": (r"(テン|てん|[xX点天展転典])", r"(１０|10)"),
+		"words": (r"(テン|てん|[xX点天展転典])", "10"),
 		"keys": ("f10",),
 	},
 
-	#---チーム選択---
-	#編制命令と区別できるようにすること
-	"select_red": { #レッドチームを選択
-		"words": (r"(レッド|レット|赤)(チーム)*?(?!([にへ]*?[割変編]))",),
-		"keys": ("com_shift", "f1",),
-	},
-	"select_green": { #グリーンチームを選択
-		"words": (r"[(グリーン)(クリーン)緑](チーム)*?(?!([にへ]*?[割変編]))",),
-		"keys": ("com_shift", "f2",),
-	},
-	"select_bule": { #ブルーチームを選択
-		"words": (r"[(ブル)(プル)(振るう)青](チーム)*?(?!([にへ]*?[割変編]))",),
-		"keys": ("com_shift", "f3",),
-	},
-	"select_yellow": { #イエローチームを選択
-		"words": (r"[(イエロー)黄](チーム)*?(?!([にへ]*?[割変編]))",),
-		"keys": ("com_shift", "f4",),
-	},
-	"select_white": { #ホワイトチームを選択
-		"words": (r"[(ホワイト)白](チーム)*?(?!([にへ]*?[割変編]))",),
-		"keys": ("com_shift", "f5",),
-	},
-
 	#---チーム割当---
 	#選択命令と区別できるようにすること
-	"select_red": { #レッドチームに編制
+	#「レッドチームに割当」は選択命令の正規表現にもヒットしてしまうため、選択命令より上に置く
+	"assign_red": { #レッドチームに編制
 		"words": (r"(レッド|レット|赤)(チーム)*?([にへ]*?[割変編])",),
 		"keys": ("com_ctrl", "f1",),
 	},
-	"select_green": { #グリーンチームに編制
-		"words": (r"[(グリーン)(クリーン)緑](チーム)*?([にへ]*?[割変編])",),
+	"assign_green": { #グリーンチームに編制
+		"words": (r"(グリーン|クリーン|緑)(チーム)*?([にへ]*?[割変編])",),
 		"keys": ("com_ctrl", "f2",),
 	},
-	"select_bule": { #ブルーチームに編制
-		"words": (r"[(ブル)(プル)(振るう)青](チーム)*?([にへ]*?[割変編])",),
+	"assign_blue": { #ブルーチームに編制
+		"words": (r"(ブル|プル|振るう|青)(チーム)*?([にへ]*?[割変編])",),
 		"keys": ("com_ctrl", "f3",),
 	},
-	"select_yellow": { #イエローチームに編制
-		"words": (r"[(イエロー)黄](チーム)*?([にへ]*?[割変編])",),
+	"assign_yellow": { #イエローチームに編制
+		"words": (r"(イエロー|黄)(チーム)*?([にへ]*?[割変編])",),
 		"keys": ("com_ctrl", "f4",),
 	},
-	"select_white": { #ホワイトチームに編制
-		"words": (r"[(ホワイト)白](チーム)*?([にへ]*?[割変編])",),
+	"assign_white": { #ホワイトチームに編制
+		"words": (r"(ホワイト|白)(チーム)*?([にへ]*?[割変編])",),
 		"keys": ("com_ctrl", "f5",),
 	},
 
-	#---メニュー番号---
-	#ユニット選択と区別できるようにすること
-	"menu_1": { #メニュー１を選択
-		"words": (r"(いち|イチ|[一壱１1])(ばん|バン|[番版晩])",),
-		"keys": ("1",),
-	},
-	"menu_2": { #メニュー２を選択
-		"words": (r"[にニ二弐２2](ばん|バン|[番版晩])",),
-		"keys": ("2",),
-	},
-	"menu_3": { #メニュー３を選択
-		"words": (r"(さん|サン|[三参３3])(ばん|バン|[番版晩])",),
-		"keys": ("3",),
-	},
-	"menu_4": { #メニュー４を選択
-		"words": (r"(よん|ヨン|[よヨ四４4夜])(ばん|バン|[番版晩])",),
-		"keys": ("4",), 
-	},
-	"menu_5": { #メニュー５を選択
-		"words": (r"[ごゴ５5五御後語](ばん|バン|[番版晩])", "碁盤", "誤(バン|BAN|Ban|ban)",),
-		"keys": ("5",), 
-	},
-	"menu_6": { #メニュー６を選択
-		"words": (r"(ろく|ロク|[六６6禄録鹿])(ばん|バン|[番版晩])", ),
-		"keys": ("6",), 
+	#---チーム選択---
+	#編制命令と区別できるようにすること
+	"select_red": { #レッドチームを選択
+		"words": (r"(レッド|レット|赤)(チーム)*?(?!([にへ]*?[割変編]))",),
+		"keys": ("com_shift", "f1",),
 	},
-	"menu_7": { #メニュー７を選択
-		"words": (r"(なな|ナナ|[七７7]|奈々|菜奈|菜々)(ばん|バン|[番版晩])", ),
-		"keys": ("7",), 
+	"select_green": { #グリーンチームを選択
+		"words": (r"(グリーン|クリーン|緑)(チーム)*?(?!([にへ]*?[割変編]))",),
+		"keys": ("com_shift", "f2",),
 	},
-	"menu_8": { #メニュー８を選択
-		"words": (r"(はち|ハチ|[八８8鉢蜂])(ばん|バン|[番版晩])", ),
-		"keys": ("8",), 
+	"select_blue": { #ブルーチームを選択
+		"words": (r"(ブル|プル|振るう|青)(チーム)*?(?!([にへ]*?[割変編]))",),
+		"keys": ("com_shift", "f3",),
 	},
-	"menu_9": { #メニュー９を選択
-		"words": (r"(きゅう|キュウ|[九９9急休級旧救宮ＱｑQq])(ばん|バン|[番版晩])", "(吸盤|旧盤)",),
-		"keys": ("9",), 
+	"select_yellow": { #イエローチームを選択
+		"words": (r"(イエロー|黄)(チーム)*?(?!([にへ]*?[割変編]))",),
+		"keys": ("com_shift", "f4",),
 	},
-	"menu_10": { #メニュー１０（あるいは０）を選択
-		"words": (r"(じゅう|ジュウ|１０|10|ぜろ|ゼロ|ZERO|Zero|zero|[拾十中重獣銃零〇])(ばん|バン|[番版晩])", "(重絆|重盤|重判)",),
-		"keys": ("0",), 
+	"select_white": { #ホワイトチームを選択
+		"words": (r"(ホワイト|白)(チーム)*?(?!([にへ]*?[割変編]))",),
+		"keys": ("com_shift", "f5",),
 	},
 
 	#---チームへの命令---
@@ -221,7 +227,7 @@ arma3_commands = {
 		"keys": ("1", "1",),
 	},
 	"cmd_advance": { #前進
-		"words": (""),
+		"words": (),
 		"keys": ("1", "2",),
 	},
 	"cmd_fallback": { #後退
@@ -239,6 +245,7 @@ arma3_commands = {
 	"cmd_stop": { #停止
 		"words": (),
 		"keys": ("1", "6",),
+		"priority": 1, #急ぎのコマンドなので、入力中のコマンドを打ち切る
 	},
 	"cmd_takecover": { #カバー
 		"words": (),
@@ -255,6 +262,7 @@ arma3_commands = {
 	"cmd_holdfire": { #射撃停止
 		"words": (),
 		"keys": ("3", "2",),
+		"priority": 1,
 	},
 	"cmd_infantryfire": { #射撃
 		"words": (),
@@ -432,37 +440,85 @@ arma3_commands = {
 }
 
 
+# #######################
+# ２．マッピング処理
+# #######################
+# ここでは、上のマッピング定義をプログラムで使いやすい形に変換（コンパイル）しておきます。
+# 変換はgrammarの読み込み時に一度だけ行います。
+# そのため、コマンドを増やしても、認識テキストごとの処理時間はほとんど増えません。
+# コマンドを追加するときは、マッピング定義に要素を一つ足すだけでよく、ここを編集する必要はありません。
+
+# その他の設定値
+order_cache_size = 256	# 同じ認識テキストの判定結果を覚えておく数（0で無効）
+fuzzy_max_distance = 0	# どのワードにもヒットしないとき、読みが似ているワードを探す場合の許容文字数（0で無効）
+push_interval = 0.06	# 複数のキーを続けて押すときの間隔（秒）。キーごとの間隔はsr2ctrl/settings/SR2Control_timing.iniで指定できます
+
+# ---①「ワード」から「コマンド」へ---
+# 全コマンドのワードを一つの照合器（matcher）にまとめ、ヒットしたワードからコマンドを引く対応表を作ります。
+# 一つの認識テキストで複数のコマンドのワードがヒットした場合は、マッピング定義で上にあるコマンドが優先されます。
+# （例えば「2番」は"unit_2"の"2"にもヒットしますが、上にある"menu_2"が選ばれます）
+# ワードが空のコマンドは、どんな言葉にもヒットしません。
+# ワード同士の被りは、次のコマンドで確認できます。
+# 　python -m sr2ctrl.analyzer --grammar sr2ctrl/grammar/Arma3.py
+_command_groups, check_rules = rules.command_rules(arma3_commands)
 
 
 # ##################################################
-# User params. REQUIRED. define keywords.
+# Keyword groups. REQUIRED. the keywords the check rules look at (also read by sr2ctrl/analyzer.py).
 # ##################################################
-params_path = r"sr2ctrl\grammar\ReadyOrNot_params.py"
-# path = os.path.abspath(params_path)
-path = os.path.join(os.getcwd(), params_path)
-name = os.path.basename(params_path).split(".")[0]
-try:
-	spec = importlib.util.spec_from_file_location(name, path)
-	params = importlib.util.module_from_spec(spec)
-	sys.modules[name] = params
-	spec.loader.exec_module(params)
-except Exception as e:
-	print("ERROR: params module import failed!")
-	print(e)
-
-# import sr2ctrl.grammar.ReadyOrNot_params as params
-
-
-
-
-
-
-
+def keyword_groups():
+	# hits are reported as "commands.<command name>", e.g. "commands.unit_1"
+	return _command_groups
+
+
+# ---②「コマンド」から「キー」へ---
+# 各コマンドの"keys"を、実際に押す手順（キープラン）に変換しておきます。
+# 　・"com_"で始まるキー名は、次のキーと同時に押します（例：("com_shift", "f1",) → shift+f1）
+# 　・"mouse_"で始まるキー名は、マウスボタンです（例："mouse_left"）
+# 　・それ以外は、keyboardモジュールのキー名です（GetKeyNameモードで確認できます）
+# キープランは、(同時押しするキー, キー, マウスボタンか) を押す順に並べたものです。
+# 　例：("com_shift", "f1", "2",) → ((("shift",), "f1", False), ((), "2", False))
+def compile_keys(keys):
+	_plan = []
+	_modifiers = []
+	for _name in keys:
+		if _name.startswith("com_"):
+			_modifiers.append(_name[len("com_"):])
+			continue
+		if _name.startswith("mouse_"):
+			_plan.append((tuple(_modifiers), _name[len("mouse_"):], True))
+		else:
+			_plan.append((tuple(_modifiers), _name, False))
+		_modifiers = []
+	if _modifiers:
+		raise ValueError(f"invalid keys {keys} given! (no key to press with {_modifiers})")
+	return tuple(_plan)
 
+# キープランを読みやすい文字列のリストにします（表示用）
+# 　例：((("shift",), "f1", False), ((), "2", False)) → ["shift+f1", "2"]
+def plan_text(plan):
+	return ["+".join(_modifiers + (("mouse_" + _key) if _is_mouse else _key,)) for _modifiers, _key, _is_mouse in plan]
 
+key_plans = {_name: compile_keys(_spec["keys"]) for _name, _spec in arma3_commands.items()}
 
+# キープランの優先度。優先度の高いコマンドは、キー入力中の優先度の低いコマンドの残りのキーを取り消し、
+# 押しっぱなしのキー（同時押しの"com_"キーなど）を離してから、すぐに実行されます。
+key_priorities = {_name: _spec.get("priority", 0) for _name, _spec in arma3_commands.items()}
 
 
+# #######################
+# ３．キー入力実行
+# #######################
+# ここからが、SR2Control本体から呼ばれる部分です。
+# 本体は認識テキストを受け取るたびに、下のSR2Cクラスのon_recognitionメソッドを呼びます。
+# 　_do_check ：認識テキストのワードをmatcherで探し、対応表からコマンドを特定する（①）
+# 　_do_action：コマンドのキープランを取り出し（②）、キーを押す（③）
+# キーは専用のスレッド（sr2ctrl/keysched.py）が予定の時刻に押していくので、on_recognitionはすぐに戻ります。
+# そのため、キーを押している間にも次の認識テキストを受け付けられます。
+# テストモード（-t）では、キーを押す代わりに押すはずのキーを表示します。
+# キーの送り先（入力バックエンド、sr2ctrl/backend.py）は、コンストラクタの引数input_backendで差し替えられます。
+# 省略した場合はkeyboard／mouseモジュールでキーを押します。
+# キープランのキーは、起動時に一度だけ入力バックエンドが扱いやすい形（スキャンコードなど）へ変換しておきます。
 
 
 # ##################################################
@@ -473,301 +529,49 @@ class SR2C:
 	# ##################################################
 	# Constructor. REQUIRED.
 	# ##################################################
-	def __init__(self, test):
+	def __init__(self, test, input_backend=None):
 		# set test mode
 		self._test_mode = test
-
-		# compile re patterns
-		self._reobj_yell = {
-			"base": re.compile(r"|".join(params.kw_yell["base"])),
-		}
-		self._reobj_colors = {
-			"gold": re.compile(r"|".join(params.kw_colors["gold"])),
-			"red": re.compile(r"|".join(params.kw_colors["red"])),
-			"blue": re.compile(r"|".join(params.kw_colors["blue"])),
-		}
-		self._reobj_hold = {
-			"base": re.compile(r"|".join(params.kw_hold["base"])),
-		}
-		self._reobj_trapped = {
-			"base": re.compile(r"|".join(params.kw_door_trapped["base"])),
-		}
-		self._reobj_interact = {
-			"base": re.compile(r"|".join(params.kw_interact["base"])),
-		}
-		self._reobj_execute = {
-			"execute": re.compile(r"|".join(params.kw_execute_cancel["execute"])),
-			"cancel": re.compile(r"|".join(params.kw_execute_cancel["cancel"])),
-		}
-		self._reobj_stackup = {
-			"base": re.compile(r"|".join(params.kw_stack_sides["base"])),
-			"auto": re.compile(r"|".join(params.kw_stack_sides["auto"])),
-			"split": re.compile(r"|".join(params.kw_stack_sides["split"])),
-			"right": re.compile(r"|".join(params.kw_stack_sides["right"])),
-			"left": re.compile(r"|".join(params.kw_stack_sides["left"])),
-		}
-		self._reobj_breach = {
-			"base": re.compile(r"|".join(params.kw_breach_tools["base"])),
-			"open": re.compile(r"|".join(params.kw_breach_tools["open"])),
-			"kick": re.compile(r"|".join(params.kw_breach_tools["kick"])),
-			"shotgun": re.compile(r"|".join(params.kw_breach_tools["shotgun"])),
-			"c2": re.compile(r"|".join(params.kw_breach_tools["c2"])),
-			"ram": re.compile(r"|".join(params.kw_breach_tools["ram"])),
-			"leader": re.compile(r"|".join(params.kw_breach_tools["leader"])),
-		}
-		self._reobj_grenades = {
-			"flash": re.compile(r"|".join(params.kw_grenades["flash"])),
-			"stinger": re.compile(r"|".join(params.kw_grenades["stinger"])),
-			"gas": re.compile(r"|".join(params.kw_grenades["gas"])),
-			"launcher": re.compile(r"|".join(params.kw_grenades["launcher"])),
-			"leader": re.compile(r"|".join(params.kw_grenades["leader"])),
-		}
-		self._reobj_npc = {
-			"base": re.compile(r"|".join(params.kw_npc_movements["base"])),
-			"here": re.compile(r"|".join(params.kw_npc_movements["here"])),
-			"me": re.compile(r"|".join(params.kw_npc_movements["me"])),
-			"stop": re.compile(r"|".join(params.kw_npc_movements["stop"])),
-			"turn": re.compile(r"|".join(params.kw_npc_movements["turn"])),
-			"exit": re.compile(r"|".join(params.kw_npc_movements["exit"])),
-		}
-		self._reobj_formations = {
-			"base": re.compile(r"|".join(params.kw_formations["base"])),
-			"single": re.compile(r"|".join(params.kw_formations["single"])),
-			"double": re.compile(r"|".join(params.kw_formations["double"])),
-			"diamond": re.compile(r"|".join(params.kw_formations["diamond"])),
-			"wedge": re.compile(r"|".join(params.kw_formations["wedge"])),
-		}
-		self._reobj_door = {
-			"mirror": re.compile(r"|".join(params.kw_door_options["mirror"])),
-			"disarm": re.compile(r"|".join(params.kw_door_options["disarm"])),
-			"wedge": re.compile(r"|".join(params.kw_door_options["wedge"])),
-		}
-		self._reobj_door2 = {
-			"base": re.compile(r"|".join(params.kw_door_options2["base"])),
-			"cover": re.compile(r"|".join(params.kw_door_options2["cover"])),
-			"open": re.compile(r"|".join(params.kw_door_options2["open"])),
-			"close": re.compile(r"|".join(params.kw_door_options2["close"])),
-		}
-		self._reobj_picking = {
-			"base": re.compile(r"|".join(params.kw_picking["base"])),
-		}
-		self._reobj_scan = {
-			"pie": re.compile(r"|".join(params.kw_door_scan["pie"])),
-			"slide": re.compile(r"|".join(params.kw_door_scan["slide"])),
-			"peak": re.compile(r"|".join(params.kw_door_scan["peak"])),
-		}
-		self._reobj_ground = {
-			"move": re.compile(r"|".join(params.kw_ground_options["move"])),
-			"cover": re.compile(r"|".join(params.kw_ground_options["cover"])),
-			"halt": re.compile(r"|".join(params.kw_ground_options["halt"])),
-			"resume": re.compile(r"|".join(params.kw_ground_options["resume"])),
-			"search": re.compile(r"|".join(params.kw_ground_options["search"])),
-		}
-		self._reobj_deployables = {
-			"flash": re.compile(r"|".join(params.kw_deployables["flash"])),
-			"stinger": re.compile(r"|".join(params.kw_deployables["stinger"])),
-			"gas": re.compile(r"|".join(params.kw_deployables["gas"])),
-			"chemlight": re.compile(r"|".join(params.kw_deployables["chemlight"])),
-			"shield": re.compile(r"|".join(params.kw_deployables["shield"])),
-		}
-		self._reobj_restrain = {
-			"base": re.compile(r"|".join(params.kw_npc_restrain["base"])),
-		}
-		self._reobj_gadgets = {
-			"taser": re.compile(r"|".join(params.kw_team_gadgets["taser"])),
-			"spray": re.compile(r"|".join(params.kw_team_gadgets["spray"])),
-			"ball": re.compile(r"|".join(params.kw_team_gadgets["ball"])),
-			"beanbag": re.compile(r"|".join(params.kw_team_gadgets["beanbag"])),
-			"melee": re.compile(r"|".join(params.kw_team_gadgets["melee"])),
-		}
-		self._reobj_actions = {
-			"move": re.compile(r"|".join(params.kw_team_actions["move"])),
-			"focus": re.compile(r"|".join(params.kw_team_actions["focus"])),
-			"unfocus": re.compile(r"|".join(params.kw_team_actions["unfocus"])),
-			"swap": re.compile(r"|".join(params.kw_team_actions["swap"])),
-			"search": re.compile(r"|".join(params.kw_team_actions["search"])),
-		}
-		self._reobj_movements = {
-			"there": re.compile(r"|".join(params.kw_team_movements["there"])),
-			"back": re.compile(r"|".join(params.kw_team_movements["back"])),
-		}
-		self._reobj_focus = {
-			"here": re.compile(r"|".join(params.kw_team_focus["here"])),
-			"me": re.compile(r"|".join(params.kw_team_focus["me"])),
-			"door": re.compile(r"|".join(params.kw_team_focus["door"])),
-			"target": re.compile(r"|".join(params.kw_team_focus["target"])),
-			"unfocus": re.compile(r"|".join(params.kw_team_focus["unfocus"])),
-		}
-		self._reobj_default = {
-			"base": re.compile(r"|".join(params.kw_default_order["base"])),
-		}
-		# this is not used so far
-		# self._reobj_members = {
-		# 	"alpha": re.compile(r"|".join(params.kw_team_members["alpha"])),
-		# 	"bravo": re.compile(r"|".join(params.kw_team_members["bravo"])),
-		# 	"charlie": re.compile(r"|".join(params.kw_team_members["charlie"])),
-		# 	"delta": re.compile(r"|".join(params.kw_team_members["delta"])),
-		# }
-
-		# mapping of key name in RoN and keyboard module except for case-difference only pattern
-		# don't edit!
-		self._map_ron_module_keynames = {
-			"None": "",
-			"LeftMouseButton": "mouse_left",
-			"MiddleMouseButton": "mouse_middle",
-			"RightMouseButton": "mouse_right",
-			"ThumbMouseButton": "mouse_x",
-			"ThumbMouseButton2": "mouse_x2",
-			"MouseScrollUp": "",	# unknown mapping
-			"MouseScrollDown": "",	# unknown mapping
-			"Zero": "0",
-			"One": "1",
-			"Two": "2",
-			"Three": "3",
-			"Four": "4",
-			"Five": "5",
-			"Six": "6",
-			"Seven": "7",
-			"Eight": "8",
-			"Nine": "9",
-			"Zero": "0",
-			"NumPadOne": "num 1",
-			"NumPadTwo": "num 2",
-			"NumPadThree": "num 3",
-			"NumPadFour": "num 4",
-			"NumPadFive": "num 5",
-			"NumPadSix": "num 6",
-			"NumPadSeven": "num 7",
-			"NumPadEight": "num 8",
-			"NumPadNine": "num 9",
-			"Divide": "/",
-			"SpaceBar": "space",
-			"LeftShift": "left shift",
-			"LeftControl": "left ctrl",
-			"LeftAlt": "left alt",
-			"RightShift": "right shift",
-			"RightControl": "right ctrl",
-			"RightAlt": "right alt",
-		}
-
-		# map of action name Tacspeak to RoN
-		# don't edit!
-		self._map_sr2c_ron_actionnames = {
-			"gold" : "SelectElementGold",
-			"blue": "SelectElementBlue",
-			"red": "SelectElementRed",
-			"cmd_1": "SwatInputKeyOne",
-			"cmd_2": "SwatInputKeyTwo",
-			"cmd_3": "SwatInputKeyThree",
-			"cmd_4": "SwatInputKeyFour",
-			"cmd_5": "SwatInputKeyFive",
-			"cmd_6": "SwatInputKeySix",
-			"cmd_7": "SwatInputKeySeven",
-			"cmd_8": "SwatInputKeyEight",
-			"cmd_9": "SwatInputKeyNine",
-			"cmd_back": "SwatInputKeyBack",
-			"cmd_hold": "HoldGoCode",
-			"cmd_default": "IssueDefaultCommand",
-			"cmd_menu": "OpenSwatCommand",
-			"interact_and_yell": "Use",	# attention! this action has special post process, need to be placed earlier than "interact" and "yell"
-			"interact": "UseOnly",		# attention! this action has special post process
-			"yell": "Yell",				# attention! this action has special post process
-		}
-
-		# default key bindings, use when failed to set automatically
-		# you can edit
-		self._ingame_key_bindings = {
-			"gold": "f5",
-			"blue": "f6",
-			"red": "f7",
-			"alpha": "f13",
-			"bravo": "f14",
-			"charlie": "f15",
-			"delta": "f16",
-			"cmd_1": "1",
-			"cmd_2": "2",
-			"cmd_3": "3",
-			"cmd_4": "4",
-			"cmd_5": "5",
-			"cmd_6": "6",
-			"cmd_7": "7",
-			"cmd_8": "8",
-			"cmd_9": "9",
-			"cmd_back": "tab",
-			"cmd_hold": "left shift",
-			"cmd_default": "z",
-			"cmd_menu": "mouse_middle",
-			"interact": "f",
-			"yell": "f",
-		}
-
-		# get list of RoN in-game key settings from ini file, and make action-keyname map
-		# edit the path if it's not along with your environment
-		_inifile_name = os.path.expandvars(r"%LOCALAPPDATA%\ReadyOrNot\Saved\Config\WindowsNoEditor\Input.ini")
-		if os.path.isfile(_inifile_name):
-			with open(_inifile_name, "rt", encoding="utf-8") as _inifile:
-				try:
-					_ron_key_bindings = {}
-					_key_setting_pattern = re.compile(r'^ActionMappings=\(ActionName="(\w+)".+Key=(\w+)')
-					for inifile_line in _inifile:
-						_match_result = re.match(_key_setting_pattern, inifile_line)
-						if _match_result:
-							_ron_action_name = _match_result.group(1)
-							_ron_key_name = _match_result.group(2)
-							# convert the specific key names to python module key names
-							if _ron_key_name in self._map_ron_module_keynames:
-								_ron_key_bindings[_ron_action_name] = self._map_ron_module_keynames[_ron_key_name]
-							else:
-								_ron_key_bindings[_ron_action_name] = _ron_key_name.lower()
-
-					# make ingame_key_bindings automatically
-					for tacspeak_action in self._map_sr2c_ron_actionnames.keys():
-						_ron_action = self._map_sr2c_ron_actionnames[tacspeak_action]
-						if _ron_action in _ron_key_bindings:
-							if _ron_action == "Use":	# special case
-								self._ingame_key_bindings["interact"] = copy.deepcopy(_ron_key_bindings[_ron_action])
-								self._ingame_key_bindings["yell"] = copy.deepcopy(_ron_key_bindings[_ron_action])
-							else:
-								self._ingame_key_bindings[tacspeak_action] = copy.deepcopy(_ron_key_bindings[_ron_action])
-						else:
-							continue
-
-				except Exception:
-					print(f"Failed to open `{_inifile_name}`. Using default key-bindings")
-		else:
-			print(f"Invalid File name `{_inifile_name}` was ignored. Using default key-bindings")
-
-		# override key-bindings manually if you need
-		self._ingame_key_bindings.update({
-			# "gold": "f5",
-			# "blue": "f6",
-			# "red": "f7",
-			"alpha": "f13",
-			"bravo": "f14",
-			"charlie": "f15",
-			"delta": "f16",
-			# "cmd_1": "1",
-			# "cmd_2": "2",
-			# "cmd_3": "3",
-			# "cmd_4": "4",
-			# "cmd_5": "5",
-			# "cmd_6": "6",
-			# "cmd_7": "7",
-			# "cmd_8": "8",
-			# "cmd_9": "9",
-			# "cmd_back": "tab",
-			# "cmd_hold": "shift",
-			# "cmd_default": "z",
-			# "cmd_menu": "mouse_middle",
-			# "interact": "f",
-			# "yell": "f",
-		})
+		# where the keys go (see sr2ctrl/backend.py). test mode pushes no key
+		if input_backend is None:
+			input_backend = backend.NullBackend() if test else backend.KeyboardBackend()
+		self._backend = input_backend
+
+		# compile keywords into one matcher. keywords are normalized the same way as the recognition text
+		_normalizer = normalize.get_normalizer()
+		_groups = keyword_groups()
+		# built matchers are cached on disk, keyed by the content of this file
+		_store = compiled.Store("Arma3", (__file__,), extra=(_normalizer.width_fold, _normalizer.kana_fold, fuzzy.kanji_reading))
+		self._matcher = _store.get("matcher", matcher.KeywordMatcher, lambda: matcher.KeywordMatcher(_groups, _normalizer))
+		# hit -> command. the first command of arma3_commands wins
+		self._rules = rules.RuleTable(check_rules, keys=self._matcher.keys)
+		self._rules.mark_regex_keys(self._matcher.regex_keys)
+		# fuzzy fallback. finds keywords which sound alike when the text has no keyword (0 = off)
+		self._fuzzy = None
+		if fuzzy_max_distance > 0:
+			self._fuzzy = _store.get("fuzzy", fuzzy.FuzzyIndex, lambda: fuzzy.FuzzyIndex(_groups, _normalizer, max_distance=fuzzy_max_distance))
+		_store.save()
+		# command -> key plan
+		self._plans = key_plans
+		self._priorities = key_priorities
+		# orders of recent texts
+		self._order_cache = cache.LRUCache(order_cache_size)
+		# key injection thread. on_recognition returns while the keys are still being pushed
+		self._scheduler = keysched.KeyScheduler(self._backend.inject, on_preempt=self._on_preempt)
+		# interval after each key (see sr2ctrl/settings/SR2Control_timing.ini)
+		self._timing = timing.load_profile("Arma3", interval=push_interval)
+		# command -> events to submit. every key is resolved here once (e.g. hotkeys into scan codes)
+		self._compile_plans()
+		# n-best counters. rescued: a lower hypothesis was taken
+		self._nbest_utterances = 0
+		self._nbest_rescued = 0
 
 		print("")
 		print(" ---------------")
-		print("Current In-Game Key Bindings:")
-		for x in self._ingame_key_bindings.keys():
-			print(" " + x + " : " + self._ingame_key_bindings[x])
+		print("Commands:")
+		for _rule in check_rules:
+			_name = _rule["set"]["command"]
+			print(" " + _name + " : " + ", ".join(plan_text(self._plans[_name])))
 		print(" ---------------")
 
 		self._txt_label_keys = r"KEYS :"
@@ -779,584 +583,208 @@ class SR2C:
 		# _txt = re.sub(r"[ ,.，．、。]*", "", text)
 		_txt = text
 		_order = self._do_check(_txt)
+		latency.mark("do_check")
+		latency.action(_order["command"])
 		print("--------------------")
 		print(r"TIME :" + datetime.datetime.now().strftime(r"%Y.%m.%d %H:%M:%S"))
 		print(r"WORD :" + _txt)		# debug
 		print(r"ORDER:" + str(_order))	# debug
 		self._do_action(_order)
+		latency.mark("do_action")
 
 	# ##################################################
-	# Sub method. OPTIONAL. be called by main method.
+	# Partial method. OPTIONAL. be called by main program in streaming mode with a text still being spoken.
+	# returns True when the order was executed (the rest of the utterance is ignored).
 	# ##################################################
-	def _do_check(self, text):
+	def on_partial(self, text):
 		_txt = text
-		_order = {
-			"action": "none",
-			"option": "none",
-			"color": "none",
-			"hold": False,
-			"trapped": False,
-		}
-
-		# yell
-		if self._reobj_yell["base"].search(_txt):
-			_order["action"] = "yell"
-			return _order
-
-		# colors
-		if self._reobj_colors["gold"].search(_txt):
-			_order["color"] = "gold"
-		elif self._reobj_colors["red"].search(_txt):
-			_order["color"] = "red"
-		elif self._reobj_colors["blue"].search(_txt):
-			_order["color"] = "blue"
-
-		# hold
-		if self._reobj_hold["base"].search(_txt):
-			_order["hold"] = True
-
-		# trapped
-		if self._reobj_trapped["base"].search(_txt):
-			_order["trapped"] = True
-
-		# trapped
-		if self._reobj_interact["base"].search(_txt):
-			_order["action"] = "interact"
-
-		# execute
-		elif self._reobj_execute["execute"].search(_txt):
-			_order["action"] = "execute"
-		elif self._reobj_execute["cancel"].search(_txt):
-			_order["action"] = "cancel"
-
-		# stack
-		elif self._reobj_stackup["base"].search(_txt):
-			_order["action"] = "stack"
-			if self._reobj_stackup["auto"].search(_txt):
-				_order["option"] = "auto"
-			elif self._reobj_stackup["split"].search(_txt):
-				_order["option"] = "split"
-			elif self._reobj_stackup["right"].search(_txt):
-				_order["option"] = "right"
-			elif self._reobj_stackup["left"].search(_txt):
-				_order["option"] = "left"
-			else:
-				_order["option"] = "auto"
-
-		# breach
-		elif self._reobj_breach["base"].search(_txt):
-			_order["action"] = "breach"
-			_order["breacher"] = "none"
-			_order["grenade"] = "none"
-			# breach tool
-			if self._reobj_breach["leader"].search(_txt):
-				_order["breacher"] = "leader"
-			elif self._reobj_breach["kick"].search(_txt):
-				_order["breacher"] = "kick"
-			elif self._reobj_breach["shotgun"].search(_txt):
-				_order["breacher"] = "shotgun"
-			elif self._reobj_breach["c2"].search(_txt):
-				_order["breacher"] = "c2"
-			elif self._reobj_breach["ram"].search(_txt):
-				_order["breacher"] = "ram"
-			elif self._reobj_breach["open"].search(_txt):
-				_order["breacher"] = "open"
-			# breach grenade
-			if self._reobj_grenades["leader"].search(_txt):
-				_order["grenade"] = "leader"
-			elif self._reobj_grenades["flash"].search(_txt):
-				_order["grenade"] = "flash"
-			elif self._reobj_grenades["stinger"].search(_txt):
-				_order["grenade"] = "stinger"
-			elif self._reobj_grenades["gas"].search(_txt):
-				_order["grenade"] = "gas"
-			elif self._reobj_grenades["launcher"].search(_txt):
-				_order["grenade"] = "launcher"
-
-		# npc
-		elif self._reobj_npc["base"].search(_txt):
-			_order["action"] = "npc"
-			if self._reobj_npc["me"].search(_txt):
-				_order["option"] = "me"
-			elif self._reobj_npc["stop"].search(_txt):
-				_order["option"] = "stop"
-			elif self._reobj_npc["turn"].search(_txt):
-				_order["option"] = "turn"
-			elif self._reobj_npc["exit"].search(_txt):
-				_order["option"] = "exit"
-			elif self._reobj_npc["here"].search(_txt):
-				_order["option"] = "here"
-			else:
-				_order["option"] = "me"
-
-		# formation
-		elif self._reobj_formations["base"].search(_txt):
-			_order["action"] = "fallin"
-			if self._reobj_formations["single"].search(_txt):
-				_order["option"] = "single"
-			elif self._reobj_formations["double"].search(_txt):
-				_order["option"] = "double"
-			elif self._reobj_formations["diamond"].search(_txt):
-				_order["option"] = "diamond"
-			elif self._reobj_formations["wedge"].search(_txt):
-				_order["option"] = "wedge"
-			else:
-				_order["option"] = "single"
-
-		# door
-		elif self._reobj_door["wedge"].search(_txt):
-			_order["action"] = "door"
-			_order["option"] = "wedge"
-		elif self._reobj_door["mirror"].search(_txt):
-			_order["action"] = "door"
-			_order["option"] = "mirror"
-		elif self._reobj_door["disarm"].search(_txt):
-			_order["action"] = "door"
-			_order["option"] = "disarm"
+		_order = self._do_check(_txt)
+		# execute only when more words can't change the order (and not on a guess)
+		if (self._checked_rule not in self._rules.early) or self._checked_fuzzy or self._matcher.can_grow(_txt):
+			return False
+		latency.mark("do_check")
+		latency.action(_order["command"])
+		print("--------------------")
+		print(r"TIME :" + datetime.datetime.now().strftime(r"%Y.%m.%d %H:%M:%S"))
+		print(r"WORD :" + _txt + " (partial)")		# debug
+		print(r"ORDER:" + str(_order))	# debug
+		self._do_action(_order)
+		latency.mark("do_action")
+		return True
 
-		# door2
-		elif self._reobj_door2["base"].search(_txt):
-			_order["action"] = "door"
-			if self._reobj_door2["cover"].search(_txt):
-				_order["option"] = "cover"
-			elif self._reobj_door2["open"].search(_txt):
-				_order["option"] = "open"
-			elif self._reobj_door2["close"].search(_txt):
-				_order["option"] = "close"
-			else:
-				_order["option"] = "cover"
+	# ##################################################
+	# N-best method. OPTIONAL. be called by main program with the ranked hypotheses of one utterance.
+	# ##################################################
+	def on_nbest(self, hypotheses):
+		# hypotheses: [(text, confidence)], best first. the first one giving something to do is taken
+		_texts = [_text for _text, _confidence in hypotheses]
+		_orders = self._do_check_many(_texts)
+		latency.mark("do_check")
+		self._nbest_utterances += 1
+		_chosen = next((_i for _i, _order in enumerate(_orders) if self._is_actionable(_order)), None)
+		if _chosen is None:
+			# nothing to do with any of them: the best one as usual
+			self.on_recognition(_texts[0])
+			return
+		if _chosen > 0:
+			self._nbest_rescued += 1
+		_order = _orders[_chosen]
+		latency.action(_order["command"])
+		print("--------------------")
+		print(r"TIME :" + datetime.datetime.now().strftime(r"%Y.%m.%d %H:%M:%S"))
+		print(r"WORD :" + _texts[_chosen] + f" (hypothesis {_chosen + 1}/{len(_texts)}, confidence {hypotheses[_chosen][1]})")		# debug
+		print(r"ORDER:" + str(_order))	# debug
+		self._do_action(_order)
+		latency.mark("do_action")
 
-		# picking
-		elif self._reobj_picking["base"].search(_txt):
-			_order["action"] = "pick"
+	# ##################################################
+	# Sub method. OPTIONAL. be called by main method.
+	# ##################################################
+	def _do_check(self, text):
+		_txt = text
+		# the same text gives the same order
+		_cached = self._order_cache.get(_txt)
+		if _cached is not None:
+			self._checked_rule = _cached[1]
+			self._checked_fuzzy = _cached[2]
+			return dict(_cached[0])
+		# every keyword hit in one scan. the priority chain (check_rules) is decided from this set
+		_hits = self._matcher.search_keys(_txt)
+		_order = self._new_order()
+		_initial = dict(_order)
+		# the rule which decided the order is kept for on_partial
+		self._checked_rule = self._rules.evaluate(_hits, _order, self)
+		self._checked_fuzzy = False
+		if self._checked_rule is None and not _hits and self._fuzzy is not None:
+			# no keyword at all: try again with the keywords which sound like a part of the text
+			_similar = self._fuzzy.search(_txt)
+			if _similar:
+				print(r"FUZZY:" + str(_similar))	# debug
+				_order = _initial
+				self._checked_rule = self._rules.evaluate({_k for _k, _score in _similar}, _order, self)
+				self._checked_fuzzy = True
+		self._order_cache.put(_txt, (dict(_order), self._checked_rule, self._checked_fuzzy))
+		return _order
 
-		# scan
-		elif self._reobj_scan["pie"].search(_txt):
-			_order["action"] = "scan"
-			_order["option"] = "pie"
-		elif self._reobj_scan["slide"].search(_txt):
-			_order["action"] = "scan"
-			_order["option"] = "slide"
-		elif self._reobj_scan["peak"].search(_txt):
-			_order["action"] = "scan"
-			_order["option"] = "peak"
+	# _do_check of several texts. the texts not in the cache are scanned together (no fuzzy fallback)
+	def _do_check_many(self, texts):
+		_orders = [None] * len(texts)
+		for _i, _txt in enumerate(texts):
+			_cached = self._order_cache.get(_txt)
+			if _cached is not None:
+				_orders[_i] = dict(_cached[0])
+		_missing = [_i for _i, _order in enumerate(_orders) if _order is None]
+		for _i, _hits in zip(_missing, self._matcher.search_keys_many([texts[_i] for _i in _missing])):
+			_order = self._new_order()
+			_rule = self._rules.evaluate(_hits, _order, self)
+			self._order_cache.put(texts[_i], (dict(_order), _rule, False))
+			_orders[_i] = _order
+		return _orders
+
+	def _new_order(self):
+		return {
+			"command": "none",
+		}
 
-		# ground
-		elif self._reobj_ground["move"].search(_txt):
-			_order["action"] = "ground"
-			_order["option"] = "move"
-		elif self._reobj_ground["cover"].search(_txt):
-			_order["action"] = "ground"
-			_order["option"] = "cover"
-		elif self._reobj_ground["halt"].search(_txt):
-			_order["action"] = "ground"
-			_order["option"] = "halt"
-		elif self._reobj_ground["resume"].search(_txt):
-			_order["action"] = "ground"
-			_order["option"] = "resume"
-		elif self._reobj_ground["search"].search(_txt):
-			_order["action"] = "ground"
-			_order["option"] = "search"
+	# an order which makes _do_action press something
+	def _is_actionable(self, order):
+		return order["command"] != "none"
+
+	# statistics. OPTIONAL. be printed by main program on exit.
+	def get_stats(self):
+		return {
+			"order_cache": self._order_cache.get_stats(),
+			"nbest": {"utterances": self._nbest_utterances, "rescued": self._nbest_rescued},
+			"keys": self._scheduler.get_stats(),
+			"input": self._backend.get_stats(),
+		}
 
-		# deployables
-		elif self._reobj_deployables["flash"].search(_txt):
-			_order["action"] = "deploy"
-			_order["option"] = "flash"
-		elif self._reobj_deployables["stinger"].search(_txt):
-			_order["action"] = "deploy"
-			_order["option"] = "stinger"
-		elif self._reobj_deployables["gas"].search(_txt):
-			_order["action"] = "deploy"
-			_order["option"] = "gas"
-		elif self._reobj_deployables["chemlight"].search(_txt):
-			_order["action"] = "deploy"
-			_order["option"] = "chemlight"
-		elif self._reobj_deployables["shield"].search(_txt):
-			_order["action"] = "deploy"
-			_order["option"] = "shield"
+	# ##################################################
+	# Close method. OPTIONAL. be called by main program on exit.
+	# ##################################################
+	def close(self):
+		# the keys already scheduled are pushed (and held keys released)
+		self._scheduler.stop(timeout=5)
+		self._backend.close()
 
-		# restrain
-		elif self._reobj_restrain["base"].search(_txt):
-			_order["action"] = "restrain"
+	# ##################################################
+	# Timing methods. OPTIONAL. be called by sr2ctrl/calibrate.py.
+	# ##################################################
+	# a sequence is a tuple of command names, pushed one after another
+	def get_timing(self):
+		return self._timing
 
-		# gadget
-		elif self._reobj_gadgets["taser"].search(_txt):
-			_order["action"] = "gadget"
-			_order["option"] = "taser"
-		elif self._reobj_gadgets["spray"].search(_txt):
-			_order["action"] = "gadget"
-			_order["option"] = "spray"
-		elif self._reobj_gadgets["ball"].search(_txt):
-			_order["action"] = "gadget"
-			_order["option"] = "ball"
-		elif self._reobj_gadgets["beanbag"].search(_txt):
-			_order["action"] = "gadget"
-			_order["option"] = "beanbag"
-		elif self._reobj_gadgets["melee"].search(_txt):
-			_order["action"] = "gadget"
-			_order["option"] = "melee"
+	def set_timing(self, profile):
+		self._timing = profile
+		self._compile_plans()
 
-		# action
-		elif self._reobj_actions["move"].search(_txt):
-			_order["action"] = "team_action"
-			# movement
-			if self._reobj_movements["there"].search(_txt):
-				_order["option"] = "move_there"
-			elif self._reobj_movements["back"].search(_txt):
-				_order["option"] = "move_back"
-			else:
-				_order["option"] = "move_there"
-		elif self._reobj_actions["focus"].search(_txt):
-			_order["action"] = "team_action"
-			# focus
-			if self._reobj_focus["here"].search(_txt):
-				_order["option"] = "focus_here"
-			elif self._reobj_focus["me"].search(_txt):
-				_order["option"] = "focus_me"
-			elif self._reobj_focus["door"].search(_txt):
-				_order["option"] = "focus_door"
-			elif self._reobj_focus["target"].search(_txt):
-				_order["option"] = "focus_target"
-			elif self._reobj_focus["unfocus"].search(_txt):
-				_order["option"] = "focus_unfocus"
-			else:
-				_order["option"] = "focus_me"
-		elif self._reobj_actions["unfocus"].search(_txt):
-			_order["action"] = "team_action"
-			_order["option"] = "unfocus"
-		elif self._reobj_actions["swap"].search(_txt):
-			_order["action"] = "team_action"
-			_order["option"] = "swap"
-		elif self._reobj_actions["search"].search(_txt):
-			_order["action"] = "team_action"
-			_order["option"] = "search"
+	# commands to calibrate by default: the ones with more than one key
+	def timing_sequences(self):
+		return tuple((_name,) for _name, _plan in self._plans.items() if len(_plan) > 1 and _name in self._timelines)
 
-		# default
-		elif self._reobj_default["base"].search(_txt):
-			_order["action"] = "default"
+	# the keys whose interval the sequence waits (the last one waits for the next command only)
+	def timing_keys(self, sequence):
+		return plan_text(self._sequence_plan(sequence))[:-1]
 
-		# member
-		# it's not used so far.
+	def compile_sequence(self, sequence):
+		return self._compile_plan(self._sequence_plan(sequence), 0)
 
-		return _order
+	def _sequence_plan(self, sequence):
+		return tuple(_step for _name in sequence for _step in self._plans[_name])
 
 	# ##################################################
 	# Sub method. OPTIONAL. be called by main method.
 	# ##################################################
 	def _do_action(self, order):
-		_order = order
-		_action = _order["action"]
-		_option = _order["option"]
-		_color = _order["color"]
-		_hold = _order["hold"]
-		_trapped = _order["trapped"]
-		_command = []
-
-		# --- build key command ---
-
-		# yell
-		if _action == "yell":
-			_command.append("yell")
-			self._push_command(_command)
+		_command = order["command"]
+		if _command == "none":
+			print(self._txt_label_keys + str(["no action"]))		# debug
 			return
+		_plan = self._plans[_command]
+		if self._test_mode:
+			print(self._txt_label_keys + str(plan_text(_plan)))
+		else:
+			self._push_plan(_command)
 
-		# interact
-		if _action == "interact":
-			_command.append("interact")
-			self._push_command(_command)
+	# a part of _do_action method. the keys are injected by the key scheduler: returns at once
+	def _push_plan(self, command):
+		_timeline = self._timelines.get(command)
+		if _timeline is None:
+			print(self._txt_label_keys + str(["no action (invalid key)"]))		# debug
 			return
-
-		# hold
-		if _hold:
-			_command.append("cmd_hold")
-
-		# color
-		if _color != "none":
-			_command.append(_color)
-
-		# menu
-		_command.append("cmd_menu")
-
-		# execute
-		if _action == "execute":
-			_command.append("cmd_1")
-		elif _action == "cancel":
-			_command.append("cmd_2")
-
-		# stack
-		elif _action == "stack":
-			_command.append("cmd_1")
-			match _option:
-				case "split":
-					_command.append("cmd_1")
-				case "left":
-					_command.append("cmd_2")
-				case "right":
-					_command.append("cmd_3")
-				case "auto":
-					_command.append("cmd_4")
-				case _:
-					_command.append("cmd_4")
-
-		# breach
-		elif _action == "breach":
-			if _order["breacher"] == "open":
-				_command.append("cmd_2")
-			elif _order["breacher"] == "none":
-				_command.append("cmd_2")
-			else:
-				_command.append("cmd_3")
-				match _order["breacher"]:
-					case "kick":
-						_command.append("cmd_1")
-					case "shotgun":
-						_command.append("cmd_2")
-					case "c2":
-						_command.append("cmd_3")
-					case "ram":
-						_command.append("cmd_4")
-					case "leader":
-						_command.append("cmd_5")
-					case _:
-						_command.append("cmd_1")
-			match _order["grenade"]:
-				case "none":
-					_command.append("cmd_1")
-				case "flash":
-					_command.append("cmd_2")
-				case "stinger":
-					_command.append("cmd_3")
-				case "gas":
-					_command.append("cmd_4")
-				case "launcher":
-					_command.append("cmd_5")
-				case "leader":
-					_command.append("cmd_6")
-				case _:
-					_command.append("cmd_1")
-
-		# npc
-		elif _action == "npc":
-			match _option:
-				case "here":
-					_command.append("cmd_2")
-					_command.append("cmd_1")
-				case "me":
-					_command.append("cmd_2")
-					_command.append("cmd_2")
-				case "stop":
-					_command.append("cmd_2")
-					_command.append("cmd_3")
-				case "turn":
-					_command.append("cmd_4")
-				case "exit":
-					_command.append("cmd_5")
-				case _:
-					_command.append("cmd_3")
-
-		# formation
-		elif _action == "fallin":
-			_command.append("cmd_2")
-			match _option:
-				case "single":
-					_command.append("cmd_1")
-				case "double":
-					_command.append("cmd_2")
-				case "diamond":
-					_command.append("cmd_3")
-				case "wedge":
-					_command.append("cmd_4")
-				case _:
-					_command.append("cmd_1")
-
-		# door
-		elif _action == "door":
-			match _option:
-				case "mirror":
-					_command.append("cmd_5")
-				case "disarm":
-					_command.append("cmd_6")
-				case "wedge":
-					if _trapped:
-						_command.append("cmd_7")
-					else:
-						_command.append("cmd_6")
-				case "cover":
-					if _trapped:
-						_command.append("cmd_8")
-					else:
-						_command.append("cmd_7")
-				case "open":
-					if _trapped:
-						_command.append("cmd_9")
-					else:
-						_command.append("cmd_8")
-				case "close":
-					if _trapped:
-						_command.append("cmd_9")
-					else:
-						_command.append("cmd_8")
-				case _:
-					_command.append("cmd_5")
-
-		# picking
-		elif _action == "pick":
-			_command.append("cmd_2")
-
-		# scan
-		elif _action == "scan":
-			match _option:
-				case "slide":
-					_command.append("cmd_4")
-					_command.append("cmd_1")
-				case "pie":
-					_command.append("cmd_4")
-					_command.append("cmd_2")
-				case "peak":
-					_command.append("cmd_4")
-					_command.append("cmd_3")
-				case _:
-					_command.append("cmd_4")
-					_command.append("cmd_2")
-
-		# ground
-		elif _action == "ground":
-			match _option:
-				case "move":
-					_command.append("cmd_1")
-				case "cover":
-					_command.append("cmd_3")
-				case "halt":
-					_command.append("cmd_4")
-				case "resume":
-					_command.append("cmd_4")
-				case "search":
-					_command.append("cmd_6")
-				case _:
-					_command.append("cmd_1")
-
-		# deployables
-		elif _action == "deploy":
-			_command.append("cmd_5")
-			match _option:
-				case "flash":
-					_command.append("cmd_1")
-				case "stinger":
-					_command.append("cmd_2")
-				case "gas":
-					_command.append("cmd_3")
-				case "chemlight":
-					_command.append("cmd_4")
-				case "shield":
-					_command.append("cmd_5")
-				case _:
-					_command.append("cmd_4")
-
-		# restrain
-		elif _action == "restrain":
-			_command.append("cmd_1")
-
-		# gadget
-		elif _action == "gadget":
-			_command.append("cmd_3")
-			match _option:
-				case "taser":
-					_command.append("cmd_1")
-				case "spray":
-					_command.append("cmd_2")
-				case "ball":
-					_command.append("cmd_3")
-				case "beanbag":
-					_command.append("cmd_4")
-				case "melee":
-					_command.append("cmd_5")
-
-		# team action
-		elif _action == "team_action":
-			match _option:
-				case "move_there":
-					_command.append("cmd_1")
-					_command.append("cmd_1")
-				case "move_back":
-					_command.append("cmd_1")
-					_command.append("cmd_2")
-				case "focus_here":
-					_command.append("cmd_2")
-					_command.append("cmd_1")
-				case "focus_me":
-					_command.append("cmd_2")
-					_command.append("cmd_2")
-				case "focus_door":
-					_command.append("cmd_2")
-					_command.append("cmd_3")
-				case "focus_target":
-					_command.append("cmd_2")
-					_command.append("cmd_4")
-				case "focus_unfocus":
-					_command.append("cmd_2")
-					_command.append("cmd_5")
-				case "swap":
-					_command.append("cmd_3")
-				case "search":
-					_command.append("cmd_4")
-
-		# default
-		elif _action == "default":
-			_command.append("cmd_default")
-
-		# --- execute to push keys ---
-		if _action != "none":
-			if self._test_mode:
-				print(self._txt_label_keys + str(_command))
+		self._scheduler.submit(_timeline)
+		print(self._txt_label_keys + str(plan_text(self._plans[command])))	# debug
+
+	# a part of the constructor
+	def _compile_plans(self):
+		self._timelines = {}
+		for _name, _plan in self._plans.items():
+			try:
+				self._timelines[_name] = self._compile_plan(_plan, self._priorities[_name])
+			except ValueError as e:
+				# skipped: the other commands still work
+				print(f"WARNING: invalid key in command '{_name}' {plan_text(_plan)}! command skipped ({e})")
+
+	# a part of _compile_plans method. the events of a key plan, with the keys resolved for the input backend
+	def _compile_plan(self, plan, priority):
+		_timeline = keysched.Timeline(plan, priority)
+		_resolve = self._backend.resolve
+		_texts = plan_text(plan)
+		for _i, (_modifiers, _key, _is_mouse) in enumerate(plan):
+			if _i > 0:
+				_timeline.wait(self._timing.interval_after(_texts[_i - 1]))
+			if _is_mouse:
+				# keyboard keys held around the mouse click
+				for _modifier in _modifiers:
+					_timeline.press(_resolve(_modifier, False))
+				_timeline.tap(_resolve(_key, True), True)
+				for _modifier in reversed(_modifiers):
+					_timeline.release(_resolve(_modifier, False))
 			else:
-				self._push_command(_command)
-		else:
-			if _color != "none":
-				_command = [_color]
-				if self._test_mode:
-					print(self._txt_label_keys + str(_command))
-				else:
-					self._push_command(_command)
-			else:
-				print(self._txt_label_keys + str(["no action"]))		# debug
-
-	# a part of _do_action method
-	def _push_command(self, command):
-		_hold_key = ""
-		_hold_is_mouse = False
-		for cmd in command:
-			_key = self._ingame_key_bindings[cmd]
-			_is_hold = False
-			_is_mouse = False
-			if "mouse_" in _key:
-				_is_mouse = True
-				_key = _key.replace("mouse_", "")
-			if cmd == "cmd_hold":
-				_is_hold = True
-				_hold_key = _key
-				if _is_mouse:
-					_hold_is_mouse = True
-			self._push_key(_key, _is_mouse, _is_hold, up=False)
-			time.sleep(0.06)
-		if _hold_key != "":
-			self._push_key(_hold_key, _hold_is_mouse, True, up=True)
-		print(self._txt_label_keys + str(command))	# debug
+				_timeline.tap(_resolve("+".join(_modifiers + (_key,)), False))
+		return _timeline.freeze()
 
-	# a part of _push_command method
-	def _push_key(self, key, is_mouse, is_hold, up):
-		if is_mouse:
-			if is_hold:
-				if up:
-					mouse.release(button=key)
-				else:
-					mouse.press(button=key)
-			else:
-				mouse.click(button=key)
-		else:
-			if is_hold:
-				if up:
-					keyboard.send(hotkey=key, do_press=False, do_release=True)
-				else:
-					keyboard.send(hotkey=key, do_press=True, do_release=False)
-			else:
-				keyboard.send(hotkey=key, do_press=True, do_release=True)
+	# key scheduler callback. be called on the injection thread after a plan cut the running ones
+	def _on_preempt(self, info):
+		print(f"(!) PREEMPTED {[plan_text(_plan) for _plan in info['cancelled']]} by {plan_text(info['by'])}:"
+			f" {info['released']} key(s) released in {info['duration_ms']:.2f} ms")
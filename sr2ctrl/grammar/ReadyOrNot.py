@@ -5,19 +5,25 @@
 #
 import os
 import sys
-import time
 import datetime
 import re
 import copy
 import importlib.util
 
-import keyboard
-import mouse
+from sr2ctrl import normalize
+from sr2ctrl import rules
+from sr2ctrl import cache
+from sr2ctrl import fuzzy
+from sr2ctrl import compiled
+from sr2ctrl import latency
+from sr2ctrl import keysched
+from sr2ctrl import backend
+from sr2ctrl import timing
 
 # ##################################################
 # User params. REQUIRED. define keywords.
 # ##################################################
-params_path = r"sr2ctrl\grammar\ReadyOrNot_params.py"
+params_path = os.path.join("sr2ctrl", "grammar", "ReadyOrNot_params.py")
 # path = os.path.abspath(params_path)
 path = os.path.join(os.getcwd(), params_path)
 name = os.path.basename(params_path).split(".")[0]
@@ -31,6 +37,159 @@ except Exception as e:
 	print(e)
 
 
+# ##################################################
+# Check rules. REQUIRED. define the priority of keywords, tried from the top (see sr2ctrl/rules.py).
+# ##################################################
+check_rules = (
+	# yell
+	{"name": "yell", "when": ("yell.base",), "set": {"action": "yell"}, "stop": True},
+	# colors
+	{"name": "colors", "options": {"color": (("colors.gold", "gold"), ("colors.red", "red"), ("colors.blue", "blue"))}},
+	# hold
+	{"name": "hold", "when": ("hold.base",), "set": {"hold": True}},
+	# open command menu
+	{"name": "open_cmd", "when": ("opencmd.base",), "set": {"action": "open_cmd"}, "stop": True},
+	# number order
+	{"name": "number_order", "when": ("number.base",), "set": {"action": "number_order"},
+		"options": {"option": (
+			("number.1", "1"), ("number.2", "2"), ("number.3", "3"), ("number.4", "4"), ("number.5", "5"),
+			("number.6", "6"), ("number.7", "7"), ("number.8", "8"), ("number.9", "9"), ("number.0", "0"),
+			("number.back", "back"),
+		)},
+		"default": {"option": "0"}, "stop": True},
+	# two doors (front or back)
+	{"name": "twodoors", "options": {"twodoors": (("twodoors.front", 1), ("twodoors.back", 2))}},
+	# step order
+	{"name": "so_timeout", "state": (1, 2), "call": "_check_so_timeout"},
+	{"name": "so_start", "when": ("socontrol.start",), "state": (0,), "set": {"action": "so_start"}, "stop": True},
+	{"name": "so_cancel", "when": ("socontrol.cancel",), "state": (1, 2), "set": {"action": "so_cancel"}, "stop": True},
+	# skip while step order
+	# trapped
+	{"name": "trapped", "when": ("trapped.base",), "state": (0,), "set": {"trapped": True}},
+	# interact
+	{"name": "interact", "when": ("interact.base",), "state": (0,), "set": {"action": "interact"}, "stop": True},
+	# long interact
+	{"name": "interact_long", "when": ("interactlong.base",), "state": (0,), "set": {"action": "interact_long"}, "stop": True},
+	# execute
+	{"name": "execute", "when": ("execute.execute", "execute.cancel"), "state": (0,),
+		"options": {"action": (("execute.execute", "execute"), ("execute.cancel", "cancel"))}, "stop": True},
+	# stack
+	{"name": "stack", "when": ("stackup.base",), "state": (0,), "set": {"action": "stack"},
+		"options": {"option": (("stackup.auto", "auto"), ("stackup.split", "split"), ("stackup.right", "right"), ("stackup.left", "left"))},
+		"default": {"option": "auto"}, "stop": True},
+	# breach
+	{"name": "breach", "when": ("breach.base",), "state": (0,), "set": {"action": "breach", "breacher": "none", "grenade": "none"},
+		"options": {
+			"breacher": (("breach.leader", "leader"), ("breach.kick", "kick"), ("breach.shotgun", "shotgun"), ("breach.c2", "c2"), ("breach.ram", "ram"), ("breach.open", "open")),
+			"grenade": (("grenades.leader", "leader"), ("grenades.flash", "flash"), ("grenades.stinger", "stinger"), ("grenades.gas", "gas"), ("grenades.launcher", "launcher")),
+		},
+		"stop": True},
+	# step order: breach tool
+	{"name": "so_breacher", "state": (1,), "set": {"action": "so_breacher", "breacher": "none", "grenade": "none"},
+		"options": {
+			"breacher": (("breach.leader", "leader"), ("breach.kick", "kick"), ("breach.shotgun", "shotgun"), ("breach.c2", "c2"), ("breach.ram", "ram"), ("breach.open", "open")),
+		},
+		"default": {"breacher": "no_match"}, "stop": True},
+	# step order: breach grenade
+	{"name": "so_grenade", "state": (2,), "set": {"action": "so_grenade", "breacher": "none", "grenade": "none"},
+		"options": {
+			"breacher": (("breach.leader", "leader"), ("breach.kick", "kick"), ("breach.shotgun", "shotgun"), ("breach.c2", "c2"), ("breach.ram", "ram"), ("breach.open", "open")),
+			"grenade": (("grenades.leader", "leader"), ("grenades.flash", "flash"), ("grenades.stinger", "stinger"), ("grenades.gas", "gas"), ("grenades.launcher", "launcher"), ("grenades.none", "none")),
+		},
+		"default": {"grenade": "no_match"}, "stop": True},
+	# npc
+	{"name": "npc", "when": ("npc.base",), "set": {"action": "npc"},
+		"options": {"option": (("npc.me", "me"), ("npc.stop", "stop"), ("npc.turn", "turn"), ("npc.exit", "exit"), ("npc.here", "here"))},
+		"default": {"option": "me"}, "stop": True},
+	# formation
+	{"name": "fallin", "when": ("formations.base",), "set": {"action": "fallin"},
+		"options": {"option": (("formations.single", "single"), ("formations.double", "double"), ("formations.diamond", "diamond"), ("formations.wedge", "wedge"))},
+		"default": {"option": "single"}, "stop": True},
+	# door
+	{"name": "door", "when": ("door.wedge", "door.mirror", "door.disarm"), "set": {"action": "door"},
+		"options": {"option": (("door.wedge", "wedge"), ("door.mirror", "mirror"), ("door.disarm", "disarm"))}, "stop": True},
+	# door2
+	{"name": "door2", "when": ("door2.base",), "set": {"action": "door"},
+		"options": {"option": (("door2.cover", "cover"), ("door2.open", "open"), ("door2.close", "close"))},
+		"default": {"option": "cover"}, "stop": True},
+	# picking
+	{"name": "pick", "when": ("picking.base",), "set": {"action": "pick"}, "stop": True},
+	# scan
+	{"name": "scan", "when": ("scan.pie", "scan.slide", "scan.peak"), "set": {"action": "scan"},
+		"options": {"option": (("scan.pie", "pie"), ("scan.slide", "slide"), ("scan.peak", "peak"))}, "stop": True},
+	# ground
+	{"name": "ground", "when": ("ground.move", "ground.cover", "ground.halt", "ground.resume", "ground.search"), "set": {"action": "ground"},
+		"options": {"option": (("ground.move", "move"), ("ground.cover", "cover"), ("ground.halt", "halt"), ("ground.resume", "resume"), ("ground.search", "search"))}, "stop": True},
+	# deployables
+	{"name": "deploy", "when": ("deployables.flash", "deployables.stinger", "deployables.gas", "deployables.chemlight", "deployables.shield"), "set": {"action": "deploy"},
+		"options": {"option": (("deployables.flash", "flash"), ("deployables.stinger", "stinger"), ("deployables.gas", "gas"), ("deployables.chemlight", "chemlight"), ("deployables.shield", "shield"))}, "stop": True},
+	# restrain
+	{"name": "restrain", "when": ("restrain.base",), "set": {"action": "restrain"}, "stop": True},
+	# gadget
+	{"name": "gadget", "when": ("gadgets.taser", "gadgets.spray", "gadgets.ball", "gadgets.beanbag", "gadgets.melee"), "set": {"action": "gadget"},
+		"options": {"option": (("gadgets.taser", "taser"), ("gadgets.spray", "spray"), ("gadgets.ball", "ball"), ("gadgets.beanbag", "beanbag"), ("gadgets.melee", "melee"))}, "stop": True},
+	# action: movement
+	{"name": "team_move", "when": ("actions.move",), "set": {"action": "team_action"},
+		"options": {"option": (("movements.there", "move_there"), ("movements.back", "move_back"))},
+		"default": {"option": "move_there"}, "stop": True},
+	# action: focus
+	{"name": "team_focus", "when": ("actions.focus",), "set": {"action": "team_action"},
+		"options": {"option": (("focus.here", "focus_here"), ("focus.me", "focus_me"), ("focus.door", "focus_door"), ("focus.target", "focus_target"), ("focus.unfocus", "focus_unfocus"))},
+		"default": {"option": "focus_me"}, "stop": True},
+	# action: others
+	{"name": "team_action", "when": ("actions.unfocus", "actions.swap", "actions.search"), "set": {"action": "team_action"},
+		"options": {"option": (("actions.unfocus", "unfocus"), ("actions.swap", "swap"), ("actions.search", "search"))}, "stop": True},
+	# default. its keywords are also fillers ("あれ", "それ"): never run it on a partial text
+	{"name": "default", "when": ("default.base",), "set": {"action": "default"}, "stop": True, "early": False},
+	# member
+	# it's not used so far.
+)
+
+# priority of the key plan of an action (default 0). a plan preempts the running plans of a lower priority:
+# their keys left are dropped and held keys (cmd_hold, a long interact) are released (see sr2ctrl/keysched.py)
+action_priorities = {"cancel": 1, "so_cancel": 1, "yell": 1}
+
+
+# ##################################################
+# Keyword groups. REQUIRED. the keywords the check rules look at (also read by sr2ctrl/analyzer.py).
+# ##################################################
+def keyword_groups():
+	# hits are reported as "group.word", e.g. "colors.gold" for params.kw_colors["gold"]
+	return {
+		"yell": params.kw_yell,
+		"colors": params.kw_colors,
+		"hold": params.kw_hold,
+		"opencmd": params.kw_open_cmd,
+		"number": params.kw_number,
+		"twodoors": params.kw_door_twodoors,
+		"socontrol": params.kw_so_control,
+		"trapped": params.kw_door_trapped,
+		"interact": params.kw_interact,
+		"interactlong": params.kw_interact_long,
+		"execute": params.kw_execute_cancel,
+		"stackup": params.kw_stack_sides,
+		"breach": params.kw_breach_tools,
+		"grenades": params.kw_grenades,
+		"npc": params.kw_npc_movements,
+		"formations": params.kw_formations,
+		"door": params.kw_door_options,
+		"door2": params.kw_door_options2,
+		"picking": params.kw_picking,
+		"scan": params.kw_door_scan,
+		"ground": params.kw_ground_options,
+		"deployables": params.kw_deployables,
+		"restrain": params.kw_npc_restrain,
+		"gadgets": params.kw_team_gadgets,
+		"actions": params.kw_team_actions,
+		"movements": params.kw_team_movements,
+		"focus": params.kw_team_focus,
+		"default": params.kw_default_order,
+	}
+
+# values of _so_state. each has its own subset of the check rules
+check_states = (0, 1, 2)
+
+
 # ##################################################
 # General class. REQUIRED. must has on_recognition method.
 # ##################################################
@@ -39,175 +198,42 @@ class SR2C:
 	# ##################################################
 	# Constructor. REQUIRED.
 	# ##################################################
-	def __init__(self, test):
+	def __init__(self, test, input_backend=None):
 		# set test mode
 		self._test_mode = test
-
-		# compile re patterns
-		self._reobj_yell = {
-			"base": re.compile(r"|".join(params.kw_yell["base"])),
-		}
-		self._reobj_colors = {
-			"gold": re.compile(r"|".join(params.kw_colors["gold"])),
-			"red": re.compile(r"|".join(params.kw_colors["red"])),
-			"blue": re.compile(r"|".join(params.kw_colors["blue"])),
-		}
-		self._reobj_hold = {
-			"base": re.compile(r"|".join(params.kw_hold["base"])),
-		}
-		self._reobj_opencmd = {
-			"base": re.compile(r"|".join(params.kw_open_cmd["base"])),
-		}
-		self._reobj_number = {
-			"base": re.compile(r"|".join(params.kw_number["base"])),
-			"1": re.compile(r"|".join(params.kw_number["1"])),
-			"2": re.compile(r"|".join(params.kw_number["2"])),
-			"3": re.compile(r"|".join(params.kw_number["3"])),
-			"4": re.compile(r"|".join(params.kw_number["4"])),
-			"5": re.compile(r"|".join(params.kw_number["5"])),
-			"6": re.compile(r"|".join(params.kw_number["6"])),
-			"7": re.compile(r"|".join(params.kw_number["7"])),
-			"8": re.compile(r"|".join(params.kw_number["8"])),
-			"9": re.compile(r"|".join(params.kw_number["9"])),
-			"0": re.compile(r"|".join(params.kw_number["0"])),
-			"back": re.compile(r"|".join(params.kw_number["back"])),
-		}
-		self._reobj_twodoors = {
-			"front": re.compile(r"|".join(params.kw_door_twodoors["front"])),
-			"back": re.compile(r"|".join(params.kw_door_twodoors["back"])),
-		}
-		self._reobj_socontrol = {
-			"start": re.compile(r"|".join(params.kw_so_control["start"])),
-			"cancel": re.compile(r"|".join(params.kw_so_control["cancel"])),
-		}
+		# where the keys go (see sr2ctrl/backend.py). test mode pushes no key
+		if input_backend is None:
+			input_backend = backend.NullBackend() if test else backend.KeyboardBackend()
+		self._backend = input_backend
+
+		# keyword groups of the matchers. keywords are normalized the same way as the recognition text
+		_normalizer = normalize.get_normalizer()
+		_groups = keyword_groups()
+		# built matchers are cached on disk, keyed by the content of this file and the params file
+		_store = compiled.Store("ReadyOrNot", (__file__, params.__file__), extra=(_normalizer.width_fold, _normalizer.kana_fold, fuzzy.kanji_reading))
+		# the priority chain of _do_check, with its own matcher per step order state
+		self._rules = rules.StateRuleTable(check_rules, _groups, _normalizer, states=check_states, store=_store)
+		# fuzzy fallback. finds keywords which sound alike when the text has no keyword (0 = off)
+		self._fuzzy = None
+		if getattr(params, "fuzzy_max_distance", 0) > 0:
+			self._fuzzy = _store.get("fuzzy", fuzzy.FuzzyIndex, lambda: fuzzy.FuzzyIndex(_groups, _normalizer, max_distance=params.fuzzy_max_distance))
+		_store.save()
 		self._so_state = 0 # 0=off, 1=tools, 2=grenades
 		self._so_lasttime = datetime.datetime.now()
 		self._so_timeout = params.so_timeout
 		self._so_cancel_reason = {0:"manual cancel", 1:"timeout cancel", 2:"cmd executed", 3:"other"}
-		self._reobj_trapped = {
-			"base": re.compile(r"|".join(params.kw_door_trapped["base"])),
-		}
-		self._reobj_interact = {
-			"base": re.compile(r"|".join(params.kw_interact["base"])),
-		}
-		self._reobj_interactlong = {
-			"base": re.compile(r"|".join(params.kw_interact_long["base"])),
-		}
 		self._long_push_time = params.long_push_time
-		self._reobj_execute = {
-			"execute": re.compile(r"|".join(params.kw_execute_cancel["execute"])),
-			"cancel": re.compile(r"|".join(params.kw_execute_cancel["cancel"])),
-		}
-		self._reobj_stackup = {
-			"base": re.compile(r"|".join(params.kw_stack_sides["base"])),
-			"auto": re.compile(r"|".join(params.kw_stack_sides["auto"])),
-			"split": re.compile(r"|".join(params.kw_stack_sides["split"])),
-			"right": re.compile(r"|".join(params.kw_stack_sides["right"])),
-			"left": re.compile(r"|".join(params.kw_stack_sides["left"])),
-		}
-		self._reobj_breach = {
-			"base": re.compile(r"|".join(params.kw_breach_tools["base"])),
-			"open": re.compile(r"|".join(params.kw_breach_tools["open"])),
-			"kick": re.compile(r"|".join(params.kw_breach_tools["kick"])),
-			"shotgun": re.compile(r"|".join(params.kw_breach_tools["shotgun"])),
-			"c2": re.compile(r"|".join(params.kw_breach_tools["c2"])),
-			"ram": re.compile(r"|".join(params.kw_breach_tools["ram"])),
-			"leader": re.compile(r"|".join(params.kw_breach_tools["leader"])),
-		}
-		self._reobj_grenades = {
-			"flash": re.compile(r"|".join(params.kw_grenades["flash"])),
-			"stinger": re.compile(r"|".join(params.kw_grenades["stinger"])),
-			"gas": re.compile(r"|".join(params.kw_grenades["gas"])),
-			"launcher": re.compile(r"|".join(params.kw_grenades["launcher"])),
-			"leader": re.compile(r"|".join(params.kw_grenades["leader"])),
-			"none": re.compile(r"|".join(params.kw_grenades["none"])),
-		}
-		self._reobj_npc = {
-			"base": re.compile(r"|".join(params.kw_npc_movements["base"])),
-			"here": re.compile(r"|".join(params.kw_npc_movements["here"])),
-			"me": re.compile(r"|".join(params.kw_npc_movements["me"])),
-			"stop": re.compile(r"|".join(params.kw_npc_movements["stop"])),
-			"turn": re.compile(r"|".join(params.kw_npc_movements["turn"])),
-			"exit": re.compile(r"|".join(params.kw_npc_movements["exit"])),
-		}
-		self._reobj_formations = {
-			"base": re.compile(r"|".join(params.kw_formations["base"])),
-			"single": re.compile(r"|".join(params.kw_formations["single"])),
-			"double": re.compile(r"|".join(params.kw_formations["double"])),
-			"diamond": re.compile(r"|".join(params.kw_formations["diamond"])),
-			"wedge": re.compile(r"|".join(params.kw_formations["wedge"])),
-		}
-		self._reobj_door = {
-			"mirror": re.compile(r"|".join(params.kw_door_options["mirror"])),
-			"disarm": re.compile(r"|".join(params.kw_door_options["disarm"])),
-			"wedge": re.compile(r"|".join(params.kw_door_options["wedge"])),
-		}
-		self._reobj_door2 = {
-			"base": re.compile(r"|".join(params.kw_door_options2["base"])),
-			"cover": re.compile(r"|".join(params.kw_door_options2["cover"])),
-			"open": re.compile(r"|".join(params.kw_door_options2["open"])),
-			"close": re.compile(r"|".join(params.kw_door_options2["close"])),
-		}
-		self._reobj_picking = {
-			"base": re.compile(r"|".join(params.kw_picking["base"])),
-		}
-		self._reobj_scan = {
-			"pie": re.compile(r"|".join(params.kw_door_scan["pie"])),
-			"slide": re.compile(r"|".join(params.kw_door_scan["slide"])),
-			"peak": re.compile(r"|".join(params.kw_door_scan["peak"])),
-		}
-		self._reobj_ground = {
-			"move": re.compile(r"|".join(params.kw_ground_options["move"])),
-			"cover": re.compile(r"|".join(params.kw_ground_options["cover"])),
-			"halt": re.compile(r"|".join(params.kw_ground_options["halt"])),
-			"resume": re.compile(r"|".join(params.kw_ground_options["resume"])),
-			"search": re.compile(r"|".join(params.kw_ground_options["search"])),
-		}
-		self._reobj_deployables = {
-			"flash": re.compile(r"|".join(params.kw_deployables["flash"])),
-			"stinger": re.compile(r"|".join(params.kw_deployables["stinger"])),
-			"gas": re.compile(r"|".join(params.kw_deployables["gas"])),
-			"chemlight": re.compile(r"|".join(params.kw_deployables["chemlight"])),
-			"shield": re.compile(r"|".join(params.kw_deployables["shield"])),
-		}
-		self._reobj_restrain = {
-			"base": re.compile(r"|".join(params.kw_npc_restrain["base"])),
-		}
-		self._reobj_gadgets = {
-			"taser": re.compile(r"|".join(params.kw_team_gadgets["taser"])),
-			"spray": re.compile(r"|".join(params.kw_team_gadgets["spray"])),
-			"ball": re.compile(r"|".join(params.kw_team_gadgets["ball"])),
-			"beanbag": re.compile(r"|".join(params.kw_team_gadgets["beanbag"])),
-			"melee": re.compile(r"|".join(params.kw_team_gadgets["melee"])),
-		}
-		self._reobj_actions = {
-			"move": re.compile(r"|".join(params.kw_team_actions["move"])),
-			"focus": re.compile(r"|".join(params.kw_team_actions["focus"])),
-			"unfocus": re.compile(r"|".join(params.kw_team_actions["unfocus"])),
-			"swap": re.compile(r"|".join(params.kw_team_actions["swap"])),
-			"search": re.compile(r"|".join(params.kw_team_actions["search"])),
-		}
-		self._reobj_movements = {
-			"there": re.compile(r"|".join(params.kw_team_movements["there"])),
-			"back": re.compile(r"|".join(params.kw_team_movements["back"])),
-		}
-		self._reobj_focus = {
-			"here": re.compile(r"|".join(params.kw_team_focus["here"])),
-			"me": re.compile(r"|".join(params.kw_team_focus["me"])),
-			"door": re.compile(r"|".join(params.kw_team_focus["door"])),
-			"target": re.compile(r"|".join(params.kw_team_focus["target"])),
-			"unfocus": re.compile(r"|".join(params.kw_team_focus["unfocus"])),
-		}
-		self._reobj_default = {
-			"base": re.compile(r"|".join(params.kw_default_order["base"])),
-		}
-		# this is not used so far
-		# self._reobj_members = {
-		# 	"alpha": re.compile(r"|".join(params.kw_team_members["alpha"])),
-		# 	"bravo": re.compile(r"|".join(params.kw_team_members["bravo"])),
-		# 	"charlie": re.compile(r"|".join(params.kw_team_members["charlie"])),
-		# 	"delta": re.compile(r"|".join(params.kw_team_members["delta"])),
-		# }
+		# interval after each key (see sr2ctrl/settings/SR2Control_timing.ini)
+		self._timing = timing.load_profile("ReadyOrNot", interval=0.06)
+		# key injection thread. on_recognition returns while the keys are still being pushed
+		self._scheduler = keysched.KeyScheduler(self._backend.inject, on_preempt=self._on_preempt)
+		# orders of recent texts. the step order state is a part of the key
+		self._order_cache = cache.LRUCache(getattr(params, "order_cache_size", 256))
+		# n-best counters. rescued: a lower hypothesis was taken
+		self._nbest_utterances = 0
+		self._nbest_rescued = 0
+		# members: this is not used so far
+		# (add "members": params.kw_team_members to the groups above to get "members.alpha" etc.)
 
 		# mapping of key name in RoN and keyboard module except for case-difference only pattern
 		# don't edit!
@@ -378,8 +404,21 @@ class SR2C:
 			print(" " + x + " : " + self._ingame_key_bindings[x])
 		print(" ---------------")
 
+		# key bindings resolved for the input backend, and the key plans compiled from them
+		self._compile_key_bindings()
+
 		self._txt_label_keys = r"KEYS :"
 
+	# step order state. setting it selects the rules of the state
+	@property
+	def _so_state(self):
+		return self._so_state_value
+
+	@_so_state.setter
+	def _so_state(self, state):
+		self._so_state_value = state
+		self._rules.select(state)
+
 	# ##################################################
 	# Main method. REQUIRED. be called by main program.
 	# ##################################################
@@ -390,15 +429,112 @@ class SR2C:
 		_txt = text
 		print(r"WORD :" + _txt)		# debug
 		_order = self._do_check(_txt)
+		latency.mark("do_check")
+		latency.action(_order["action"])
+		print(r"ORDER:" + str(_order))	# debug
+		self._do_action(_order)
+		latency.mark("do_action")
+
+	# ##################################################
+	# Partial method. OPTIONAL. be called by main program in streaming mode with a text still being spoken.
+	# returns True when the order was executed (the rest of the utterance is ignored).
+	# ##################################################
+	def on_partial(self, text):
+		_txt = text
+		_order = self._do_check(_txt)
+		# execute only when more words can't change the order (and not on a guess)
+		if (self._checked_rule not in self._rules.early) or self._checked_fuzzy or self._rules.can_grow(_txt):
+			return False
+		latency.mark("do_check")
+		latency.action(_order["action"])
+		print("--------------------")
+		print(r"TIME :" + datetime.datetime.now().strftime(r"%Y.%m.%d %H:%M:%S"))
+		print(r"WORD :" + _txt + " (partial)")		# debug
+		print(r"ORDER:" + str(_order))	# debug
+		self._do_action(_order)
+		latency.mark("do_action")
+		return True
+
+	# ##################################################
+	# N-best method. OPTIONAL. be called by main program with the ranked hypotheses of one utterance.
+	# ##################################################
+	def on_nbest(self, hypotheses):
+		# hypotheses: [(text, confidence)], best first. the first one giving something to do is taken
+		_texts = [_text for _text, _confidence in hypotheses]
+		_orders = self._do_check_many(_texts)
+		latency.mark("do_check")
+		self._nbest_utterances += 1
+		_chosen = next((_i for _i, _order in enumerate(_orders) if self._is_actionable(_order)), None)
+		if _chosen is None:
+			# nothing to do with any of them: the best one as usual
+			self.on_recognition(_texts[0])
+			return
+		if _chosen > 0:
+			self._nbest_rescued += 1
+		_order = _orders[_chosen]
+		latency.action(_order["action"])
+		print("--------------------")
+		print(r"TIME :" + datetime.datetime.now().strftime(r"%Y.%m.%d %H:%M:%S"))
+		print(r"WORD :" + _texts[_chosen] + f" (hypothesis {_chosen + 1}/{len(_texts)}, confidence {hypotheses[_chosen][1]})")		# debug
 		print(r"ORDER:" + str(_order))	# debug
 		self._do_action(_order)
+		latency.mark("do_action")
 
 	# ##################################################
 	# Sub method. OPTIONAL. be called by main method.
 	# ##################################################
 	def _do_check(self, text):
 		_txt = text
-		_order = {
+		# the same text in the same state gives the same order, unless the step order times out now
+		_key = (_txt, self._so_state)
+		_expired = self._so_state != 0 and self._is_so_expired()
+		if not _expired:
+			_cached = self._order_cache.get(_key)
+			if _cached is not None:
+				self._checked_rule = _cached[1]
+				self._checked_fuzzy = _cached[2]
+				return dict(_cached[0])
+		_order = self._new_order()
+		_initial = dict(_order)
+		# one scan for the keywords of the current state, then its rules of check_rules.
+		# the rule which decided the order is kept for on_partial
+		_hits = self._rules.search_keys(_txt)
+		self._checked_rule = self._rules.evaluate(_txt, _order, self, hits=_hits)
+		self._checked_fuzzy = False
+		if self._checked_rule is None and not _hits and self._fuzzy is not None:
+			# no keyword at all: try again with the keywords which sound like a part of the text
+			_similar = self._fuzzy.search(_txt)
+			if _similar:
+				print(r"FUZZY:" + str(_similar))	# debug
+				_order = _initial
+				self._checked_rule = self._rules.evaluate(_txt, _order, self, extra=[_k for _k, _score in _similar])
+				self._checked_fuzzy = True
+		if not _expired and self._so_state == _key[1]:
+			self._order_cache.put(_key, (dict(_order), self._checked_rule, self._checked_fuzzy))
+		return _order
+
+	# _do_check of several texts. the texts not in the cache are scanned together (no fuzzy fallback)
+	def _do_check_many(self, texts):
+		_state = self._so_state
+		_expired = _state != 0 and self._is_so_expired()
+		_orders = [None] * len(texts)
+		if not _expired:
+			for _i, _txt in enumerate(texts):
+				_cached = self._order_cache.get((_txt, _state))
+				if _cached is not None:
+					_orders[_i] = dict(_cached[0])
+		_missing = [_i for _i, _order in enumerate(_orders) if _order is None]
+		if _missing:
+			_new = [self._new_order() for _ in _missing]
+			_stopped = self._rules.evaluate_many([texts[_i] for _i in _missing], _new, self)
+			for _i, _order, _rule in zip(_missing, _new, _stopped):
+				_orders[_i] = _order
+				if not _expired and self._so_state == _state:
+					self._order_cache.put((texts[_i], _state), (dict(_order), _rule, False))
+		return _orders
+
+	def _new_order(self):
+		return {
 			"action": "none",
 			"option": "none",
 			"color": "none",
@@ -407,310 +543,67 @@ class SR2C:
 			"twodoors": 0,
 		}
 
-		# yell
-		if self._reobj_yell["base"].search(_txt):
-			_order["action"] = "yell"
-			return _order
-
-		# colors
-		if self._reobj_colors["gold"].search(_txt):
-			_order["color"] = "gold"
-		elif self._reobj_colors["red"].search(_txt):
-			_order["color"] = "red"
-		elif self._reobj_colors["blue"].search(_txt):
-			_order["color"] = "blue"
-
-		# hold
-		if self._reobj_hold["base"].search(_txt):
-			_order["hold"] = True
-
-		# open command menu
-		if self._reobj_opencmd["base"].search(_txt):
-			_order["action"] = "open_cmd"
-			return _order
-
-		# number order
-		if self._reobj_number["base"].search(_txt):
-			_order["action"] = "number_order"
-			if self._reobj_number["1"].search(_txt):		_order["option"] = "1"
-			elif self._reobj_number["2"].search(_txt):		_order["option"] = "2"
-			elif self._reobj_number["3"].search(_txt):		_order["option"] = "3"
-			elif self._reobj_number["4"].search(_txt):		_order["option"] = "4"
-			elif self._reobj_number["5"].search(_txt):		_order["option"] = "5"
-			elif self._reobj_number["6"].search(_txt):		_order["option"] = "6"
-			elif self._reobj_number["7"].search(_txt):		_order["option"] = "7"
-			elif self._reobj_number["8"].search(_txt):		_order["option"] = "8"
-			elif self._reobj_number["9"].search(_txt):		_order["option"] = "9"
-			elif self._reobj_number["0"].search(_txt):		_order["option"] = "0"
-			elif self._reobj_number["back"].search(_txt):	_order["option"] = "back"
-			else:											_order["option"] = "0"
-			return _order
-
-		# two doors (front or back)
-		if self._reobj_twodoors["front"].search(_txt):
-			_order["twodoors"] = 1
-		elif self._reobj_twodoors["back"].search(_txt):
-			_order["twodoors"] = 2
-
-		# step order
-		if self._so_state in (1,2):
-			if ((datetime.datetime.now() - self._so_lasttime).total_seconds() >= self._so_timeout): self._quit_so(1) # step order timeout
-		if self._reobj_socontrol["start"].search(_txt) and self._so_state == 0:
-			_order["action"] = "so_start"
-			return _order
-		if self._reobj_socontrol["cancel"].search(_txt) and self._so_state in (1,2):
-			_order["action"] = "so_cancel"
-			return _order
-
-		# skip while step order
-		if self._so_state == 0:
-			# trapped
-			if self._reobj_trapped["base"].search(_txt):
-				_order["trapped"] = True
-
-			# interact
-			if self._reobj_interact["base"].search(_txt):
-				_order["action"] = "interact"
-				return _order
-
-			# long interact
-			if self._reobj_interactlong["base"].search(_txt):
-				_order["action"] = "interact_long"
-				return _order
-
-			# execute
-			if self._reobj_execute["execute"].search(_txt):
-				_order["action"] = "execute"
-				return _order
-			elif self._reobj_execute["cancel"].search(_txt):
-				_order["action"] = "cancel"
-				return _order
-
-			# stack
-			if self._reobj_stackup["base"].search(_txt):
-				_order["action"] = "stack"
-				if self._reobj_stackup["auto"].search(_txt):
-					_order["option"] = "auto"
-				elif self._reobj_stackup["split"].search(_txt):
-					_order["option"] = "split"
-				elif self._reobj_stackup["right"].search(_txt):
-					_order["option"] = "right"
-				elif self._reobj_stackup["left"].search(_txt):
-					_order["option"] = "left"
-				else:
-					_order["option"] = "auto"
-				return _order
-
-		# breach
-		if self._reobj_breach["base"].search(_txt) or self._so_state in (1,2):
-			_order["action"] = "breach"
-			_order["breacher"] = "none"
-			_order["grenade"] = "none"
-			# breach tool
-			if self._reobj_breach["leader"].search(_txt):
-				_order["breacher"] = "leader"
-			elif self._reobj_breach["kick"].search(_txt):
-				_order["breacher"] = "kick"
-			elif self._reobj_breach["shotgun"].search(_txt):
-				_order["breacher"] = "shotgun"
-			elif self._reobj_breach["c2"].search(_txt):
-				_order["breacher"] = "c2"
-			elif self._reobj_breach["ram"].search(_txt):
-				_order["breacher"] = "ram"
-			elif self._reobj_breach["open"].search(_txt):
-				_order["breacher"] = "open"
-			elif self._so_state == 1:
-				_order["breacher"] = "no_match"
-			# skip below while step order
-			if self._so_state == 1:
-				_order["action"] = "so_breacher"
-				return _order
-			# breach grenade
-			if self._reobj_grenades["leader"].search(_txt):
-				_order["grenade"] = "leader"
-			elif self._reobj_grenades["flash"].search(_txt):
-				_order["grenade"] = "flash"
-			elif self._reobj_grenades["stinger"].search(_txt):
-				_order["grenade"] = "stinger"
-			elif self._reobj_grenades["gas"].search(_txt):
-				_order["grenade"] = "gas"
-			elif self._reobj_grenades["launcher"].search(_txt):
-				_order["grenade"] = "launcher"
-			elif self._reobj_grenades["none"].search(_txt) and self._so_state == 2:
-				_order["grenade"] = "none"
-			elif self._so_state == 2:
-				_order["grenade"] = "no_match"
-			# skip below while step order
-			if self._so_state == 2:
-				_order["action"] = "so_grenade"
-				return _order
-
-		# npc
-		elif self._reobj_npc["base"].search(_txt):
-			_order["action"] = "npc"
-			if self._reobj_npc["me"].search(_txt):
-				_order["option"] = "me"
-			elif self._reobj_npc["stop"].search(_txt):
-				_order["option"] = "stop"
-			elif self._reobj_npc["turn"].search(_txt):
-				_order["option"] = "turn"
-			elif self._reobj_npc["exit"].search(_txt):
-				_order["option"] = "exit"
-			elif self._reobj_npc["here"].search(_txt):
-				_order["option"] = "here"
-			else:
-				_order["option"] = "me"
-
-		# formation
-		elif self._reobj_formations["base"].search(_txt):
-			_order["action"] = "fallin"
-			if self._reobj_formations["single"].search(_txt):
-				_order["option"] = "single"
-			elif self._reobj_formations["double"].search(_txt):
-				_order["option"] = "double"
-			elif self._reobj_formations["diamond"].search(_txt):
-				_order["option"] = "diamond"
-			elif self._reobj_formations["wedge"].search(_txt):
-				_order["option"] = "wedge"
-			else:
-				_order["option"] = "single"
-
-		# door
-		elif self._reobj_door["wedge"].search(_txt):
-			_order["action"] = "door"
-			_order["option"] = "wedge"
-		elif self._reobj_door["mirror"].search(_txt):
-			_order["action"] = "door"
-			_order["option"] = "mirror"
-		elif self._reobj_door["disarm"].search(_txt):
-			_order["action"] = "door"
-			_order["option"] = "disarm"
-
-		# door2
-		elif self._reobj_door2["base"].search(_txt):
-			_order["action"] = "door"
-			if self._reobj_door2["cover"].search(_txt):
-				_order["option"] = "cover"
-			elif self._reobj_door2["open"].search(_txt):
-				_order["option"] = "open"
-			elif self._reobj_door2["close"].search(_txt):
-				_order["option"] = "close"
-			else:
-				_order["option"] = "cover"
-
-		# picking
-		elif self._reobj_picking["base"].search(_txt):
-			_order["action"] = "pick"
-
-		# scan
-		elif self._reobj_scan["pie"].search(_txt):
-			_order["action"] = "scan"
-			_order["option"] = "pie"
-		elif self._reobj_scan["slide"].search(_txt):
-			_order["action"] = "scan"
-			_order["option"] = "slide"
-		elif self._reobj_scan["peak"].search(_txt):
-			_order["action"] = "scan"
-			_order["option"] = "peak"
+	# an order which makes _do_action press something
+	def _is_actionable(self, order):
+		return order["action"] != "none" or order["color"] != "none"
 
-		# ground
-		elif self._reobj_ground["move"].search(_txt):
-			_order["action"] = "ground"
-			_order["option"] = "move"
-		elif self._reobj_ground["cover"].search(_txt):
-			_order["action"] = "ground"
-			_order["option"] = "cover"
-		elif self._reobj_ground["halt"].search(_txt):
-			_order["action"] = "ground"
-			_order["option"] = "halt"
-		elif self._reobj_ground["resume"].search(_txt):
-			_order["action"] = "ground"
-			_order["option"] = "resume"
-		elif self._reobj_ground["search"].search(_txt):
-			_order["action"] = "ground"
-			_order["option"] = "search"
+	# step order timeout. be called from check_rules while step order
+	def _check_so_timeout(self):
+		if self._is_so_expired(): self._quit_so(1) # step order timeout
 
-		# deployables
-		elif self._reobj_deployables["flash"].search(_txt):
-			_order["action"] = "deploy"
-			_order["option"] = "flash"
-		elif self._reobj_deployables["stinger"].search(_txt):
-			_order["action"] = "deploy"
-			_order["option"] = "stinger"
-		elif self._reobj_deployables["gas"].search(_txt):
-			_order["action"] = "deploy"
-			_order["option"] = "gas"
-		elif self._reobj_deployables["chemlight"].search(_txt):
-			_order["action"] = "deploy"
-			_order["option"] = "chemlight"
-		elif self._reobj_deployables["shield"].search(_txt):
-			_order["action"] = "deploy"
-			_order["option"] = "shield"
-
-		# restrain
-		elif self._reobj_restrain["base"].search(_txt):
-			_order["action"] = "restrain"
+	def _is_so_expired(self):
+		return (datetime.datetime.now() - self._so_lasttime).total_seconds() >= self._so_timeout
 
-		# gadget
-		elif self._reobj_gadgets["taser"].search(_txt):
-			_order["action"] = "gadget"
-			_order["option"] = "taser"
-		elif self._reobj_gadgets["spray"].search(_txt):
-			_order["action"] = "gadget"
-			_order["option"] = "spray"
-		elif self._reobj_gadgets["ball"].search(_txt):
-			_order["action"] = "gadget"
-			_order["option"] = "ball"
-		elif self._reobj_gadgets["beanbag"].search(_txt):
-			_order["action"] = "gadget"
-			_order["option"] = "beanbag"
-		elif self._reobj_gadgets["melee"].search(_txt):
-			_order["action"] = "gadget"
-			_order["option"] = "melee"
-
-		# action
-		elif self._reobj_actions["move"].search(_txt):
-			_order["action"] = "team_action"
-			# movement
-			if self._reobj_movements["there"].search(_txt):
-				_order["option"] = "move_there"
-			elif self._reobj_movements["back"].search(_txt):
-				_order["option"] = "move_back"
-			else:
-				_order["option"] = "move_there"
-		elif self._reobj_actions["focus"].search(_txt):
-			_order["action"] = "team_action"
-			# focus
-			if self._reobj_focus["here"].search(_txt):
-				_order["option"] = "focus_here"
-			elif self._reobj_focus["me"].search(_txt):
-				_order["option"] = "focus_me"
-			elif self._reobj_focus["door"].search(_txt):
-				_order["option"] = "focus_door"
-			elif self._reobj_focus["target"].search(_txt):
-				_order["option"] = "focus_target"
-			elif self._reobj_focus["unfocus"].search(_txt):
-				_order["option"] = "focus_unfocus"
-			else:
-				_order["option"] = "focus_me"
-		elif self._reobj_actions["unfocus"].search(_txt):
-			_order["action"] = "team_action"
-			_order["option"] = "unfocus"
-		elif self._reobj_actions["swap"].search(_txt):
-			_order["action"] = "team_action"
-			_order["option"] = "swap"
-		elif self._reobj_actions["search"].search(_txt):
-			_order["action"] = "team_action"
-			_order["option"] = "search"
+	# statistics. OPTIONAL. be printed by main program on exit.
+	def get_stats(self):
+		return {
+			"order_cache": self._order_cache.get_stats(),
+			"nbest": {"utterances": self._nbest_utterances, "rescued": self._nbest_rescued},
+			"keys": self._scheduler.get_stats(),
+			"input": self._backend.get_stats(),
+		}
 
-		# default
-		elif self._reobj_default["base"].search(_txt):
-			_order["action"] = "default"
+	# ##################################################
+	# Close method. OPTIONAL. be called by main program on exit.
+	# ##################################################
+	def close(self):
+		# the keys already scheduled are pushed (and held keys released)
+		self._scheduler.stop(timeout=5)
+		self._backend.close()
 
-		# member
-		# it's not used so far.
+	# ##################################################
+	# Key bindings. OPTIONAL. change in-game key bindings while running (e.g. after the game settings changed).
+	# ##################################################
+	def set_key_bindings(self, bindings):
+		self._ingame_key_bindings.update(bindings)
+		self._compile_key_bindings()
 
-		return _order
+	# ##################################################
+	# Timing methods. OPTIONAL. be called by sr2ctrl/calibrate.py.
+	# ##################################################
+	def get_timing(self):
+		return self._timing
+
+	def set_timing(self, profile):
+		self._timing = profile
+		self._plans = {}
+
+	# command lists to calibrate by default: the command menu sequences
+	def timing_sequences(self):
+		return (
+			("cmd_menu", "cmd_1", "cmd_4"),
+			("red", "cmd_menu", "cmd_2", "cmd_3"),
+			("gold", "cmd_menu", "cmd_3", "cmd_1", "cmd_2"),
+			("cmd_hold", "blue", "cmd_menu", "cmd_1", "cmd_4"),
+			("cmd_menu", "cmd_back"),
+		)
+
+	# the keys whose interval the command list waits (the last one waits for the next command only)
+	def timing_keys(self, sequence):
+		return [cmd[len("long_"):] if cmd.startswith("long_") else cmd for cmd in sequence[:-1]]
+
+	def compile_sequence(self, sequence):
+		return self._compile_plan(tuple(sequence), 0)
 
 	# ##################################################
 	# Sub method. OPTIONAL. be called by main method.
@@ -733,7 +626,7 @@ class SR2C:
 		# yell
 		if _action == "yell":
 			_command.append("yell")
-			self._push_command(_command)
+			self._push_command(_command, action_priorities["yell"])
 			return
 
 		# interact
@@ -813,7 +706,7 @@ class SR2C:
 			return
 		if _action == "so_cancel":
 			_command.append("cmd_menu")
-			self._push_command(_command)
+			self._push_command(_command, action_priorities["so_cancel"])
 			self._quit_so(0) # step order cancel
 			return
 
@@ -850,7 +743,7 @@ class SR2C:
 			return
 		elif _action == "cancel":
 			_command.append("cmd_2")
-			self._push_command(_command)
+			self._push_command(_command, action_priorities["cancel"])
 			return
 
 		# stack
@@ -1118,57 +1011,56 @@ class SR2C:
 				_cmd = "cmd_6"
 		return _cmd
 
-	# a part of _do_action method
-	def _push_command(self, command):
-		_is_long = False
-		_hold_key = ""
-		_hold_is_mouse = False
-		_push_interval = 0.06 # interbal between normal key push
+	# a part of _do_action method. the keys are injected by the key scheduler: returns at once
+	def _push_command(self, command, priority=0):
 		if not self._test_mode:
-			for cmd in command:
-				if "long_" in cmd:
-					_is_long = True
-					_cmd = cmd.replace("long_", "")
-				else:
-					_cmd = cmd
-				_key = self._ingame_key_bindings[_cmd]
-				_is_hold = False
-				_is_mouse = False
-				if "mouse_" in _key:
-					_is_mouse = True
-					_key = _key.replace("mouse_", "")
-				if _is_long:
-					self._push_key(_key, _is_mouse, is_hold=True, up=False)
-					time.sleep(self._long_push_time)
-					self._push_key(_key, _is_mouse, is_hold=True, up=True)
-					time.sleep(_push_interval)
-					continue
-				if _cmd == "cmd_hold":
-					_is_hold = True
-					_hold_key = _key
-					if _is_mouse:
-						_hold_is_mouse = True
-				self._push_key(_key, _is_mouse, _is_hold, up=False)
-				time.sleep(_push_interval)
-			if _hold_key != "":
-				self._push_key(_hold_key, _hold_is_mouse, True, up=True)
+			_plan_key = (tuple(command), priority)
+			_timeline = self._plans.get(_plan_key)
+			if _timeline is None:
+				_timeline = self._plans[_plan_key] = self._compile_plan(_plan_key[0], priority)
+			self._scheduler.submit(_timeline)
 		print(self._txt_label_keys + str(command))	# debug
 
-	# a part of _push_command method
-	def _push_key(self, key, is_mouse, is_hold, up):
-		if is_mouse:
-			if is_hold:
-				if up:
-					mouse.release(button=key)
-				else:
-					mouse.press(button=key)
-			else:
-				mouse.click(button=key)
-		else:
-			if is_hold:
-				if up:
-					keyboard.send(hotkey=key, do_press=False, do_release=True)
-				else:
-					keyboard.send(hotkey=key, do_press=True, do_release=False)
-			else:
-				keyboard.send(hotkey=key, do_press=True, do_release=True)
+	# a part of _push_command method. the key plan of a command list, with the resolved keys.
+	# compiled once per command list: pushing it again only submits the same events
+	def _compile_plan(self, command, priority):
+		_hold_key = None
+		_timeline = keysched.Timeline(command, priority)
+		for cmd in command:
+			_is_long = cmd.startswith("long_")
+			_cmd = cmd[len("long_"):] if _is_long else cmd
+			_key, _is_mouse = self._key_events[_cmd]
+			_push_interval = self._timing.interval_after(_cmd) # interval before the next key
+			if _is_long:
+				_timeline.press(_key, _is_mouse).wait(self._long_push_time)
+				_timeline.release(_key, _is_mouse).wait(_push_interval)
+				continue
+			if _cmd == "cmd_hold":
+				# kept pressed until the end of the command
+				_hold_key = (_key, _is_mouse)
+				_timeline.press(_key, _is_mouse).wait(_push_interval)
+				continue
+			_timeline.tap(_key, _is_mouse).wait(_push_interval)
+		if _hold_key is not None:
+			_timeline.release(*_hold_key)
+		return _timeline.freeze()
+
+	# resolve the key bindings for the input backend (e.g. hotkeys into scan codes) once,
+	# instead of on every key. the compiled key plans are dropped
+	def _compile_key_bindings(self):
+		self._key_events = {}
+		for _name, _key in self._ingame_key_bindings.items():
+			_is_mouse = _key.startswith("mouse_")
+			if _is_mouse:
+				_key = _key[len("mouse_"):]
+			try:
+				self._key_events[_name] = (self._backend.resolve(_key, _is_mouse), _is_mouse)
+			except ValueError as e:
+				# kept as it is: the injection reports it
+				print(f"WARNING: invalid key '{_key}' for '{_name}'! ({e})")
+				self._key_events[_name] = (_key, _is_mouse)
+		self._plans = {} # (command list, priority) -> frozen timeline
+
+	# key scheduler callback. be called on the injection thread after a plan cut the running ones
+	def _on_preempt(self, info):
+		print(f"(!) PREEMPTED {info['cancelled']} by {info['by']}: {info['released']} key(s) released in {info['duration_ms']:.2f} ms")
@@ -58,6 +58,7 @@ kw_sample = {		# 大まかにコマンドの種類ごとのグループに変数
 					# その「言葉」のバリエーションを「絶対ヒットしないであろうワードのみ」にしてください。
 					# （例えば記号の羅列や、意味のない外国語の文字列など）
 					# 特に 句読点"、。" や カンマ"，," は、認識結果テキストから除外しているためオススメです。
+					# （認識結果テキストとここのワードは、どちらも全角英数字や半角カナが自動で揃えられてから比較されます。）
 					# ※ 空文字"" は逆にあらゆる言葉にヒットしてしまうため、使わないでください。
 		# "不要ワード",	# 使わない言葉は、行頭に"#"を付けることでコメントアウトできます。
 	),
@@ -133,16 +134,17 @@ kw_number = {
 	"base": ("ばん", "番", "盤", "版", r"取[り]*消", "訂正",),
 	# ↑"バン"はフラッシュバンと競合するので不使用
 	# ↑"back"と同じ中身も入れておくこと
-	"1": ("いち", r"[一壱Ⅰⅰ①１1]",),
-	"2": ("に", r"[二弐Ⅱⅱ②２2]",),
-	"3": ("さん", r"[三参Ⅲⅲ③３3]",),
-	"4": ("よん", "よ", r"[四Ⅳⅳ④４4]",),
-	"5": ("ご", r"[五伍碁Ⅴⅴ⑤５5]",),
-	"6": ("ろく", r"[六Ⅵⅵ⑥６6]",),
-	"7": ("なな", "ナナ", r"[七Ⅶⅶ⑦７7]",),
-	"8": ("はち", "ハチ", r"[八Ⅷⅷ⑧８8]",),
-	"9": ("きゅう", "キュウ", r"[九旧吸Ⅸⅸ⑨９9]",),
-	"0": ("ぜろ", "ゼロ", "zero", "Zero", "ZERO", r"[〇零０0]",),
+	# ↓全角の数字や丸数字（"１"や"①"）は自動で半角（"1"）に揃えられるので、半角だけ書けばよい
+	"1": ("いち", r"[一壱Ⅰⅰ1]",),
+	"2": ("に", r"[二弐Ⅱⅱ2]",),
+	"3": ("さん", r"[三参Ⅲⅲ3]",),
+	"4": ("よん", "よ", r"[四Ⅳⅳ4]",),
+	"5": ("ご", r"[五伍碁Ⅴⅴ5]",),
+	"6": ("ろく", r"[六Ⅵⅵ6]",),
+	"7": ("なな", "ナナ", r"[七Ⅶⅶ7]",),
+	"8": ("はち", "ハチ", r"[八Ⅷⅷ8]",),
+	"9": ("きゅう", "キュウ", r"[九旧吸Ⅸⅸ9]",),
+	"0": ("ぜろ", "ゼロ", "zero", "Zero", "ZERO", r"[〇零0]",),
 	"back": (r"取[り]*消", "訂正",), # １階層戻る
 }
 
@@ -711,3 +713,13 @@ kw_team_members = {
 		"デルタ",
 	),
 }
+
+# 同じ発話（認識結果）から判定したコマンドを覚えておく件数（0で無効）
+# よく使う言葉の判定が省略されて速くなります
+order_cache_size = 256
+
+# あいまい一致の許容文字数（0で無効）
+# どのキーワードにも当てはまらなかったとき、読み（ひらがな）がこの文字数以内の違いで似ているキーワードを探して判定し直します
+# 上で列挙している聞き間違い（"ベッド"、"別途"など）にない言い間違いも拾えるようになりますが、誤爆も増えます
+# 短いキーワード（読みが２文字以下）は対象外です。漢字の読みを使うにはpykakasiのインストールが必要です
+fuzzy_max_distance = 0
@@ -0,0 +1,292 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# Key scheduler. injects the keys of the grammars on a dedicated thread.
+#
+# a grammar turns a command into a timeline: its key events (tap, press, release) with their time offsets.
+# submit() puts the events into a timer queue and returns at once, so the grammar takes the next text
+# while the keys of a long hold are still pressed. the injection thread fires each event at its deadline
+# on the monotonic clock (perf_counter_ns), and measures how late it was (drift).
+# timelines never overlap: a timeline submitted while another one is running starts after its end.
+#
+# a timeline has a priority. a timeline with a higher priority than the running / waiting ones
+# (e.g. a cancel) preempts them: their events left are dropped, the keys and mouse buttons they hold
+# are released, and the new timeline starts at once. the injection thread does the releases, so a key
+# being pressed at that moment is released too. each preemption is reported to on_preempt with its duration.
+#
+import time
+import heapq
+import itertools
+import threading
+
+from sr2ctrl import latency
+
+TAP = "tap"
+PRESS = "press"
+RELEASE = "release"
+# internal: releases the keys of preempted timelines
+_CLEANUP = "cleanup"
+
+# the last part of a wait is slept instead of waited on the condition, which is coarse on some platforms
+_spin_ns = 2_000_000
+# an event this late counts as late
+_late_ns = 2_000_000
+
+
+# ##################################################
+# Timeline of one command
+# ##################################################
+class Timeline(object):
+	__slots__ = ("label", "priority", "events", "duration")
+
+	def __init__(self, label="", priority=0):
+		self.label = label
+		self.priority = priority # preempts the timelines of a lower priority
+		self.events = [] # (offset ns, kind, key, is_mouse), in order
+		self.duration = 0 # offset ns of the end. the next timeline starts here
+
+	def _add(self, kind, key, is_mouse):
+		if type(self.events) is tuple:
+			raise ValueError(f"timeline {self.label} is frozen")
+		self.events.append((self.duration, kind, key, is_mouse))
+		return self
+
+	def tap(self, key, is_mouse=False):
+		return self._add(TAP, key, is_mouse)
+
+	def press(self, key, is_mouse=False):
+		return self._add(PRESS, key, is_mouse)
+
+	def release(self, key, is_mouse=False):
+		return self._add(RELEASE, key, is_mouse)
+
+	def wait(self, seconds):
+		self.duration += int(seconds * 1e9)
+		return self
+
+	def freeze(self):
+		# the events as a tuple. a frozen timeline (a compiled key plan) can be submitted again and again
+		self.events = tuple(self.events)
+		return self
+
+
+class _Run(object):
+	# a submitted timeline
+	__slots__ = ("timeline", "trace", "remaining", "end", "held", "cancelled")
+
+
+class _Preemption(object):
+	# the runs preempted by one timeline
+	__slots__ = ("by", "runs", "start")
+	cancelled = False # never dropped from the queue
+
+
+# ##################################################
+# Scheduler
+# ##################################################
+class KeyScheduler(object):
+	def __init__(self, inject, on_preempt=None):
+		# inject: inject(kind, key, is_mouse) sends one key event to the system. called on the injection thread.
+		# on_preempt: on_preempt(info) after a preemption, with info = {"by", "cancelled", "released", "duration_ms"}.
+		# called on the injection thread
+		self._inject = inject
+		self._on_preempt = on_preempt
+		self._cond = threading.Condition()
+		self._heap = [] # (deadline ns, sequence, event, run)
+		self._sequence = itertools.count()
+		self._busy_until = 0 # deadline ns of the end of the last timeline
+		self._active = [] # runs not ended yet
+		self._injecting = False # an event taken from the queue is being fired
+		self._stopping = False
+		# counters
+		self._timelines = 0
+		self._queued = 0 # timelines which waited for the one before
+		self._events = 0
+		self._late = 0
+		self._drift_total = 0
+		self._drift_max = 0
+		self._preemptions = 0
+		self._preempted = 0 # timelines cut
+		self._released = 0 # keys released by preemptions
+		self._preempt_total = 0
+		self._preempt_max = 0
+		self._thread = threading.Thread(target=self._loop, name="SR2C key scheduler", daemon=True)
+		self._thread.start()
+
+	def submit(self, timeline):
+		# schedule the events of the timeline and return at once.
+		# the latency trace of the text being dispatched goes with it and is recorded after the last key
+		_run = _Run()
+		_run.timeline = timeline
+		_run.trace = latency.detach()
+		_run.remaining = len(timeline.events)
+		_run.held = [] # (key, is_mouse) pressed and not released yet. used on the injection thread only
+		_run.cancelled = False
+		_now = time.perf_counter_ns()
+		with self._cond:
+			if self._stopping:
+				raise RuntimeError("key scheduler stopped")
+			self._active = [_r for _r in self._active if _r.end > _now or _r.remaining > 0]
+			_lower = [_r for _r in self._active if _r.timeline.priority < timeline.priority]
+			if _lower:
+				self._preempt(timeline, _lower, _now)
+			_start = _now
+			if self._busy_until > _now:
+				_start = self._busy_until
+				self._queued += 1
+			_run.end = _start + timeline.duration
+			self._busy_until = _run.end
+			self._timelines += 1
+			self._active.append(_run)
+			for _event in timeline.events:
+				heapq.heappush(self._heap, (_start + _event[0], next(self._sequence), _event, _run))
+			self._cond.notify_all()
+		if _run.remaining == 0:
+			latency.finish(_run.trace)
+
+	def _preempt(self, timeline, runs, now):
+		# drop the events of the runs and release their keys before anything else. called with the lock
+		for _run in runs:
+			_run.cancelled = True
+		self._heap = [_entry for _entry in self._heap if not _entry[3].cancelled]
+		heapq.heapify(self._heap)
+		self._active = [_r for _r in self._active if not _r.cancelled]
+		self._busy_until = max((_r.end for _r in self._active), default=0)
+		# a run with no event left was only waiting for its end: nothing to cut
+		_cut = [_r for _r in runs if _r.remaining > 0]
+		if _cut:
+			_preemption = _Preemption()
+			_preemption.by = timeline.label
+			_preemption.runs = _cut
+			_preemption.start = now
+			heapq.heappush(self._heap, (now, next(self._sequence), (0, _CLEANUP, None, False), _preemption))
+
+	def _loop(self):
+		while True:
+			with self._cond:
+				while not self._heap and not self._stopping:
+					self._cond.wait()
+				if not self._heap:
+					return
+				_deadline = self._heap[0][0]
+				_remaining = _deadline - time.perf_counter_ns()
+				if _remaining > _spin_ns:
+					# woken up early by a submit: look at the head again
+					self._cond.wait((_remaining - _spin_ns) / 1e9)
+					continue
+				_deadline, _seq, _event, _run = heapq.heappop(self._heap)
+				self._injecting = True
+			try:
+				if _event[1] == _CLEANUP:
+					self._cleanup(_run)
+				else:
+					self._fire(_deadline, _event, _run)
+			finally:
+				with self._cond:
+					self._injecting = False
+					self._cond.notify_all()
+
+	def _fire(self, deadline, event, run):
+		_remaining = deadline - time.perf_counter_ns()
+		if _remaining > 0:
+			time.sleep(_remaining / 1e9)
+		with self._cond:
+			if run.cancelled:
+				# preempted while waiting for its deadline
+				return
+		_drift = time.perf_counter_ns() - deadline
+		_offset, _kind, _key, _is_mouse = event
+		self._send(_kind, _key, _is_mouse)
+		if _kind == PRESS:
+			run.held.append((_key, _is_mouse))
+		elif _kind == RELEASE and (_key, _is_mouse) in run.held:
+			run.held.remove((_key, _is_mouse))
+		if run.trace is not None:
+			run.trace.key()
+		with self._cond:
+			self._events += 1
+			self._drift_total += _drift
+			self._drift_max = max(self._drift_max, _drift)
+			if _drift > _late_ns:
+				self._late += 1
+			run.remaining -= 1
+			_done = run.remaining == 0 and not run.cancelled
+		if _done:
+			latency.finish(run.trace)
+
+	def _send(self, kind, key, is_mouse):
+		try:
+			self._inject(kind, key, is_mouse)
+		except Exception as e:
+			print(f"ERROR: key injection failed! ({kind} {key}: {e})")
+
+	def _cleanup(self, preemption):
+		# release the keys held by the preempted runs, the last pressed first
+		_released = 0
+		for _run in preemption.runs:
+			for _key, _is_mouse in reversed(_run.held):
+				self._send(RELEASE, _key, _is_mouse)
+				_released += 1
+			_run.held = []
+			# the keys pushed so far are recorded
+			latency.finish(_run.trace)
+		_duration = time.perf_counter_ns() - preemption.start
+		with self._cond:
+			self._preemptions += 1
+			self._preempted += len(preemption.runs)
+			self._released += _released
+			self._preempt_total += _duration
+			self._preempt_max = max(self._preempt_max, _duration)
+		if self._on_preempt is not None:
+			_info = {
+				"by": preemption.by,
+				"cancelled": [_run.timeline.label for _run in preemption.runs],
+				"released": _released,
+				"duration_ms": _duration / 1e6,
+			}
+			try:
+				self._on_preempt(_info)
+			except Exception as e:
+				print(f"ERROR: preemption callback failed! ({e})")
+
+	def wait_idle(self, timeout=None):
+		# wait until every submitted timeline has ended (e.g. a benchmark between two texts).
+		# returns False on timeout
+		_limit = None if timeout is None else time.perf_counter_ns() + int(timeout * 1e9)
+		with self._cond:
+			while True:
+				_now = time.perf_counter_ns()
+				if not self._heap and not self._injecting and self._busy_until <= _now:
+					return True
+				_wait = 0.01
+				if _limit is not None:
+					if _now >= _limit:
+						return False
+					_wait = min(_wait, (_limit - _now) / 1e9)
+				self._cond.wait(_wait)
+
+	def stop(self, timeout=None):
+		# let the scheduled events fire (held keys are released by their timelines), then end the thread
+		with self._cond:
+			self._stopping = True
+			self._cond.notify_all()
+		self._thread.join(timeout)
+		return not self._thread.is_alive()
+
+	def get_stats(self):
+		with self._cond:
+			return {
+				"timelines": self._timelines,
+				"queued": self._queued,
+				"events": self._events,
+				"late": self._late,
+				"drift_avg_ms": self._drift_total / self._events / 1e6 if self._events else 0.0,
+				"drift_max_ms": self._drift_max / 1e6,
+				"preemptions": self._preemptions,
+				"preempted": self._preempted,
+				"released": self._released,
+				"preempt_avg_ms": self._preempt_total / self._preemptions / 1e6 if self._preemptions else 0.0,
+				"preempt_max_ms": self._preempt_max / 1e6,
+			}
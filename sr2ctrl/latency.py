@@ -0,0 +1,173 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# Latency trace. follows one recognition text from its arrival to the last injected key.
+#
+# every stage puts a perf_counter_ns mark on the trace of the text, in this order:
+#   receive    the receive engine woke up with the data (the start of the trace)
+#   decode     the text was taken out of the received bytes
+#   ptt        the PTT gate let it through
+#   normalize  the text was normalized and handed to the queue
+#   queue      the dispatcher took it from the queue
+#   do_check   the grammar decided the order
+#   first_key  the first key was injected
+#   last_key   the last key was injected
+#   do_action  the grammar finished the action
+# the time of a stage is the time since the previous mark, so the stages add up to the total.
+# grammars only call mark(), action() and key(). they are no-ops when tracing is off.
+# keys injected on another thread (sr2ctrl/keysched.py): the trace is taken over by detach() and
+# recorded by finish() after the last key, "do_action" being the end of the injection.
+#
+import time
+import threading
+import collections
+
+stages = ("decode", "ptt", "normalize", "queue", "do_check", "first_key", "last_key", "do_action")
+
+_enabled = False
+_local = threading.local()
+_lock = threading.Lock()
+_window = 512
+# stage -> recent durations (ns)
+_stage_samples = {}
+# action -> (recent receive-to-first-key durations, recent total durations) (ns)
+_action_samples = {}
+
+
+# ##################################################
+# Trace of one text
+# ##################################################
+class Trace(object):
+	__slots__ = ("marks", "action")
+
+	def __init__(self, received_ns):
+		self.marks = [("receive", received_ns)]
+		self.action = None
+
+	def mark(self, stage, ns=None):
+		self.marks.append((stage, time.perf_counter_ns() if ns is None else ns))
+
+	def key(self):
+		_ns = time.perf_counter_ns()
+		if self.marks[-1][0] == "last_key":
+			self.marks[-1] = ("last_key", _ns)
+		else:
+			# a single key is the first and the last key
+			self.marks.append(("first_key", _ns))
+			self.marks.append(("last_key", _ns))
+
+
+def enable(window=512):
+	global _enabled, _window
+	_window = window
+	_enabled = True
+
+def is_enabled():
+	return _enabled
+
+def start(received_ns):
+	# a new trace, or None when tracing is off
+	return Trace(received_ns) if _enabled else None
+
+
+# ##################################################
+# Dispatcher side. the trace of the text being dispatched is kept per thread.
+# ##################################################
+def begin(trace):
+	_local.trace = trace
+	if trace is not None:
+		trace.mark("queue")
+
+def end():
+	_trace = getattr(_local, "trace", None)
+	_local.trace = None
+	if _trace is not None:
+		_record(_trace)
+
+def mark(stage):
+	_trace = getattr(_local, "trace", None)
+	if _trace is not None:
+		_trace.mark(stage)
+
+def action(name):
+	_trace = getattr(_local, "trace", None)
+	if _trace is not None:
+		_trace.action = name
+
+def key():
+	_trace = getattr(_local, "trace", None)
+	if _trace is not None:
+		_trace.key()
+
+def detach():
+	# the trace of the text being dispatched, which end() will not record any more (see finish())
+	_trace = getattr(_local, "trace", None)
+	_local.trace = None
+	return _trace
+
+def finish(trace):
+	# record a detached trace. thread safe
+	if trace is not None:
+		trace.mark("do_action")
+		_record(trace)
+
+
+def _record(trace):
+	_marks = trace.marks
+	with _lock:
+		for _i in range(1, len(_marks)):
+			_stage, _ns = _marks[_i]
+			_samples = _stage_samples.get(_stage)
+			if _samples is None:
+				_samples = _stage_samples[_stage] = collections.deque(maxlen=_window)
+			_samples.append(_ns - _marks[_i - 1][1])
+		if trace.action is not None:
+			_samples = _action_samples.get(trace.action)
+			if _samples is None:
+				_samples = _action_samples[trace.action] = (collections.deque(maxlen=_window), collections.deque(maxlen=_window))
+			_first_key = next((_ns for _stage, _ns in _marks if _stage == "first_key"), None)
+			if _first_key is not None:
+				_samples[0].append(_first_key - _marks[0][1])
+			_samples[1].append(_marks[-1][1] - _marks[0][1])
+
+
+# ##################################################
+# Summary
+# ##################################################
+def _percentiles(samples):
+	# nearest rank p50 / p95 / p99 in ms
+	if not samples:
+		return None
+	_sorted = sorted(samples)
+	_n = len(_sorted)
+	return tuple(_sorted[min(_n - 1, (_n * _p + 99) // 100 - 1)] / 1e6 for _p in (50, 95, 99))
+
+def _format(percentiles):
+	if percentiles is None:
+		return f"{'-':>8}{'-':>8}{'-':>8}"
+	return "".join(f"{_v:8.2f}" for _v in percentiles)
+
+def get_stats():
+	with _lock:
+		return {
+			"stages": {_stage: _percentiles(_samples) for _stage, _samples in _stage_samples.items()},
+			"actions": {_action: (len(_samples[1]), _percentiles(_samples[0]), _percentiles(_samples[1])) for _action, _samples in _action_samples.items()},
+		}
+
+def summary():
+	# a printable table of the recent traces
+	with _lock:
+		_stage_rows = [(_stage, len(_stage_samples[_stage]), _percentiles(_stage_samples[_stage])) for _stage in stages if _stage in _stage_samples]
+		_stage_rows += [(_stage, len(_samples), _percentiles(_samples)) for _stage, _samples in _stage_samples.items() if _stage not in stages]
+		_action_rows = [(_action, len(_samples[1]), _percentiles(_samples[0]), _percentiles(_samples[1])) for _action, _samples in sorted(_action_samples.items())]
+	_lines = [f"LATENCY (ms, last {_window} texts)"]
+	_lines.append(f"  {'stage':<12}{'n':>6}{'p50':>8}{'p95':>8}{'p99':>8}")
+	for _stage, _n, _p in _stage_rows:
+		_lines.append(f"  {_stage:<12}{_n:>6}{_format(_p)}")
+	if _action_rows:
+		_lines.append(f"  {'action':<12}{'n':>6}{'first key p50/p95/p99':>24}{'total p50/p95/p99':>24}")
+		for _action, _n, _first, _total in _action_rows:
+			_lines.append(f"  {_action:<12}{_n:>6}{_format(_first)}{_format(_total)}")
+	return "\n".join(_lines)
@@ -0,0 +1,400 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# Keyword matcher. finds every keyword group of a grammar in one scan of the recognition text.
+#
+# every keyword is a re pattern. a pattern with a small finite language ("ドア", r"[一壱1]", r"外[へに]")
+# is expanded to its literals, and all literals of all groups go into one Aho-Corasick automaton.
+# other patterns (r"手(?!前)", r"取[り]*消") are real regexes. they are tried only where the automaton
+# found one of their leading literals, or searched as they are when they have none.
+# a group hits exactly when `re.compile("|".join(patterns)).search(text)` would.
+#
+import re
+import collections
+
+try:
+	from re import _parser as _sre_parse
+except ImportError: # python < 3.11
+	import sre_parse as _sre_parse
+
+_max_literals = 256 # a pattern expanding to more literals than this stays a regex
+_separator = "\x00" # joins the texts of search_keys_many(). no keyword contains it
+
+
+# ##################################################
+# Pattern expansion
+# ##################################################
+def _expand(items, limit=_max_literals):
+	# every string matched by the parsed pattern, or None when it is not a small finite set
+	_acc = [""]
+	for _op, _av in items:
+		_alternatives = _expand_item(_op, _av, limit)
+		if _alternatives is None:
+			return None
+		_acc = [_a + _b for _a in _acc for _b in _alternatives]
+		if len(_acc) > limit:
+			return None
+	return list(dict.fromkeys(_acc))
+
+def _expand_item(op, av, limit):
+	if op is _sre_parse.LITERAL:
+		return [chr(av)]
+	if op is _sre_parse.IN:
+		_chars = []
+		for _op, _av in av:
+			if _op is _sre_parse.LITERAL:
+				_chars.append(chr(_av))
+			elif _op is _sre_parse.RANGE and _av[1] - _av[0] < limit:
+				_chars.extend(chr(_c) for _c in range(_av[0], _av[1] + 1))
+			else:
+				# NEGATE, CATEGORY (\d, \w ...) or a wide range
+				return None
+		return _chars if len(_chars) <= limit else None
+	if op is _sre_parse.SUBPATTERN:
+		_group, _add_flags, _del_flags, _items = av
+		if _add_flags or _del_flags:
+			return None
+		return _expand(_items, limit)
+	if op is _sre_parse.BRANCH:
+		_acc = []
+		for _items in av[1]:
+			_alternatives = _expand(_items, limit)
+			if _alternatives is None:
+				return None
+			_acc.extend(_alternatives)
+			if len(_acc) > limit:
+				return None
+		return _acc
+	if op in (_sre_parse.MAX_REPEAT, _sre_parse.MIN_REPEAT):
+		_min, _max, _items = av
+		if _max is _sre_parse.MAXREPEAT or _max > 8:
+			return None
+		_alternatives = _expand(_items, limit)
+		if _alternatives is None:
+			return None
+		_acc = []
+		_power = [""]
+		for _n in range(_max + 1):
+			if _n >= _min:
+				_acc.extend(_power)
+			_power = [_a + _b for _a in _power for _b in _alternatives]
+			if len(_acc) > limit or len(_power) > limit * limit:
+				return None
+		return _acc if len(_acc) <= limit else None
+	# ANY, AT (anchors), ASSERT / ASSERT_NOT (lookarounds), GROUPREF, atomic groups ...
+	return None
+
+def _leading_literals(items, limit=_max_literals):
+	# literals one of which every match starts with, or None when there are none
+	if len(items) == 1 and items[0][0] is _sre_parse.BRANCH:
+		_acc = []
+		for _branch in items[0][1][1]:
+			_prefixes = _leading_literals(_branch, limit)
+			if _prefixes is None:
+				return None
+			_acc.extend(_prefixes)
+		return list(dict.fromkeys(_acc))
+	_acc = [""]
+	for _op, _av in items:
+		_alternatives = _expand_item(_op, _av, limit)
+		if _alternatives is None:
+			break
+		_next = [_a + _b for _a in _acc for _b in _alternatives]
+		if len(_next) > limit:
+			break
+		_acc = _next
+	if "" in _acc:
+		return None
+	return list(dict.fromkeys(_acc))
+
+def _parse(pattern):
+	try:
+		_parsed = _sre_parse.parse(pattern)
+	except re.error:
+		return None
+	if _parsed.state.flags & (re.IGNORECASE | re.LOCALE):
+		return None
+	return list(_parsed)
+
+def literals(pattern):
+	# every string the pattern matches, or None when it is not a small finite set (e.g. r"手(?!前)")
+	_items = _parse(pattern)
+	return None if _items is None else _expand(_items)
+
+def leading_literals(pattern):
+	# literals one of which every match of the pattern starts with, or None when there are none (e.g. r"(?<!再)装填")
+	_items = _parse(pattern)
+	return None if _items is None else _leading_literals(_items)
+
+
+# ##################################################
+# Keyword matcher
+# ##################################################
+class KeywordMatcher(object):
+	def __init__(self, groups, normalizer=None, keys=None):
+		# groups: {group name: {word name: (pattern, ...)}}, e.g. {"colors": params.kw_colors}.
+		# hits are reported as "group.word", e.g. "colors.gold".
+		# keys: only these "group.word" go into the matcher (e.g. the keywords of one grammar state)
+		self.keys = []
+		self._always = [] # keys whose pattern matches the empty string, i.e. every text
+		self._fallbacks = [] # (key, re object), searched on every scan
+		self._gated = [] # (key, re object), tried where the automaton found a leading literal
+		_literals = collections.defaultdict(set) # literal -> keys
+		_gates = collections.defaultdict(set) # leading literal -> indexes of self._gated
+		for _group, _words in groups.items():
+			for _word, _patterns in _words.items():
+				_key = f"{_group}.{_word}"
+				if keys is not None and _key not in keys:
+					continue
+				self.keys.append(_key)
+				if isinstance(_patterns, str):
+					_patterns = (_patterns,)
+				if normalizer is not None:
+					_patterns = tuple(normalizer.pattern(_p) for _p in _patterns)
+				_parsed = [_parse(_p) for _p in _patterns]
+				if not _patterns or any(_p == [] for _p in _parsed):
+					# "" (or no pattern at all) matches anywhere
+					self._always.append(_key)
+					continue
+				if any(_p is None for _p in _parsed):
+					# not understood pattern by pattern: keep the group as one regex
+					self._fallbacks.append((_key, re.compile("|".join(_patterns))))
+					continue
+				for _pattern, _items in zip(_patterns, _parsed):
+					_expanded = _expand(_items)
+					if _expanded is not None:
+						if "" in _expanded:
+							self._always.append(_key)
+							break
+						for _literal in _expanded:
+							_literals[_literal].add(_key)
+						continue
+					_prefixes = _leading_literals(_items)
+					if _prefixes is None:
+						self._fallbacks.append((_key, re.compile(_pattern)))
+						continue
+					self._gated.append((_key, re.compile(_pattern)))
+					for _prefix in _prefixes:
+						_gates[_prefix].add(len(self._gated) - 1)
+		self._always = tuple(dict.fromkeys(self._always))
+		self.literal_count = len(_literals)
+		self.regex_count = len(self._fallbacks) + len(self._gated)
+		self._build(_literals, _gates)
+
+	def _build(self, literals, gates):
+		# trie
+		_goto = [{}]
+		_out = [[]] # node -> [(key, length)]
+		_checks = [[]] # node -> [(gated index, length)]
+		def node_of(literal):
+			_node = 0
+			for _char in literal:
+				_next = _goto[_node].get(_char)
+				if _next is None:
+					_next = len(_goto)
+					_goto[_node][_char] = _next
+					_goto.append({})
+					_out.append([])
+					_checks.append([])
+				_node = _next
+			return _node
+		for _literal, _keys in literals.items():
+			_node = node_of(_literal)
+			_out[_node].extend((_key, len(_literal)) for _key in sorted(_keys, key=self.keys.index))
+		for _literal, _indexes in gates.items():
+			_node = node_of(_literal)
+			_checks[_node].extend((_index, len(_literal)) for _index in sorted(_indexes))
+		# failure links (breadth first), outputs of the suffixes are merged into each node
+		_fail = [0] * len(_goto)
+		# node -> a longer literal may still follow (the node or one of its suffixes has children)
+		_open = [False] * len(_goto)
+		_queue = collections.deque(_goto[0].values())
+		while _queue:
+			_node = _queue.popleft()
+			for _char, _next in _goto[_node].items():
+				_state = _fail[_node]
+				while _state and _char not in _goto[_state]:
+					_state = _fail[_state]
+				_fail[_next] = _goto[_state].get(_char, 0) if _goto[_state].get(_char, 0) != _next else 0
+				_out[_next] = _out[_next] + _out[_fail[_next]]
+				_checks[_next] = _checks[_next] + _checks[_fail[_next]]
+				_open[_next] = bool(_goto[_next]) or _open[_fail[_next]]
+				_queue.append(_next)
+		self._goto = _goto
+		self._fail = _fail
+		self._open = _open
+		# per node: None, or (keys, hits, checks) for search_keys() / scan()
+		self._out = [
+			(tuple(dict.fromkeys(_key for _key, _length in _o)), tuple(_o), tuple(_c)) if (_o or _c) else None
+			for _o, _c in zip(_out, _checks)
+		]
+
+	def to_data(self):
+		# the built structures as plain data (see sr2ctrl/compiled.py)
+		return {
+			"keys": self.keys,
+			"always": self._always,
+			"fallbacks": [(_key, _reobj.pattern) for _key, _reobj in self._fallbacks],
+			"gated": [(_key, _reobj.pattern) for _key, _reobj in self._gated],
+			"goto": self._goto,
+			"fail": self._fail,
+			"open": self._open,
+			"out": self._out,
+			"literal_count": self.literal_count,
+			"regex_count": self.regex_count,
+		}
+
+	@classmethod
+	def from_data(cls, data):
+		_matcher = cls.__new__(cls)
+		_matcher.keys = data["keys"]
+		_matcher._always = data["always"]
+		_matcher._fallbacks = [(_key, re.compile(_pattern)) for _key, _pattern in data["fallbacks"]]
+		_matcher._gated = [(_key, re.compile(_pattern)) for _key, _pattern in data["gated"]]
+		_matcher._goto = data["goto"]
+		_matcher._fail = data["fail"]
+		_matcher._open = data["open"]
+		_matcher._out = data["out"]
+		_matcher.literal_count = data["literal_count"]
+		_matcher.regex_count = data["regex_count"]
+		return _matcher
+
+	def search_keys(self, text):
+		# the set of keys which hit somewhere in the text
+		_keys = set(self._always)
+		_goto = self._goto
+		_fail = self._fail
+		_out = self._out
+		_tried = None
+		_state = 0
+		for _i, _char in enumerate(text):
+			while _state and _char not in _goto[_state]:
+				_state = _fail[_state]
+			_state = _goto[_state].get(_char, 0)
+			_o = _out[_state]
+			if _o is None:
+				continue
+			_keys.update(_o[0])
+			for _index, _length in _o[2]:
+				_key, _reobj = self._gated[_index]
+				if _key in _keys:
+					continue
+				if _reobj.match(text, _i + 1 - _length):
+					_keys.add(_key)
+		for _key, _reobj in self._fallbacks:
+			if _key not in _keys and _reobj.search(text):
+				_keys.add(_key)
+		return _keys
+
+	def search_keys_many(self, texts):
+		# search_keys() of several texts (e.g. n-best hypotheses) in one scan of the joined texts
+		if not texts:
+			return []
+		_joined = _separator.join(texts)
+		_ends = []
+		_end = -1
+		for _text in texts:
+			_end += len(_text) + 1
+			_ends.append(_end)
+		_results = [set(self._always) for _ in texts]
+		_goto = self._goto
+		_fail = self._fail
+		_out = self._out
+		_n = 0
+		_keys = _results[0]
+		_state = 0
+		for _i, _char in enumerate(_joined):
+			if _char == _separator:
+				_n += 1
+				_keys = _results[_n]
+				_state = 0
+				continue
+			while _state and _char not in _goto[_state]:
+				_state = _fail[_state]
+			_state = _goto[_state].get(_char, 0)
+			_o = _out[_state]
+			if _o is None:
+				continue
+			_keys.update(_o[0])
+			for _index, _length in _o[2]:
+				_key, _reobj = self._gated[_index]
+				if _key in _keys:
+					continue
+				# endpos: the regex sees the end of this text, as search_keys() does
+				if _reobj.match(_joined, _i + 1 - _length, _ends[_n]):
+					_keys.add(_key)
+		for _key, _reobj in self._fallbacks:
+			for _text, _keys in zip(texts, _results):
+				if _key not in _keys and _reobj.search(_text):
+					_keys.add(_key)
+		return _results
+
+	@property
+	def regex_keys(self):
+		# keys with a pattern which stays a regex. can_grow() doesn't see them, and a lookaround
+		# may stop hitting when the text grows: rules.RuleTable.mark_regex_keys() keeps their rules from running early
+		return frozenset(_key for _key, _reobj in (*self._fallbacks, *self._gated))
+
+	def can_grow(self, text):
+		# True when the end of the text is the start of a literal: a longer text may hit another keyword
+		# (e.g. "行け" growing into "行け行け"). used for partial texts of streaming recognition.
+		# literals only (see regex_keys)
+		_goto = self._goto
+		_fail = self._fail
+		_state = 0
+		for _char in text:
+			while _state and _char not in _goto[_state]:
+				_state = _fail[_state]
+			_state = _goto[_state].get(_char, 0)
+		return self._open[_state] if _state else False
+
+	def scan(self, text):
+		# every hit as (key, start, end), in order of the end position. regex hits are the re match spans
+		_hits = [(_key, 0, 0) for _key in self._always]
+		_goto = self._goto
+		_fail = self._fail
+		_out = self._out
+		_state = 0
+		for _i, _char in enumerate(text):
+			while _state and _char not in _goto[_state]:
+				_state = _fail[_state]
+			_state = _goto[_state].get(_char, 0)
+			_o = _out[_state]
+			if _o is None:
+				continue
+			for _key, _length in _o[1]:
+				_hits.append((_key, _i + 1 - _length, _i + 1))
+			for _index, _length in _o[2]:
+				_key, _reobj = self._gated[_index]
+				_m = _reobj.match(text, _i + 1 - _length)
+				if _m:
+					_hits.append((_key, _m.start(), _m.end()))
+		for _key, _reobj in self._fallbacks:
+			for _m in _reobj.finditer(text):
+				_hits.append((_key, _m.start(), _m.end()))
+		return _hits
+
+
+# ##################################################
+# Regex matcher. one re object per group, searched one after another (the way grammars did it).
+# the reference for KeywordMatcher in tests and benchmarks.
+# ##################################################
+class RegexMatcher(object):
+	def __init__(self, groups, normalizer=None):
+		self.keys = []
+		self._reobjs = []
+		for _group, _words in groups.items():
+			for _word, _patterns in _words.items():
+				_key = f"{_group}.{_word}"
+				if isinstance(_patterns, str):
+					_patterns = (_patterns,)
+				_pattern = r"|".join(_patterns)
+				if normalizer is not None:
+					_pattern = normalizer.pattern(_pattern)
+				self.keys.append(_key)
+				self._reobjs.append((_key, re.compile(_pattern)))
+
+	def search_keys(self, text):
+		return {_key for _key, _reobj in self._reobjs if _reobj.search(text)}
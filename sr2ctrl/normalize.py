@@ -0,0 +1,89 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+import re
+import unicodedata
+
+# characters removed from every recognition text
+omit_chars = " 　,.，．、。"
+
+# ascii characters which have a special meaning in re patterns
+_regex_special = frozenset(".^$*+?{}[]\\|()-")
+
+
+# width folding: the NFKC mapping restricted to the width variants
+# (ideographic space, full-width ascii, half-width katakana and circled digits).
+# other compatibility characters such as roman numerals "Ⅱ" -> "II" are kept,
+# because they appear inside keyword character classes.
+def _width_fold_map():
+	_map = {}
+	for _code in (0x3000, *range(0xFF01, 0xFFEF), *range(0x2460, 0x2469)):
+		_char = chr(_code)
+		_folded = unicodedata.normalize("NFKC", _char)
+		if _folded != _char and len(_folded) == 1:
+			_map[_code] = _folded
+	return _map
+
+# katakana -> hiragana
+def _kana_fold_map():
+	return {_code: chr(_code - 0x60) for _code in range(0x30A1, 0x30F7)}
+
+
+# ##################################################
+# Text normalizer. built once, one str.translate pass per message.
+# ##################################################
+class TextNormalizer(object):
+	def __init__(self, omit=omit_chars, width_fold=True, kana_fold=False):
+		_fold = {}
+		if width_fold:
+			_fold.update(_width_fold_map())
+		if kana_fold:
+			_kana = _kana_fold_map()
+			for _code, _folded in _fold.items():
+				_fold[_code] = _folded.translate(_kana)
+			for _code, _folded in _kana.items():
+				_fold.setdefault(_code, _folded)
+		self.width_fold = width_fold
+		self.kana_fold = kana_fold
+		# recognition text: fold and delete. one pass: a character folded to an omitted one is deleted too ("｡" -> "。")
+		self._text_table = dict(_fold)
+		for _code, _folded in _fold.items():
+			if _folded in omit:
+				self._text_table[_code] = None
+		for _char in omit:
+			self._text_table[ord(_char)] = None
+		# keyword pattern: fold only, and keep full-width symbols literal (e.g. "（" -> r"\(")
+		self._pattern_table = {_code: (re.escape(_folded) if _folded in _regex_special else _folded) for _code, _folded in _fold.items()}
+
+	def normalize(self, text):
+		text = text.translate(self._text_table)
+		# half-width voiced sound marks were folded to combining ones: compose them ("ｶﾞ" -> "ガ")
+		if "\u3099" in text or "\u309a" in text:
+			text = unicodedata.normalize("NFC", text)
+		return text
+
+	def pattern(self, pattern):
+		pattern = pattern.translate(self._pattern_table)
+		if "\u3099" in pattern or "\u309a" in pattern:
+			pattern = unicodedata.normalize("NFC", pattern)
+		return pattern
+
+	def compile(self, words):
+		# keyword tuple -> one re object, normalized the same way as the recognition text
+		if isinstance(words, str):
+			words = (words,)
+		return re.compile(self.pattern(r"|".join(words)))
+
+
+# shared instance. main configures it before the grammar is loaded, grammars compile their keywords with it.
+_normalizer = TextNormalizer()
+
+def configure(**kwargs):
+	global _normalizer
+	_normalizer = TextNormalizer(**kwargs)
+	return _normalizer
+
+def get_normalizer():
+	return _normalizer
@@ -0,0 +1,524 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+import os
+import stat
+import time
+import asyncio
+import signal
+import socket
+
+from sr2ctrl import bouyomi
+from sr2ctrl import shmring
+
+# receive modes which take a file path instead of a port
+path_modes = ("unix_dgram", "unix_stream", "shm_ring")
+
+
+# ##################################################
+# UDP mode. one datagram carries one utf-8 recognition text.
+# also serves the unix datagram mode (family=AF_UNIX, address=path)
+# ##################################################
+class UdpReceiver(object):
+	_max_datagram = 65507 # max payload of an IPv4 UDP datagram
+
+	def __init__(self, address, on_texts, family=socket.AF_INET, on_error=None):
+		# on_error: on_error(exception) for a socket error which ends receiving (the engine stops). raised when not given
+		self._on_texts = on_texts
+		self._on_fatal = on_error
+		self._address = address
+		self._family = family
+		self._sock = socket.socket(family, socket.SOCK_DGRAM)
+		try:
+			if family != socket.AF_INET:
+				_remove_stale_socket(address)
+			self._sock.bind(address)
+			self._sock.setblocking(False)
+			# a datagram never exceeds the socket receive buffer, so size the reusable buffer from it.
+			# one spare byte tells an oversized (truncated) datagram apart from a full-size one
+			_rcvbuf = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+			self._max_size = min(_rcvbuf, self._max_datagram)
+			self._buf = bytearray(self._max_size + 1)
+			self._view = memoryview(self._buf)
+		except Exception:
+			self._sock.close()
+			raise
+		self._loop = None
+		self._task = None
+		# counters
+		self.datagrams = 0
+		self.batches = 0
+		self.oversized = 0
+
+	def start(self, loop):
+		self._loop = loop
+		try:
+			# selector loop: drain on every readable wakeup
+			loop.add_reader(self._sock, self._on_readable)
+		except NotImplementedError:
+			# proactor loop (windows): wait with an overlapped recv, then drain
+			self._task = loop.create_task(self._recv_loop())
+
+	def close(self):
+		if self._task is not None:
+			self._task.cancel()
+		elif self._loop is not None:
+			self._loop.remove_reader(self._sock)
+		self._sock.close()
+		if self._family != socket.AF_INET:
+			_remove_stale_socket(self._address)
+
+	def _on_readable(self):
+		_received_ns = time.perf_counter_ns()
+		_texts = []
+		self._drain(_texts)
+		self._hand_over(_texts, _received_ns)
+
+	async def _recv_loop(self):
+		while True:
+			_texts = []
+			try:
+				_n = await self._loop.sock_recv_into(self._sock, self._buf)
+				_received_ns = time.perf_counter_ns()
+				self._take(_n, _texts)
+			except OSError as e:
+				_received_ns = time.perf_counter_ns()
+				if not self._on_error(e):
+					# nothing awaits this task: the error goes to the engine, not raised here
+					return
+			self._drain(_texts)
+			self._hand_over(_texts, _received_ns)
+
+	def _drain(self, texts):
+		# read every pending datagram without blocking
+		while True:
+			try:
+				_n = self._sock.recv_into(self._buf)
+			except (BlockingIOError, InterruptedError):
+				return
+			except OSError as e:
+				if not self._on_error(e):
+					return
+				continue
+			self._take(_n, texts)
+
+	def _take(self, n, texts):
+		if n > self._max_size:
+			self.oversized += 1
+			return
+		self.datagrams += 1
+		if n > 0:
+			texts.append(str(self._view[:n], "utf-8", "replace"))
+
+	def _hand_over(self, texts, received_ns):
+		if texts:
+			self.batches += 1
+			self._on_texts(texts, received_ns)
+
+	def _on_error(self, e):
+		# False when the error ends receiving
+		if getattr(e, "winerror", None) == 10040: # WSAEMSGSIZE: truncated datagram
+			self.oversized += 1
+		elif getattr(e, "winerror", None) == 10054: # WSAECONNRESET: ICMP port unreachable. keep listening
+			pass
+		elif self._on_fatal is None:
+			raise e
+		else:
+			self._on_fatal(e)
+			return False
+		return True
+
+
+# ##################################################
+# YNC Bouyomi mode. one connection carries one bouyomi-chan command.
+# ##################################################
+class BouyomiProtocol(asyncio.Protocol):
+	_idle_timeout = 5 # seconds without any data before a connection is given up
+
+	def __init__(self, sequencer):
+		self._sequencer = sequencer
+		self._transport = None
+		self._parser = bouyomi.BouyomiParser()
+		self._seq = None
+		self._timeout_handle = None
+
+	def connection_made(self, transport):
+		self._transport = transport
+		self._seq = self._sequencer.open()
+		self._arm_timeout()
+
+	def data_received(self, data):
+		if self._seq is None:
+			return
+		self._sequencer.progress(self._seq)
+		try:
+			_commands = self._parser.feed(data)
+		except bouyomi.BouyomiError as e:
+			print(e)
+			self._finish(None)
+			return
+		if _commands:
+			# one command per connection (due to bouyomi-chan spec)
+			_command = _commands[0]
+			self._finish(_command.text if isinstance(_command, bouyomi.BouyomiTalk) else None)
+		else:
+			self._arm_timeout()
+
+	def eof_received(self):
+		# closed before a whole command arrived
+		self._finish(None)
+		return False # close the transport
+
+	def connection_lost(self, exc):
+		self._finish(None)
+
+	def _arm_timeout(self):
+		if self._timeout_handle is not None:
+			self._timeout_handle.cancel()
+		self._timeout_handle = asyncio.get_running_loop().call_later(self._idle_timeout, self._transport.close)
+
+	def _finish(self, text):
+		if self._timeout_handle is not None:
+			self._timeout_handle.cancel()
+			self._timeout_handle = None
+		if self._seq is None:
+			return
+		self._sequencer.finish(self._seq, text)
+		self._seq = None
+		self._transport.close()
+
+
+# ##################################################
+# Unix stream mode. a connection carries any number of utf-8 texts, one per line.
+# ##################################################
+class LineProtocol(asyncio.Protocol):
+	_max_line = 1 << 20
+
+	def __init__(self, deliver):
+		self._deliver = deliver
+		self._transport = None
+		self._buf = bytearray()
+		self._received_ns = 0
+
+	def connection_made(self, transport):
+		self._transport = transport
+
+	def data_received(self, data):
+		self._received_ns = time.perf_counter_ns()
+		self._buf += data
+		_end = self._buf.rfind(b"\n")
+		if _end < 0:
+			if len(self._buf) > self._max_line:
+				print(f"line too long({len(self._buf)} bytes)")
+				self._transport.close()
+			return
+		# every complete line of this chunk is handed over as one batch
+		_lines = self._buf[:_end].split(b"\n")
+		del self._buf[:_end + 1]
+		self._hand_over(_lines)
+
+	def eof_received(self):
+		# an unterminated last line is taken as it is
+		if self._buf:
+			self._hand_over((self._buf,))
+			self._buf = bytearray()
+		return False # close the transport
+
+	def _hand_over(self, lines):
+		_texts = [str(_line, "utf-8", "replace").rstrip("\r") for _line in lines if _line.strip()]
+		if _texts:
+			self._deliver(_texts, self._received_ns)
+
+
+# ##################################################
+# Shared memory ring mode. a recognizer on the same machine writes texts into a mapped file.
+# ##################################################
+class ShmRingReceiver(object):
+	_safety_wait = 0.1 # max seconds asleep without the doorbell (a missed doorbell costs at most this)
+	_linger = 0.05 # seconds to keep polling after the last text
+	_poll_interval = 0.001
+
+	def __init__(self, path, on_texts):
+		self._on_texts = on_texts
+		self._ring = shmring.ShmRing(path)
+		try:
+			# doorbell: the writer sends a datagram here only while the reader is asleep
+			self._bell = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			self._bell.bind(("127.0.0.1", 0))
+			self._bell.setblocking(False)
+		except Exception:
+			self._ring.close()
+			raise
+		self._ring.set_doorbell_port(self._bell.getsockname()[1])
+		self._loop = None
+		self._task = None
+		# counters
+		self.texts = 0
+		self.batches = 0
+		self.wakeups = 0
+
+	def start(self, loop):
+		self._loop = loop
+		self._task = loop.create_task(self._run())
+
+	def close(self):
+		if self._task is not None:
+			self._task.cancel()
+		self._bell.close()
+		self._ring.close()
+
+	async def _run(self):
+		_idle_since = None
+		while True:
+			_texts = []
+			_received_ns = time.perf_counter_ns()
+			self._ring.drain(_texts)
+			if not _texts and _idle_since is None:
+				_idle_since = self._loop.time()
+			if not _texts and (self._loop.time() - _idle_since) < self._linger:
+				# keep polling a while after the last text: the writer of a burst needs no doorbell
+				await asyncio.sleep(self._poll_interval)
+				continue
+			if not _texts:
+				# announce the sleep, then look once more: a text written meanwhile is not missed
+				self._ring.set_sleeping(True)
+				self._ring.drain(_texts)
+				if not _texts:
+					try:
+						await asyncio.wait_for(self._loop.sock_recv(self._bell, 16), self._safety_wait)
+						self.wakeups += 1
+					except asyncio.TimeoutError:
+						pass
+				self._ring.set_sleeping(False)
+				self._clear_doorbell()
+				_received_ns = time.perf_counter_ns()
+				self._ring.drain(_texts)
+			if _texts:
+				_idle_since = None
+				self.texts += len(_texts)
+				self.batches += 1
+				self._on_texts(_texts, _received_ns)
+
+	def _clear_doorbell(self):
+		while True:
+			try:
+				self._bell.recv(16)
+			except (BlockingIOError, InterruptedError):
+				return
+			except OSError:
+				# WSAECONNRESET etc. nothing to read anyway
+				return
+
+
+def _remove_stale_socket(path):
+	# a socket file left by a previous run makes bind() fail. any other file is not ours to remove
+	try:
+		_mode = os.lstat(path).st_mode
+	except FileNotFoundError:
+		return
+	if not stat.S_ISSOCK(_mode):
+		raise ValueError(f"'{path}' exists and is not a socket! (give another path)")
+	try:
+		os.remove(path)
+	except FileNotFoundError:
+		pass
+
+
+# ##################################################
+# Sequencer. releases finished messages of concurrent connections in accept order.
+# ##################################################
+class _Sequencer(object):
+	_order_hold = 0.5 # max seconds a finished message waits for an earlier one still receiving
+
+	def __init__(self, deliver):
+		self._deliver = deliver
+		self._next_seq = 0
+		# seq -> [state, text, started, finished_ns]. state: 0 = no data yet, 1 = receiving, 2 = finished
+		self._entries = {}
+		self._flush_handle = None
+
+	def open(self):
+		_seq = self._next_seq
+		self._next_seq += 1
+		self._entries[_seq] = [0, None, 0.0, 0]
+		return _seq
+
+	def progress(self, seq):
+		_entry = self._entries[seq]
+		if _entry[0] == 0:
+			_entry[0] = 1
+			_entry[2] = asyncio.get_running_loop().time()
+
+	def finish(self, seq, text):
+		_entry = self._entries[seq]
+		_entry[0] = 2
+		_entry[1] = text
+		_entry[3] = time.perf_counter_ns()
+		self._flush()
+
+	def _flush(self):
+		if self._flush_handle is not None:
+			self._flush_handle.cancel()
+			self._flush_handle = None
+		_now = asyncio.get_running_loop().time()
+		_texts = []
+		_received_ns = None
+		for _seq in list(self._entries):
+			_state, _text, _started, _finished_ns = self._entries[_seq]
+			if _state == 2:
+				del self._entries[_seq]
+				if _text is not None:
+					_texts.append(_text)
+					if _received_ns is None or _finished_ns < _received_ns:
+						_received_ns = _finished_ns
+			elif _state == 1 and (_now - _started) < self._order_hold:
+				# keep the order of a burst: wait a little for the earlier message
+				if any(_entry[0] == 2 for _entry in self._entries.values()):
+					_delay = self._order_hold - (_now - _started)
+					self._flush_handle = asyncio.get_running_loop().call_later(_delay, self._flush)
+				break
+			# a connection without data (or stalled too long) does not hold the later ones
+		if _texts:
+			self._deliver(_texts, _received_ns)
+
+
+# ##################################################
+# Receive engine. serves every registered endpoint on one event loop.
+# ##################################################
+class ReceiveEngine(object):
+	def __init__(self, on_texts):
+		# on_texts receives a list of texts arrived in one wakeup, and the perf_counter_ns of the wakeup
+		self._on_texts = on_texts
+		self._endpoints = []
+		self._udp_receivers = []
+		self._shm_receivers = []
+		# texts received per endpoint ("mode:port" -> count)
+		self._received = {}
+		self._loop = None
+		self._stop = None
+		self._error = None
+
+	def add_endpoint(self, mode, address):
+		# mode: "udp" or "ync_bouyomi" with (host, port),
+		# or one of path_modes with a file path. any number of endpoints may be added, all of them feed on_texts
+		if mode in ("unix_dgram", "unix_stream") and not hasattr(socket, "AF_UNIX"):
+			raise ValueError(f"receive mode('{mode}') is not supported on this platform!")
+		if (mode, address) in self._endpoints:
+			raise ValueError(f"endpoint('{_endpoint_label(mode, address)}') given twice!")
+		self._endpoints.append((mode, address))
+		self._received[_endpoint_label(mode, address)] = 0
+
+	def request_stop(self):
+		# safe to call from signal handlers and other threads
+		if self._loop is not None:
+			self._loop.call_soon_threadsafe(self._stop.set)
+
+	def run(self, on_ready=None):
+		# block until request_stop() is called or a fatal error occurs
+		self._error = None
+		asyncio.run(self._serve(on_ready))
+		if self._error is not None:
+			raise self._error
+
+	def get_stats(self):
+		return {
+			"udp_datagrams": sum(_r.datagrams for _r in self._udp_receivers),
+			"udp_batches": sum(_r.batches for _r in self._udp_receivers),
+			"udp_oversized": sum(_r.oversized for _r in self._udp_receivers),
+			"shm_texts": sum(_r.texts for _r in self._shm_receivers),
+			"shm_batches": sum(_r.batches for _r in self._shm_receivers),
+			"shm_wakeups": sum(_r.wakeups for _r in self._shm_receivers),
+			"received": dict(self._received),
+		}
+
+	def _deliver_from(self, mode, address):
+		# deliver function of one endpoint, counting what it received
+		_label = _endpoint_label(mode, address)
+		def deliver(texts, received_ns):
+			self._received[_label] += len(texts)
+			self._deliver(texts, received_ns)
+		return deliver
+
+	def _deliver(self, texts, received_ns):
+		try:
+			self._on_texts(texts, received_ns)
+		except Exception as e:
+			# same as the blocking loop did: an error in the handler stops receiving
+			self._fail(e)
+
+	def _fail(self, e):
+		# a fatal error of an endpoint: run() raises it after stopping. the first one is kept
+		if self._error is None:
+			self._error = e
+		self._stop.set()
+
+	async def _serve(self, on_ready):
+		self._loop = asyncio.get_running_loop()
+		self._stop = asyncio.Event()
+		_servers = []
+		_restore = self._install_signal_handlers()
+		try:
+			for mode, address in self._endpoints:
+				_deliver = self._deliver_from(mode, address)
+				match mode:
+					case "udp":
+						_receiver = UdpReceiver(address, _deliver, on_error=self._fail)
+						_receiver.start(self._loop)
+						self._udp_receivers.append(_receiver)
+						_servers.append(_receiver)
+					case "ync_bouyomi":
+						_sequencer = _Sequencer(_deliver)
+						_server = await self._loop.create_server(
+							lambda _sequencer=_sequencer: BouyomiProtocol(_sequencer), host=address[0], port=address[1])
+						_servers.append(_server)
+					case "unix_dgram":
+						_receiver = UdpReceiver(address, _deliver, family=socket.AF_UNIX, on_error=self._fail)
+						_receiver.start(self._loop)
+						self._udp_receivers.append(_receiver)
+						_servers.append(_receiver)
+					case "unix_stream":
+						_server = await self._loop.create_unix_server(
+							lambda _deliver=_deliver: LineProtocol(_deliver), path=address)
+						_servers.append(_server)
+					case "shm_ring":
+						_receiver = ShmRingReceiver(address, _deliver)
+						_receiver.start(self._loop)
+						self._shm_receivers.append(_receiver)
+						_servers.append(_receiver)
+					case _:
+						raise ValueError(f"invalid receive mode('{mode}') given!")
+			if on_ready is not None:
+				on_ready()
+			await self._stop.wait()
+		finally:
+			for _server in _servers:
+				_server.close()
+			_restore()
+			self._loop = None
+
+	def _install_signal_handlers(self):
+		# ctrl+c (SIGINT) and ctrl+pause/break (SIGBREAK on windows) request a clean stop
+		_previous = {}
+		for _signame in ("SIGINT", "SIGBREAK", "SIGTERM"):
+			_signum = getattr(signal, _signame, None)
+			if _signum is None:
+				continue
+			try:
+				self._loop.add_signal_handler(_signum, self._stop.set)
+				_previous[_signum] = None
+			except (NotImplementedError, RuntimeError):
+				# windows: the proactor loop is woken up by its signal wakeup fd
+				_previous[_signum] = signal.signal(_signum, lambda signum, frame: self.request_stop())
+		def restore():
+			for _signum, _handler in _previous.items():
+				if _handler is None:
+					self._loop.remove_signal_handler(_signum)
+				else:
+					signal.signal(_signum, _handler)
+		return restore
+
+
+def _endpoint_label(mode, address):
+	return f"{mode}:{address}" if isinstance(address, str) else f"{mode}:{address[1]}"
@@ -0,0 +1,294 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# Rule table. the priority chain of a grammar's _do_check written as data.
+#
+# a rule is a dict. every field is optional:
+#   "name":    name of the rule (for messages and statistics)
+#   "when":    keyword hits ("group.word") which trigger the rule. any one of them is enough.
+#              without "when" the rule is tried for every text
+#   "state":   states the rule applies to, e.g. (1, 2) for _so_state in step order
+#   "call":    name of a grammar method called first (e.g. a timeout check which may change the state)
+#   "set":     order fields set by the rule, e.g. {"action": "door"}
+#   "options": order fields set from the first hit of a list, e.g. {"option": (("door.wedge", "wedge"), ...)}
+#   "default": value of an "options" field when none of its list hit, e.g. {"option": "cover"}
+#   "stop":    True to return the order after this rule
+#   "early":   False to never execute the rule on a partial text (streaming recognition).
+#              by default a stopping rule without "options" may run early when more words can't change its order:
+#              no rule before it can still fire or change a field (see RuleTable.early), and it is not
+#              triggered by a regex keyword (see mark_regex_keys())
+# rules are tried from the top. a rule without "when" but with "options" only (e.g. team colors)
+# is triggered by its option hits.
+#
+# the table is compiled once: each keyword maps to a bit mask of the rules it triggers,
+# and evaluate() walks only the rules whose trigger groups hit.
+#
+# a grammar with states (e.g. the step order of ReadyOrNot) uses StateRuleTable: the table is cut
+# into one subset per state, with its own keyword matcher. rules of other states are gone, "state"
+# is not checked any more, and rules after an unconditional stop can never fire and are dropped.
+# changing the state is a pointer swap (select()).
+#
+
+import bisect
+
+from sr2ctrl import matcher
+
+_rule_fields = ("name", "when", "state", "call", "set", "options", "default", "stop", "early")
+_unset = object()
+
+
+class RuleError(ValueError):
+	pass
+
+
+def command_rules(commands, group="commands"):
+	# a command table {command name: {"words": (pattern, ...), ...}} as keyword groups and check rules:
+	# the first command of the table whose words hit is the order ({"command": name}).
+	# commands without words are left out (a pattern "" would hit every text).
+	# a command with a lookaround (e.g. r"1(?!0)") depends on the text after its word: it never runs early
+	_words = {_name: _spec["words"] for _name, _spec in commands.items() if _spec.get("words")}
+	_rules = []
+	for _name, _patterns in _words.items():
+		if isinstance(_patterns, str):
+			_patterns = (_patterns,)
+		_rule = {"name": _name, "when": (f"{group}.{_name}",), "set": {"command": _name}, "stop": True}
+		if any(_look in _p for _p in _patterns for _look in ("(?=", "(?!")):
+			_rule["early"] = False
+		_rules.append(_rule)
+	return {group: _words}, tuple(_rules)
+
+
+class _Rule(object):
+	__slots__ = ("index", "name", "when", "states", "call", "set", "options", "stop", "early")
+
+
+# ##################################################
+# Compiled rule table
+# ##################################################
+class RuleTable(object):
+	def __init__(self, rules, keys=None, state_attr="_so_state"):
+		# keys: every keyword name of the matcher, to catch typos in the table
+		self.state_attr = state_attr
+		self.state = _unset # the state of a subset (see subset())
+		self.regex_keys = frozenset()
+		_known = None if keys is None else set(keys)
+		self._index([self._compile_rule(_index, _spec, _known) for _index, _spec in enumerate(rules)])
+
+	def _index(self, compiled):
+		self._rules = compiled
+		self._positions = [_rule.index for _rule in compiled]
+		self._key_masks = {}
+		self._always_mask = 0
+		for _pos, _rule in enumerate(compiled):
+			if _rule.when is None:
+				self._always_mask |= 1 << _pos
+			else:
+				for _key in _rule.when:
+					self._key_masks[_key] = self._key_masks.get(_key, 0) | (1 << _pos)
+		self.names = tuple(_rule.name for _rule in compiled)
+		# the compiled rules in order (read only)
+		self.rules = tuple(compiled)
+		self.early = self._early_rules()
+		# every keyword the rules look at
+		self.keys = frozenset(
+			{_key for _rule in compiled for _key in (_rule.when or ())}
+			| {_key for _rule in compiled for _field, _entries, _d in _rule.options for _key, _value in _entries}
+		)
+
+	def _early_rules(self):
+		# the rules which may run on a partial text. a later word may trigger a rule with "when" before the rule
+		# (a yell, a cancel, another command), or change the field of a rule with "options" before it (a color).
+		# so only the rules before the first such one may. a rule without both (set / call for every text) does
+		# the same on the longer text. a regex keyword may stop hitting when the text grows (r"1(?!0)")
+		_early = []
+		for _rule in self._rules:
+			if _rule.early and not (_rule.when and _rule.when & self.regex_keys):
+				_early.append(_rule.name)
+			if _rule.when is not None or _rule.options:
+				break
+		return frozenset(_early)
+
+	def mark_regex_keys(self, keys):
+		# keywords which are regexes (see matcher.KeywordMatcher.regex_keys). a rule they trigger never runs early
+		self.regex_keys = frozenset(keys)
+		self.early = self._early_rules()
+
+	def subset(self, state):
+		# the rules which can fire in one state, without state checks
+		_compiled = []
+		for _rule in self._rules:
+			if _rule.states is not None and state not in _rule.states:
+				continue
+			_copy = _Rule()
+			for _slot in _Rule.__slots__:
+				setattr(_copy, _slot, getattr(_rule, _slot))
+			_copy.states = None
+			_compiled.append(_copy)
+			if _rule.when is None and _rule.call is None and _rule.stop:
+				# nothing after this one is ever tried
+				break
+		_table = RuleTable.__new__(RuleTable)
+		_table.state_attr = self.state_attr
+		_table.state = state
+		_table.regex_keys = self.regex_keys
+		_table._index(_compiled)
+		return _table
+
+	def _compile_rule(self, index, spec, known):
+		_unknown = set(spec) - set(_rule_fields)
+		if _unknown:
+			raise RuleError(f"rule #{index}: unknown field(s) {sorted(_unknown)}")
+		_rule = _Rule()
+		_rule.index = index
+		_rule.name = spec.get("name", f"#{index}")
+		_options = spec.get("options", {})
+		_default = spec.get("default", {})
+		if set(_default) - set(_options):
+			raise RuleError(f"rule '{_rule.name}': default for a field without options {sorted(set(_default) - set(_options))}")
+		_rule.options = tuple(
+			(_field, tuple((_key, _value) for _key, _value in _entries), _default.get(_field, _unset))
+			for _field, _entries in _options.items()
+		)
+		_rule.when = frozenset(spec["when"]) if "when" in spec else None
+		_rule.states = frozenset(spec["state"]) if "state" in spec else None
+		_rule.call = spec.get("call")
+		_rule.set = dict(spec.get("set", {}))
+		_rule.stop = bool(spec.get("stop", False))
+		_rule.early = bool(spec.get("early", _rule.stop and not _rule.options))
+		if _rule.early and (not _rule.stop or _rule.options):
+			raise RuleError(f"rule '{_rule.name}': only a stopping rule without options can be early")
+		if _rule.when is None and _rule.call is None and not _rule.set and not _default and not _rule.stop and _rule.options:
+			# options only: nothing happens unless one of them hits
+			_rule.when = frozenset(_key for _field, _entries, _d in _rule.options for _key, _value in _entries)
+		if known is not None:
+			_keys = set(_rule.when or ()) | {_key for _field, _entries, _d in _rule.options for _key, _value in _entries}
+			if _keys - known:
+				raise RuleError(f"rule '{_rule.name}': unknown keyword(s) {sorted(_keys - known)}")
+		return _rule
+
+	def evaluate(self, hits, order, owner=None):
+		# apply the rules to `order` for the keyword hits of one text.
+		# owner: the grammar object, for "state" (owner.<state_attr>) and "call".
+		# returns the name of the rule which stopped, or None
+		return self._run(hits, order, owner)[0]
+
+	def _run(self, hits, order, owner, after=-1):
+		# evaluate() of the rules after the index `after` of the full table.
+		# returns (name of the rule which stopped or None, index of the call which changed the state of a subset or None)
+		_mask = self._always_mask
+		_key_masks = self._key_masks
+		for _key in hits:
+			_m = _key_masks.get(_key)
+			if _m is not None:
+				_mask |= _m
+		if after >= 0:
+			_mask &= ~((1 << bisect.bisect_right(self._positions, after)) - 1)
+		_rules = self._rules
+		while _mask:
+			_low = _mask & -_mask
+			_mask ^= _low
+			_rule = _rules[_low.bit_length() - 1]
+			if _rule.states is not None and getattr(owner, self.state_attr) not in _rule.states:
+				continue
+			if _rule.call is not None:
+				getattr(owner, _rule.call)()
+				if self.state is not _unset and getattr(owner, self.state_attr) != self.state:
+					# the rest is up to the subset of the new state
+					return None, _rule.index
+			if _rule.set:
+				order.update(_rule.set)
+			for _field, _entries, _default in _rule.options:
+				for _key, _value in _entries:
+					if _key in hits:
+						order[_field] = _value
+						break
+				else:
+					if _default is not _unset:
+						order[_field] = _default
+			if _rule.stop:
+				return _rule.name, None
+		return None, None
+
+
+# ##################################################
+# Rule table per state
+# ##################################################
+class StateRuleTable(object):
+	def __init__(self, rules, groups, normalizer=None, states=(0,), state_attr="_so_state", store=None):
+		# groups: the keyword groups of the grammar, as for matcher.KeywordMatcher.
+		# states: every value of owner.<state_attr>. the first one is selected.
+		# store: a compiled.Store to keep the built matchers in
+		self.groups = groups
+		self.table = RuleTable(rules, keys=[f"{_group}.{_word}" for _group, _words in groups.items() for _word in _words], state_attr=state_attr)
+		self._by_state = {}
+		for _state in states:
+			_table = self.table.subset(_state)
+			def build(keys=_table.keys):
+				return matcher.KeywordMatcher(groups, normalizer, keys=keys)
+			if store is None:
+				_matcher = build()
+			else:
+				_matcher = store.get(f"matcher.{_state}", matcher.KeywordMatcher, build)
+			_table.mark_regex_keys(_matcher.regex_keys)
+			self._by_state[_state] = (_table, _matcher)
+		self.table.mark_regex_keys(_key for _table, _matcher in self._by_state.values() for _key in _matcher.regex_keys)
+		self.select(states[0])
+
+	def select(self, state):
+		self.state = state
+		self._current = self._by_state[state]
+
+	def tables(self):
+		# {state: (rule table, keyword matcher)}
+		return dict(self._by_state)
+
+	@property
+	def early(self):
+		# the early rules of the current state: the rules before a rule differ from state to state
+		return self._current[0].early
+
+	def can_grow(self, text):
+		# see matcher.KeywordMatcher.can_grow(). only the keywords of the current state count
+		return self._current[1].can_grow(text)
+
+	def search_keys(self, text):
+		# the keys the matcher of the current state finds in the text. give them to evaluate() as `hits`
+		return self._current[1].search_keys(text)
+
+	def evaluate(self, text, order, owner=None, extra=None, hits=None):
+		# scan the text with the matcher of the current state and apply its rules to `order`.
+		# extra: keys taken as hits in addition (e.g. fuzzy matches).
+		# hits: the keys the matcher of the current state found in the text already (see evaluate_many()).
+		# returns the name of the rule which stopped, or None
+		_table, _matcher = self._current
+		if hits is None:
+			hits = self._hits(_matcher, text, extra)
+		_stopped, _changed_at = _table._run(hits, order, owner)
+		while _changed_at is not None:
+			# a "call" changed the state (e.g. step order timeout): go on with the rules of the new state after it
+			self.select(getattr(owner, _table.state_attr))
+			_table, _matcher = self._current
+			_stopped, _changed_at = _table._run(self._hits(_matcher, text, extra), order, owner, _changed_at)
+		return _stopped
+
+	def evaluate_many(self, texts, orders, owner=None):
+		# evaluate() of several texts (e.g. n-best hypotheses) with one matcher scan.
+		# returns the names of the rules which stopped
+		_state = self.state
+		_all_hits = self._current[1].search_keys_many(texts)
+		_stopped = []
+		for _text, _order, _hits in zip(texts, orders, _all_hits):
+			if self.state != _state:
+				# a "call" changed the state: the keywords of the new state are scanned again
+				_hits = None
+			_stopped.append(self.evaluate(_text, _order, owner, hits=_hits))
+		return _stopped
+
+	@staticmethod
+	def _hits(matcher, text, extra):
+		_hits = matcher.search_keys(text)
+		if extra:
+			_hits.update(extra)
+		return _hits
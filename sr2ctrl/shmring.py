@@ -0,0 +1,194 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# Shared memory ring. a single-producer / single-consumer ring buffer on a memory mapped file.
+# SR2Control creates the ring (ShmRing), a recognizer on the same machine writes texts into it (ShmRingWriter).
+# only the standard library is used, so this file can be copied next to the recognizer as a client library.
+#
+#   writer = ShmRingWriter("sr2control.ring")
+#   writer.send("ブリーチ")
+#
+# while SR2Control is draining the ring, a send is a plain memory copy (no system call).
+# only when SR2Control has gone to sleep on an empty ring, the first text rings a doorbell (one UDP datagram on loopback).
+#
+import os
+import mmap
+import socket
+import struct
+
+# header layout (little endian, 64 bytes)
+#   0  8s  magic
+#   8  I   version
+#   12 I   capacity (bytes of the data area, multiple of 4)
+#   16 Q   head: total bytes written. written by the writer only
+#   24 Q   tail: total bytes read. written by the reader only
+#   32 I   sleeping: 1 while the reader waits for the doorbell
+#   36 I   doorbell port (udp, 127.0.0.1)
+_magic = b"SR2CRING"
+_version = 1
+_header_size = 64
+_header_struct = struct.Struct("<8sII")
+_u64 = struct.Struct("<Q")
+_u32 = struct.Struct("<I")
+_head_offset = 16
+_tail_offset = 24
+_sleeping_offset = 32
+_port_offset = 36
+# record: u32 length, then utf-8 text, padded to 4 bytes. a length of _wrap means "continue at the start"
+_wrap = 0xFFFFFFFF
+
+default_capacity = 1 << 16
+
+
+def _record_size(length):
+	return (4 + length + 3) & ~3
+
+
+class ShmRingError(ValueError):
+	pass
+
+
+def _is_ring(path):
+	# a regular file starting with the ring header (a ring left by a previous run)
+	if not os.path.isfile(path) or os.path.islink(path):
+		return False
+	try:
+		with open(path, "rb") as f:
+			_header = f.read(_header_struct.size)
+	except OSError:
+		return False
+	return len(_header) == _header_struct.size and _header_struct.unpack(_header)[0] == _magic
+
+
+# ##################################################
+# Reader side. SR2Control owns the ring file.
+# ##################################################
+class ShmRing(object):
+	def __init__(self, path, capacity=default_capacity):
+		if capacity < 64 or capacity % 4 != 0:
+			raise ShmRingError(f"invalid ring capacity({capacity}) given!")
+		if os.path.lexists(path) and not _is_ring(path):
+			raise ShmRingError(f"'{path}' exists and is not a SR2Control ring! (give another path)")
+		self.path = path
+		self.capacity = capacity
+		# (re)create the ring file. a writer opens it after this
+		with open(path, "w+b") as f:
+			f.truncate(_header_size + capacity)
+			self._mm = mmap.mmap(f.fileno(), _header_size + capacity)
+		self._view = memoryview(self._mm)
+		self._tail = 0
+		_u64.pack_into(self._mm, _head_offset, 0)
+		_u64.pack_into(self._mm, _tail_offset, 0)
+		_u32.pack_into(self._mm, _sleeping_offset, 0)
+		# magic last: the ring is ready
+		_header_struct.pack_into(self._mm, 0, _magic, _version, capacity)
+
+	def set_doorbell_port(self, port):
+		_u32.pack_into(self._mm, _port_offset, port)
+
+	def set_sleeping(self, sleeping):
+		_u32.pack_into(self._mm, _sleeping_offset, 1 if sleeping else 0)
+
+	def drain(self, texts):
+		# append every text written so far. returns the number of texts taken
+		(_head,) = _u64.unpack_from(self._mm, _head_offset)
+		_tail = self._tail
+		if _tail == _head:
+			return 0
+		_capacity = self.capacity
+		_count = 0
+		while _tail < _head:
+			_pos = _tail % _capacity
+			(_length,) = _u32.unpack_from(self._mm, _header_size + _pos)
+			if _length == _wrap:
+				_tail += _capacity - _pos
+				continue
+			_start = _header_size + _pos + 4
+			texts.append(str(self._view[_start:_start + _length], "utf-8", "replace"))
+			_tail += _record_size(_length)
+			_count += 1
+		self._tail = _tail
+		# the space is free for the writer now
+		_u64.pack_into(self._mm, _tail_offset, _tail)
+		return _count
+
+	def close(self):
+		self._view.release()
+		self._mm.close()
+		try:
+			os.remove(self.path)
+		except OSError:
+			pass
+
+
+# ##################################################
+# Writer side. the client library for a recognizer.
+# ##################################################
+class ShmRingWriter(object):
+	def __init__(self, path):
+		with open(path, "r+b") as f:
+			_size = os.fstat(f.fileno()).st_size
+			if _size < _header_size:
+				raise ShmRingError(f"'{path}' is not a SR2Control ring")
+			self._mm = mmap.mmap(f.fileno(), _size)
+		_magic_read, _version_read, self.capacity = _header_struct.unpack_from(self._mm, 0)
+		if _magic_read != _magic or _version_read != _version or _header_size + self.capacity > _size:
+			self._mm.close()
+			raise ShmRingError(f"'{path}' is not a SR2Control ring")
+		self._bell = None
+		# counters
+		self.sent = 0
+		self.dropped = 0
+		self.doorbells = 0
+
+	def send(self, text):
+		# never blocks. returns False when the ring is full (the text is dropped)
+		_data = text.encode("utf-8")
+		_need = _record_size(len(_data))
+		_capacity = self.capacity
+		if _need > _capacity:
+			raise ShmRingError(f"text too long for the ring({len(_data)} bytes)")
+		(_head,) = _u64.unpack_from(self._mm, _head_offset)
+		(_tail,) = _u64.unpack_from(self._mm, _tail_offset)
+		_pos = _head % _capacity
+		# a record never wraps around: skip the rest of the area when it does not fit
+		_skip = (_capacity - _pos) if (_capacity - _pos) < _need else 0
+		if _head + _skip + _need - _tail > _capacity:
+			self.dropped += 1
+			return False
+		if _skip:
+			_u32.pack_into(self._mm, _header_size + _pos, _wrap)
+			_head += _skip
+			_pos = 0
+		_start = _header_size + _pos
+		self._mm[_start + 4:_start + 4 + len(_data)] = _data
+		_u32.pack_into(self._mm, _start, len(_data))
+		# publish: the record is visible to the reader from here
+		_u64.pack_into(self._mm, _head_offset, _head + _need)
+		self.sent += 1
+		# the reader sleeps only on an empty ring: a bell is already on its way if the ring was not empty
+		(_sleeping,) = _u32.unpack_from(self._mm, _sleeping_offset)
+		if _sleeping and _tail == _head - _skip:
+			self._ring_doorbell()
+		return True
+
+	def _ring_doorbell(self):
+		(_port,) = _u32.unpack_from(self._mm, _port_offset)
+		if _port == 0:
+			return
+		if self._bell is None:
+			self._bell = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		try:
+			self._bell.sendto(b"\x01", ("127.0.0.1", _port))
+			self.doorbells += 1
+		except OSError:
+			# the reader polls anyway
+			pass
+
+	def close(self):
+		if self._bell is not None:
+			self._bell.close()
+			self._bell = None
+		self._mm.close()
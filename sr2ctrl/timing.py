@@ -0,0 +1,82 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# Timing profiles. the interval after each key of a grammar, kept in the settings (SR2Control_timing.ini).
+#
+# one section per grammar:
+#   [ReadyOrNot]
+#   interval	=	0.06	the interval after a key (seconds)
+#   cmd_menu	=	0.08	the interval after this key. the key names are the grammar's own
+#                       	(ReadyOrNot: "cmd_menu", "red", ... Arma3: "1", "shift+f1", "mouse_left", ...)
+# a grammar without a section (or without the file) uses its own default interval for every key.
+# sr2ctrl/calibrate.py measures the intervals and writes the section.
+#
+import os
+import configparser
+
+# the profile file. relative to the working directory, as the settings files
+profile_path = os.path.join("sr2ctrl", "settings", "SR2Control_timing.ini")
+
+
+class TimingProfile(object):
+	def __init__(self, name, interval=0.06, keys=None):
+		self.name = name # the grammar
+		self.interval = interval
+		self.keys = dict(keys or {}) # key -> interval after it
+
+	def interval_after(self, key):
+		return self.keys.get(key, self.interval)
+
+	def copy(self):
+		return TimingProfile(self.name, self.interval, self.keys)
+
+
+def _parser():
+	_config = configparser.ConfigParser(interpolation=None)
+	# key names are case sensitive ("F1" is not "f1" in a hotkey)
+	_config.optionxform = str
+	return _config
+
+def load_profile(name, interval=0.06, path=None):
+	# the profile of the grammar `name`. interval: the default when the settings have none
+	_path = path or profile_path
+	_config = _parser()
+	try:
+		_config.read(_path, encoding="utf-8")
+	except configparser.Error as e:
+		print(f"WARNING: timing profile '{_path}' not read! ({e})")
+		return TimingProfile(name, interval)
+	if not _config.has_section(name):
+		return TimingProfile(name, interval)
+	_keys = {}
+	for _key, _value in _config.items(name):
+		try:
+			_keys[_key] = float(_value)
+		except ValueError:
+			print(f"WARNING: invalid interval('{_value}') of '{_key}' in [{name}] ignored")
+	return TimingProfile(name, _keys.pop("interval", interval), _keys)
+
+def save_profile(profile, path=None):
+	# write the section of the grammar. the rest of the file (other grammars, comments) is kept as it is
+	_path = path or profile_path
+	_section = [f"[{profile.name}]\n", f"interval\t=\t{profile.interval:g}\n"]
+	_section += [f"{_key}\t=\t{_value:g}\n" for _key, _value in sorted(profile.keys.items())]
+	_lines = []
+	if os.path.isfile(_path):
+		with open(_path, "rt", encoding="utf-8") as f:
+			_lines = f.readlines()
+	_start = next((_i for _i, _line in enumerate(_lines) if _line.strip() == f"[{profile.name}]"), None)
+	if _start is None:
+		if _lines and _lines[-1].strip() != "":
+			_lines.append("\n")
+		_lines += _section
+	else:
+		_end = next((_i for _i in range(_start + 1, len(_lines)) if _lines[_i].lstrip().startswith("[")), len(_lines))
+		# blank lines and comments before the next section stay with it
+		while _end - 1 > _start and (_lines[_end - 1].strip() == "" or _lines[_end - 1].lstrip().startswith("#")):
+			_end -= 1
+		_lines[_start:_end] = _section
+	with open(_path, "wt", encoding="utf-8") as f:
+		f.writelines(_lines)
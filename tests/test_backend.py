@@ -0,0 +1,68 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+import pytest
+
+from sr2ctrl import backend
+from sr2ctrl import keysched
+
+keyboard = pytest.importorskip("keyboard")
+pytest.importorskip("mouse")
+
+
+class FakeOsKeyboard(object):
+	# the os layer of the keyboard module: a few scan codes, and the events pushed
+	codes = {"left shift": 42, "right shift": 54, "left ctrl": 29, "right ctrl": 97, "f1": 59, "space": 57}
+
+	def __init__(self):
+		self.events = []
+
+	def init(self):
+		pass
+
+	def map_name(self, name):
+		if name not in self.codes:
+			raise ValueError(name)
+		yield self.codes[name], ()
+
+	def press(self, scan_code):
+		self.events.append(("down", scan_code))
+
+	def release(self, scan_code):
+		self.events.append(("up", scan_code))
+
+
+@pytest.fixture
+def os_keyboard(monkeypatch):
+	_fake = FakeOsKeyboard()
+	monkeypatch.setattr(keyboard, "_os_keyboard", _fake)
+	return _fake
+
+
+def test_combo_is_pressed_and_released_in_order(os_keyboard):
+	_backend = backend.KeyboardBackend()
+	_key = _backend.resolve("shift+f1", False)
+	_backend.inject(keysched.TAP, _key, False)
+	assert os_keyboard.events == [("down", 42), ("down", 59), ("up", 59), ("up", 42)]
+
+
+def test_combo_press_and_release_apart(os_keyboard):
+	_backend = backend.KeyboardBackend()
+	_key = _backend.resolve("ctrl+space", False)
+	_backend.inject(keysched.PRESS, _key, False)
+	assert os_keyboard.events == [("down", 29), ("down", 57)]
+	_backend.inject(keysched.RELEASE, _key, False)
+	assert os_keyboard.events[2:] == [("up", 57), ("up", 29)]
+
+
+def test_key_name_is_still_taken(os_keyboard):
+	_backend = backend.KeyboardBackend()
+	_backend.inject(keysched.TAP, "shift+f1", False)
+	assert os_keyboard.events == [("down", 42), ("down", 59), ("up", 59), ("up", 42)]
+
+
+def test_unknown_key_is_rejected(os_keyboard):
+	with pytest.raises(ValueError):
+		backend.KeyboardBackend().resolve("no such key", False)
@@ -0,0 +1,77 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+import struct
+
+import pytest
+
+from sr2ctrl import bouyomi
+
+
+def talk(text, encoding=0, speed=-1, tone=-1, volume=-1, voice=0):
+	# a talk command as a bouyomi-chan client sends it
+	_data = text.encode(bouyomi._encodings[encoding])
+	return struct.pack("<hhhhhbi", bouyomi.CMD_TALK, speed, tone, volume, voice, encoding, len(_data)) + _data
+
+
+def feed_in_chunks(parser, data, size):
+	_done = []
+	for _i in range(0, len(data), size):
+		_done += parser.feed(data[_i:_i + size])
+	return _done
+
+
+def test_whole_command():
+	_parser = bouyomi.BouyomiParser()
+	_done = _parser.feed(talk("ブリーチ"))
+	assert [_talk.text for _talk in _done] == ["ブリーチ"]
+	assert _parser.is_idle()
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16])
+def test_split_reads(size):
+	_data = talk("レッドチーム", encoding=0) + talk("ブルー", encoding=1) + talk("ゴールド", encoding=2)
+	_parser = bouyomi.BouyomiParser()
+	_done = feed_in_chunks(_parser, _data, size)
+	assert [_talk.text for _talk in _done] == ["レッドチーム", "ブルー", "ゴールド"]
+	assert [_talk.encoding for _talk in _done] == [0, 1, 2]
+	assert _parser.is_idle()
+
+
+def test_partial_read_keeps_state():
+	_data = talk("オープン")
+	_parser = bouyomi.BouyomiParser()
+	# the header and a part of the text
+	assert _parser.feed(_data[:20]) == []
+	assert not _parser.is_idle()
+	_done = _parser.feed(_data[20:] + _data[:5])
+	assert [_talk.text for _talk in _done] == ["オープン"]
+	assert not _parser.is_idle()
+	assert [_talk.text for _talk in _parser.feed(_data[5:])] == ["オープン"]
+	assert _parser.is_idle()
+
+
+def test_fields_and_empty_text():
+	_parser = bouyomi.BouyomiParser()
+	_done = _parser.feed(talk("", speed=100, tone=90, volume=80, voice=1))
+	assert _done == [bouyomi.BouyomiTalk(100, 90, 80, 1, 0, "")]
+
+
+def test_non_talk_commands_are_skipped():
+	_data = struct.pack("<h", 0x0040) + talk("スタック") + struct.pack("<h", 0x0010)
+	_parser = bouyomi.BouyomiParser()
+	_done = feed_in_chunks(_parser, _data, 1)
+	assert _done[0] == 0x0040
+	assert _done[1].text == "スタック"
+	assert _done[2] == 0x0010
+
+
+def test_invalid_commands():
+	with pytest.raises(bouyomi.BouyomiError):
+		bouyomi.BouyomiParser().feed(struct.pack("<h", 0x7777))
+	with pytest.raises(bouyomi.BouyomiError):
+		bouyomi.BouyomiParser().feed(struct.pack("<hhhhhbi", bouyomi.CMD_TALK, 0, 0, 0, 0, 9, 0))
+	with pytest.raises(bouyomi.BouyomiError):
+		bouyomi.BouyomiParser().feed(struct.pack("<hhhhhbi", bouyomi.CMD_TALK, 0, 0, 0, 0, 0, -1))
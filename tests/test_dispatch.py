@@ -0,0 +1,173 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+import threading
+
+import pytest
+
+from sr2ctrl import dispatch
+
+
+def drain(work_queue):
+	_items = []
+	while work_queue.get_stats()["waiting"]:
+		_items.append(work_queue.get())
+	return _items
+
+
+# ##################################################
+# Work queue
+# ##################################################
+def test_fifo_below_depth():
+	_queue = dispatch.WorkQueue(depth=4)
+	_queue.put_many(["a", "b", "c"])
+	assert drain(_queue) == ["a", "b", "c"]
+
+
+def test_drop_oldest():
+	_queue = dispatch.WorkQueue(depth=2, overflow="drop_oldest")
+	assert _queue.put("a") and _queue.put("b") and _queue.put("c")
+	assert drain(_queue) == ["b", "c"]
+	assert _queue.get_stats()["dropped"] == 1
+
+
+def test_drop_newest():
+	_queue = dispatch.WorkQueue(depth=2, overflow="drop_newest")
+	assert _queue.put("a") and _queue.put("b")
+	assert not _queue.put("c")
+	assert drain(_queue) == ["a", "b"]
+	assert _queue.get_stats()["dropped"] == 1
+
+
+def test_coalesce_drops_the_same_item():
+	_queue = dispatch.WorkQueue(depth=2, overflow="coalesce")
+	_queue.put_many(["a", "b"])
+	assert not _queue.put("a")
+	assert drain(_queue) == ["a", "b"]
+	# nothing was merged: the duplicate is counted as dropped
+	assert (_queue.get_stats()["coalesced"], _queue.get_stats()["dropped"]) == (0, 1)
+
+
+def test_coalesce_supersedes_the_newest():
+	_queue = dispatch.WorkQueue(depth=2, overflow="coalesce")
+	_queue.put_many(["a", "b"])
+	assert _queue.put("c")
+	assert drain(_queue) == ["a", "c"]
+	assert (_queue.get_stats()["coalesced"], _queue.get_stats()["dropped"]) == (1, 0)
+
+
+def test_tags_travel_with_items():
+	_queue = dispatch.WorkQueue(depth=4)
+	_queue.put_many(["a", "b"], tags=[1, 2])
+	assert _queue.get_tagged() == ("a", 1)
+	assert _queue.get_tagged() == ("b", 2)
+
+
+def test_closed_queue():
+	_queue = dispatch.WorkQueue(depth=4)
+	_queue.put("a")
+	_queue.close()
+	assert not _queue.put("b")
+	assert _queue.get() is None
+
+
+def test_invalid_settings():
+	with pytest.raises(ValueError):
+		dispatch.WorkQueue(depth=0)
+	with pytest.raises(ValueError):
+		dispatch.WorkQueue(overflow="drop_all")
+
+
+# ##################################################
+# Dispatcher
+# ##################################################
+def test_dispatcher_runs_items_in_order():
+	_queue = dispatch.WorkQueue(depth=8)
+	_done = []
+	_finished = threading.Event()
+	def handler(item):
+		_done.append(item)
+		if item == "c":
+			_finished.set()
+	_dispatcher = dispatch.Dispatcher(_queue, handler)
+	_dispatcher.start()
+	_queue.put_many(["a", "b", "c"])
+	assert _finished.wait(2)
+	_dispatcher.stop(timeout=2)
+	assert _done == ["a", "b", "c"]
+
+
+def test_dispatcher_goes_on_after_an_error():
+	_queue = dispatch.WorkQueue(depth=8)
+	_errors = []
+	_done = []
+	_finished = threading.Event()
+	def handler(item):
+		if item == "bad":
+			raise ValueError(item)
+		_done.append(item)
+		_finished.set()
+	_dispatcher = dispatch.Dispatcher(_queue, handler, on_error=_errors.append)
+	_dispatcher.start()
+	_queue.put_many(["bad", "good"])
+	assert _finished.wait(2)
+	_dispatcher.stop(timeout=2)
+	assert _done == ["good"]
+	assert [str(_e) for _e in _errors] == ["bad"]
+
+
+# ##################################################
+# Duplicate filter
+# ##################################################
+@pytest.fixture
+def clock(monkeypatch):
+	# time.monotonic() of the dispatch module, moved by hand
+	class Clock(object):
+		now = 1000.0
+	_clock = Clock()
+	monkeypatch.setattr(dispatch.time, "monotonic", lambda: _clock.now)
+	return _clock
+
+
+def test_repeat_within_the_window_is_dropped(clock, capsys):
+	_queue = dispatch.WorkQueue(depth=8)
+	_filter = dispatch.DuplicateFilter(_queue, window=1.0)
+	_filter.put_many(["ブリーチ"])
+	clock.now += 0.5
+	_filter.put_many(["ブリーチ"])
+	assert drain(_queue) == ["ブリーチ"]
+	assert _filter.get_stats()["duplicates"] == 1
+	# never dropped silently
+	assert "DEDUP: 'ブリーチ' dropped" in capsys.readouterr().out
+
+
+def test_repeat_after_the_window_passes(clock):
+	_queue = dispatch.WorkQueue(depth=8)
+	_filter = dispatch.DuplicateFilter(_queue, window=1.0)
+	_filter.put_many(["ブリーチ"])
+	clock.now += 1.5
+	_filter.put_many(["ブリーチ"])
+	assert drain(_queue) == ["ブリーチ", "ブリーチ"]
+	assert _filter.get_stats()["duplicates"] == 0
+
+
+def test_grown_text_replaces_the_waiting_one(clock):
+	_queue = dispatch.WorkQueue(depth=8)
+	_filter = dispatch.DuplicateFilter(_queue, window=1.0)
+	_filter.put_many(["レッド"])
+	_filter.put_many(["レッドブリーチ"])
+	# a late interim version of it
+	_filter.put_many(["レッド"])
+	assert drain(_queue) == ["レッドブリーチ"]
+	assert _filter.get_stats() == {"duplicates": 0, "interims": 1, "coalesced": 1}
+
+
+def test_grown_text_after_dispatch_is_passed(clock):
+	_queue = dispatch.WorkQueue(depth=8)
+	_filter = dispatch.DuplicateFilter(_queue, window=1.0)
+	_filter.put_many(["レッド"])
+	assert drain(_queue) == ["レッド"]
+	_filter.put_many(["レッドブリーチ"])
+	assert drain(_queue) == ["レッドブリーチ"]
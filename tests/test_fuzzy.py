@@ -0,0 +1,69 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+import os
+import random
+import importlib.util
+
+import pytest
+
+from sr2ctrl import normalize
+from sr2ctrl import fuzzy
+
+_params_path = os.path.join(os.path.dirname(__file__), "..", "sr2ctrl", "grammar", "ReadyOrNot_params.py")
+_kana = [chr(_c) for _c in range(0x30A2, 0x30F3)]
+
+
+@pytest.fixture(scope="module")
+def groups():
+	_spec = importlib.util.spec_from_file_location("test_fuzzy_params", _params_path)
+	_params = importlib.util.module_from_spec(_spec)
+	_spec.loader.exec_module(_params)
+	return {_name[3:]: _value for _name, _value in vars(_params).items() if _name.startswith("kw_") and _name != "kw_sample"}
+
+
+def misheard(groups, size, seed=1):
+	# plain keywords with one character replaced
+	_words = sorted({_p for _words in groups.values() for _patterns in _words.values() for _p in _patterns
+					if len(_p) >= 3 and not any(_c in _p for _c in "[]()?*+|\\")})
+	_random = random.Random(seed)
+	_texts = []
+	for _ in range(size):
+		_word = _random.choice(_words)
+		_i = _random.randrange(len(_word))
+		_texts.append(_word[:_i] + _random.choice(_kana) + _word[_i + 1:])
+	return _texts
+
+
+@pytest.mark.parametrize("max_distance", [1, 2])
+def test_same_hits_as_brute_force(groups, max_distance):
+	_normalizer = normalize.TextNormalizer()
+	_index = fuzzy.FuzzyIndex(groups, _normalizer, max_distance=max_distance)
+	for _text in misheard(groups, 300):
+		_text = _normalizer.normalize(_text)
+		assert dict(_index.search(_text)) == dict(_index.search_brute(_text)), _text
+
+
+def test_capped_buckets(groups):
+	# every keyword stays listed, and the buckets stay short
+	_extra = {f"w{_n}": ("ブリ" + _kana[_n % len(_kana)] + _kana[_n // len(_kana)],) for _n in range(200)}
+	_index = fuzzy.FuzzyIndex(dict(groups, extra=_extra), max_distance=1, max_bucket=8)
+	_listed = {_i for _bucket in _index._index.values() for _i in _bucket}
+	assert _listed == set(range(len(_index)))
+	assert len(_index._index["ぶり"]) <= 8
+	assert dict(_index.search("ブリアア")).get("extra.w0") == 1.0
+
+
+def test_score_and_short_keywords():
+	_index = fuzzy.FuzzyIndex({"colors": {"red": ("レッド",), "one": ("ワン",)}}, max_distance=1)
+	assert dict(_index.search("ベッド")) == {"colors.red": pytest.approx(2 / 3)}
+	assert _index.search("レッド") == [("colors.red", 1.0)]
+	# a reading of two characters never hits fuzzily
+	assert _index.search("ワソ") == []
+
+
+def test_has_piece():
+	assert fuzzy._has_piece("ぶりーち", 1, "ぶりあち")
+	assert not fuzzy._has_piece("ぶりーち", 1, "ぷいあち")
@@ -0,0 +1,102 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+import time
+import threading
+
+import pytest
+
+from sr2ctrl import keysched
+
+
+class Recorder(object):
+	# inject() of the scheduler: keeps the events
+	def __init__(self):
+		self.events = []
+		self._cond = threading.Condition()
+
+	def inject(self, kind, key, is_mouse):
+		with self._cond:
+			self.events.append((kind, key, is_mouse))
+			self._cond.notify_all()
+
+	def wait_for(self, event, timeout=2):
+		with self._cond:
+			return self._cond.wait_for(lambda: event in self.events, timeout)
+
+
+@pytest.fixture
+def recorder():
+	return Recorder()
+
+
+@pytest.fixture
+def preemptions():
+	return []
+
+
+@pytest.fixture
+def scheduler(recorder, preemptions):
+	_scheduler = keysched.KeyScheduler(recorder.inject, on_preempt=preemptions.append)
+	yield _scheduler
+	_scheduler.stop(timeout=2)
+
+
+def test_events_in_order(scheduler, recorder):
+	scheduler.submit(keysched.Timeline("a").tap("1").wait(0.01).tap("2").freeze())
+	scheduler.submit(keysched.Timeline("b").tap("3").freeze())
+	assert scheduler.wait_idle(timeout=2)
+	assert [_key for _kind, _key, _is_mouse in recorder.events] == ["1", "2", "3"]
+	assert scheduler.get_stats()["queued"] == 1
+
+
+def test_preemption_releases_held_keys(scheduler, recorder, preemptions):
+	_hold = keysched.Timeline("hold").press("w").press("right", True).wait(5).release("right", True).release("w")
+	scheduler.submit(_hold.freeze())
+	assert recorder.wait_for((keysched.PRESS, "right", True))
+	_start = time.perf_counter()
+	scheduler.submit(keysched.Timeline("cancel", priority=1).tap("x").freeze())
+	assert scheduler.wait_idle(timeout=2)
+	# the cancel does not wait for the 5 seconds of the hold
+	assert time.perf_counter() - _start < 1
+	assert recorder.events == [
+		(keysched.PRESS, "w", False),
+		(keysched.PRESS, "right", True),
+		# released by the preemption, the last pressed first
+		(keysched.RELEASE, "right", True),
+		(keysched.RELEASE, "w", False),
+		(keysched.TAP, "x", False),
+	]
+	assert len(preemptions) == 1
+	assert preemptions[0]["by"] == "cancel"
+	assert preemptions[0]["cancelled"] == ["hold"]
+	assert preemptions[0]["released"] == 2
+	_stats = scheduler.get_stats()
+	assert (_stats["preemptions"], _stats["preempted"], _stats["released"]) == (1, 1, 2)
+
+
+def test_waiting_timelines_are_dropped(scheduler, recorder, preemptions):
+	scheduler.submit(keysched.Timeline("hold").press("w").wait(5).release("w").freeze())
+	scheduler.submit(keysched.Timeline("next").tap("n").freeze())
+	assert recorder.wait_for((keysched.PRESS, "w", False))
+	scheduler.submit(keysched.Timeline("cancel", priority=1).tap("x").freeze())
+	assert scheduler.wait_idle(timeout=2)
+	assert [_key for _kind, _key, _is_mouse in recorder.events] == ["w", "w", "x"]
+	assert preemptions[0]["cancelled"] == ["hold", "next"]
+
+
+def test_same_priority_waits(scheduler, recorder, preemptions):
+	scheduler.submit(keysched.Timeline("hold").press("w").wait(0.05).release("w").freeze())
+	scheduler.submit(keysched.Timeline("next").tap("n").freeze())
+	assert scheduler.wait_idle(timeout=2)
+	assert [(_kind, _key) for _kind, _key, _is_mouse in recorder.events] == [
+		(keysched.PRESS, "w"), (keysched.RELEASE, "w"), (keysched.TAP, "n")]
+	assert preemptions == []
+
+
+def test_frozen_timeline():
+	_timeline = keysched.Timeline("a").tap("1").freeze()
+	with pytest.raises(ValueError):
+		_timeline.tap("2")
@@ -0,0 +1,77 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+import os
+import random
+import importlib.util
+
+import pytest
+
+from sr2ctrl import normalize
+from sr2ctrl import matcher
+
+_params_path = os.path.join(os.path.dirname(__file__), "..", "sr2ctrl", "grammar", "ReadyOrNot_params.py")
+
+
+@pytest.fixture(scope="module")
+def groups():
+	# every kw_* dict of the ReadyOrNot params, as the grammar gives them to the matcher
+	_spec = importlib.util.spec_from_file_location("test_matcher_params", _params_path)
+	_params = importlib.util.module_from_spec(_spec)
+	_spec.loader.exec_module(_params)
+	return {_name[3:]: _value for _name, _value in vars(_params).items() if _name.startswith("kw_") and _name != "kw_sample"}
+
+
+def corpus(groups, size=500, seed=1):
+	# utterances of 1-4 keywords (plain words of the params) and a few words hitting nothing
+	_words = sorted({_p for _words in groups.values() for _patterns in _words.values() for _p in _patterns
+					if _p and not any(_c in _p for _c in "[]()?*+|\\")})
+	_words += ["えーと", "あの", "ちょっと", "お願い"]
+	_random = random.Random(seed)
+	return ["".join(_random.choice(_words) for _ in range(_random.randint(1, 4))) for _ in range(size)]
+
+
+@pytest.mark.parametrize("kana_fold", [False, True])
+def test_same_hits_as_regex(groups, kana_fold):
+	_normalizer = normalize.TextNormalizer(kana_fold=kana_fold)
+	_regex = matcher.RegexMatcher(groups, _normalizer)
+	_keyword = matcher.KeywordMatcher(groups, _normalizer)
+	assert _keyword.keys == _regex.keys
+	for _text in corpus(groups):
+		_text = _normalizer.normalize(_text)
+		assert _keyword.search_keys(_text) == _regex.search_keys(_text), _text
+
+
+def test_many_texts_in_one_scan(groups):
+	_normalizer = normalize.TextNormalizer()
+	_regex = matcher.RegexMatcher(groups, _normalizer)
+	_keyword = matcher.KeywordMatcher(groups, _normalizer)
+	_texts = [_normalizer.normalize(_t) for _t in corpus(groups, size=40, seed=2)]
+	assert _keyword.search_keys_many(_texts) == [_regex.search_keys(_t) for _t in _texts]
+
+
+def test_pattern_kinds():
+	# literals, small classes, gated regexes (lookarounds, repeats) and patterns matching anywhere
+	_groups = {
+		"g": {
+			"door": ("ドア",),
+			"one": (r"[一壱1]",),
+			"out": (r"外[へに]",),
+			"hand": (r"手(?!前)",),
+			"cancel": (r"取[り]*消",),
+			"any": ("",),
+			"end": (r".*了$",),
+		},
+	}
+	_regex = matcher.RegexMatcher(_groups)
+	_keyword = matcher.KeywordMatcher(_groups)
+	for _text in ["ドア", "壱", "外へ", "外で", "手前", "手", "取り消し", "取消", "完了", "了解", "", "ドア1手取消完了"]:
+		assert _keyword.search_keys(_text) == _regex.search_keys(_text), _text
+
+
+def test_keys_subset(groups):
+	_keys = {"colors.gold", "colors.red"}
+	_keyword = matcher.KeywordMatcher(groups, keys=_keys)
+	assert set(_keyword.keys) == _keys
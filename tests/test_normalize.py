@@ -0,0 +1,33 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+from sr2ctrl import normalize
+
+
+def test_omitted_characters_in_every_width():
+	_normalizer = normalize.TextNormalizer()
+	assert _normalizer.normalize("レッド、ブリーチ。") == "レッドブリーチ"
+	assert _normalizer.normalize("レッド､ブリーチ｡") == "レッドブリーチ"
+	assert _normalizer.normalize("レッド, ブリーチ．　") == "レッドブリーチ"
+
+
+def test_width_fold():
+	_normalizer = normalize.TextNormalizer()
+	assert _normalizer.normalize("ｶﾞｽ１２ＡＢ") == "ガス12AB"
+	# roman numerals stay as they are
+	assert _normalizer.normalize("Ⅱ") == "Ⅱ"
+
+
+def test_kana_fold():
+	_normalizer = normalize.TextNormalizer(kana_fold=True)
+	assert _normalizer.normalize("ドアｶﾞ") == "どあが"
+	assert _normalizer.pattern("ドア") == "どあ"
+
+
+def test_pattern_keeps_symbols_literal():
+	_normalizer = normalize.TextNormalizer()
+	assert _normalizer.pattern("（１）") == r"\(1\)"
+	# the pattern is folded, not deleted
+	assert _normalizer.pattern("ドア。") == "ドア。"
@@ -0,0 +1,82 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+# on_partial of the grammars: a partial text runs only when more words can't change its order
+#
+import os
+import io
+import contextlib
+import importlib.util
+
+import pytest
+
+from sr2ctrl import compiled
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def load_grammar(name, monkeypatch, tmp_path):
+	# the grammar in test mode, as main loads it (from the repository root)
+	monkeypatch.chdir(_root)
+	monkeypatch.setattr(compiled, "cache_dir", str(tmp_path))
+	_spec = importlib.util.spec_from_file_location(f"test_partial_{name}", os.path.join(_root, "sr2ctrl", "grammar", f"{name}.py"))
+	_module = importlib.util.module_from_spec(_spec)
+	with contextlib.redirect_stdout(io.StringIO()):
+		_spec.loader.exec_module(_module)
+		_owner = _module.SR2C(True)
+	return _owner
+
+
+@pytest.fixture
+def ron(monkeypatch, tmp_path):
+	_owner = load_grammar("ReadyOrNot", monkeypatch, tmp_path)
+	yield _owner
+	_owner.close()
+
+
+@pytest.fixture
+def arma3(monkeypatch, tmp_path):
+	_owner = load_grammar("Arma3", monkeypatch, tmp_path)
+	yield _owner
+	_owner.close()
+
+
+def partial(owner, text):
+	with contextlib.redirect_stdout(io.StringIO()):
+		return owner.on_partial(text)
+
+
+def test_ron_later_color_changes_the_order(ron):
+	# "コマンド" alone opens the command menu, but a later "レッド" makes it the red team's
+	assert not partial(ron, "コマンド")
+	assert ron._do_check("コマンド")["color"] == "none"
+	assert ron._do_check("コマンドレッド")["color"] == "red"
+
+
+def test_ron_later_yell_changes_the_order(ron):
+	# the yell comes before every other rule: a later "警察" is a yell
+	assert not partial(ron, "ブリーチ")
+	assert ron._do_check("ブリーチ警察")["action"] == "yell"
+
+
+def test_ron_nothing_runs_early(ron):
+	# the yell rule comes first in every state, so every order may still change
+	for _state, (_table, _matcher) in ron._rules.tables().items():
+		assert _table.early == frozenset(), _state
+
+
+def test_arma3_first_command_runs_early(arma3):
+	assert partial(arma3, "1番")
+
+
+def test_arma3_later_command_may_change_the_order(arma3):
+	# "2番" is menu_2, but a later "1番" would be menu_1, which comes first
+	assert not partial(arma3, "2番")
+	assert arma3._do_check("2番1番")["command"] == "menu_1"
+
+
+def test_arma3_partial_word_waits(arma3):
+	# "1" may still grow into "1番"
+	assert not partial(arma3, "1")
@@ -0,0 +1,87 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+import errno
+import asyncio
+
+import pytest
+
+from sr2ctrl import receiver
+
+
+class FailingLoop(object):
+	# the proactor path of UdpReceiver: the overlapped recv fails
+	def __init__(self, errors):
+		self._errors = list(errors)
+
+	async def sock_recv_into(self, sock, buf):
+		raise self._errors.pop(0)
+
+
+def make_receiver(on_error=None):
+	return receiver.UdpReceiver(("127.0.0.1", 0), lambda texts, received_ns: None, on_error=on_error)
+
+
+def test_socket_error_goes_to_the_engine():
+	_errors = []
+	_receiver = make_receiver(on_error=_errors.append)
+	_error = OSError(errno.EBADF, "bad file descriptor")
+	_receiver._loop = FailingLoop([_error])
+	try:
+		# the task ends without raising: nothing awaits it
+		asyncio.run(_receiver._recv_loop())
+	finally:
+		_receiver._sock.close()
+	assert _errors == [_error]
+
+
+def test_kept_listening_on_connection_reset():
+	_errors = []
+	_receiver = make_receiver(on_error=_errors.append)
+	_reset = OSError(errno.ECONNRESET, "reset")
+	_reset.winerror = 10054
+	_fatal = OSError(errno.EBADF, "bad file descriptor")
+	_receiver._loop = FailingLoop([_reset, _fatal])
+	try:
+		asyncio.run(_receiver._recv_loop())
+	finally:
+		_receiver._sock.close()
+	assert _errors == [_fatal]
+
+
+def test_socket_error_raised_without_the_engine():
+	_receiver = make_receiver()
+	try:
+		with pytest.raises(OSError):
+			_receiver._on_error(OSError(errno.EBADF, "bad file descriptor"))
+	finally:
+		_receiver._sock.close()
+
+
+def test_engine_stops_on_a_socket_error():
+	_engine = receiver.ReceiveEngine(lambda texts, received_ns: None)
+	_engine.add_endpoint("udp", ("127.0.0.1", 0))
+	_error = OSError(errno.EBADF, "bad file descriptor")
+	def on_ready():
+		# as the receive task meets it
+		assert not _engine._udp_receivers[0]._on_error(_error)
+	with pytest.raises(OSError) as _raised:
+		_engine.run(on_ready=on_ready)
+	assert _raised.value is _error
+
+
+@pytest.mark.skipif(not hasattr(receiver.socket, "AF_UNIX"), reason="no unix domain sockets")
+def test_unix_datagrams_are_counted(tmp_path):
+	_path = str(tmp_path / "sr2control.sock")
+	_texts = []
+	_engine = receiver.ReceiveEngine(lambda texts, received_ns: (_texts.extend(texts), _engine.request_stop()))
+	_engine.add_endpoint("unix_dgram", _path)
+	def on_ready():
+		with receiver.socket.socket(receiver.socket.AF_UNIX, receiver.socket.SOCK_DGRAM) as _sock:
+			_sock.sendto("ブリーチ".encode("utf-8"), _path)
+	_engine.run(on_ready=on_ready)
+	assert _texts == ["ブリーチ"]
+	_stats = _engine.get_stats()
+	assert (_stats["udp_datagrams"], _stats["udp_batches"]) == (1, 1)
@@ -0,0 +1,98 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+import pytest
+
+from sr2ctrl import matcher
+from sr2ctrl import rules
+
+_groups = {
+	"yell": {"base": ("フリーズ",)},
+	"colors": {"red": ("レッド",), "blue": ("ブルー",)},
+	"cmd": {"menu": ("コマンド",), "breach": ("ブリーチ",), "cancel": (r"取[り]*消",)},
+}
+_keys = [f"{_group}.{_word}" for _group, _words in _groups.items() for _word in _words]
+
+
+def table(check_rules):
+	_matcher = matcher.KeywordMatcher(_groups)
+	_table = rules.RuleTable(check_rules, keys=_keys)
+	_table.mark_regex_keys(_matcher.regex_keys)
+	return _table
+
+
+def test_evaluate_in_priority_order():
+	_table = table((
+		{"name": "yell", "when": ("yell.base",), "set": {"action": "yell"}, "stop": True},
+		{"name": "colors", "options": {"color": (("colors.red", "red"), ("colors.blue", "blue"))}},
+		{"name": "breach", "when": ("cmd.breach",), "set": {"action": "breach"}, "stop": True},
+	))
+	_order = {"action": "none", "color": "none"}
+	assert _table.evaluate({"colors.blue", "cmd.breach"}, _order) == "breach"
+	assert _order == {"action": "breach", "color": "blue"}
+	_order = {"action": "none", "color": "none"}
+	assert _table.evaluate({"yell.base", "cmd.breach"}, _order) == "yell"
+	assert _order == {"action": "yell", "color": "none"}
+
+
+def test_first_stop_rule_is_early():
+	_table = table((
+		{"name": "always", "set": {"hold": False}},
+		{"name": "menu", "when": ("cmd.menu",), "set": {"action": "menu"}, "stop": True},
+		{"name": "breach", "when": ("cmd.breach",), "set": {"action": "breach"}, "stop": True},
+	))
+	# a later word may still hit "menu", which comes first
+	assert _table.early == {"menu"}
+
+
+def test_not_early_after_a_rule_which_may_still_fire():
+	# a later "フリーズ" would be a yell
+	_table = table((
+		{"name": "yell", "when": ("yell.base",), "set": {"action": "yell"}, "stop": True},
+		{"name": "menu", "when": ("cmd.menu",), "set": {"action": "menu"}, "stop": True},
+	))
+	assert _table.early == {"yell"}
+
+
+def test_not_early_after_options():
+	# a later "レッド" would change the color of the order
+	_table = table((
+		{"name": "colors", "options": {"color": (("colors.red", "red"), ("colors.blue", "blue"))}},
+		{"name": "menu", "when": ("cmd.menu",), "set": {"action": "menu"}, "stop": True},
+	))
+	assert _table.early == frozenset()
+
+
+def test_not_early_on_a_regex_keyword():
+	_table = table((
+		{"name": "cancel", "when": ("cmd.cancel",), "set": {"action": "cancel"}, "stop": True},
+	))
+	assert _table.regex_keys == {"cmd.cancel"}
+	assert _table.early == frozenset()
+
+
+def test_early_opt_out_and_invalid_early():
+	_table = table((
+		{"name": "menu", "when": ("cmd.menu",), "set": {"action": "menu"}, "stop": True, "early": False},
+	))
+	assert _table.early == frozenset()
+	with pytest.raises(rules.RuleError):
+		table(({"name": "colors", "options": {"color": (("colors.red", "red"),)}, "early": True},))
+
+
+def test_early_rules_of_each_state():
+	_state_rules = rules.StateRuleTable((
+		{"name": "yell", "when": ("yell.base",), "state": (0,), "set": {"action": "yell"}, "stop": True},
+		{"name": "menu", "when": ("cmd.menu",), "set": {"action": "menu"}, "stop": True},
+	), _groups, states=(0, 1))
+	assert _state_rules.early == {"yell"}
+	_state_rules.select(1)
+	# no yell in this state
+	assert _state_rules.early == {"menu"}
+
+
+def test_unknown_keyword():
+	with pytest.raises(rules.RuleError):
+		table(({"name": "x", "when": ("cmd.nothing",), "stop": True},))
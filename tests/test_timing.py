@@ -0,0 +1,42 @@
+#
+# This file is part of SR2Control tool.
+# (c) Copyright 2024 by Domtaro
+# Licensed under the LGPL-3.0; see LICENSE.txt file.
+#
+from sr2ctrl import timing
+
+
+def test_round_trip(tmp_path):
+	_path = str(tmp_path / "timing.ini")
+	_profile = timing.TimingProfile("Arma3", 0.05, {"shift+f1": 0.08, "F1": 0.07, "mouse_left": 0.02})
+	timing.save_profile(_profile, _path)
+	_loaded = timing.load_profile("Arma3", path=_path)
+	assert _loaded.interval == 0.05
+	# key names keep their case
+	assert _loaded.keys == {"shift+f1": 0.08, "F1": 0.07, "mouse_left": 0.02}
+	assert _loaded.interval_after("F1") == 0.07
+	assert _loaded.interval_after("f2") == 0.05
+
+
+def test_no_section_uses_the_default(tmp_path):
+	_path = str(tmp_path / "timing.ini")
+	assert timing.load_profile("ReadyOrNot", 0.06, path=_path).interval == 0.06
+	timing.save_profile(timing.TimingProfile("Arma3", 0.05), _path)
+	_profile = timing.load_profile("ReadyOrNot", 0.06, path=_path)
+	assert (_profile.interval, _profile.keys) == (0.06, {})
+
+
+def test_save_keeps_the_rest_of_the_file(tmp_path):
+	_path = tmp_path / "timing.ini"
+	_path.write_text("# comment\n\n[ReadyOrNot]\ninterval\t=\t0.06\ncmd_menu\t=\t0.1\n\n# arma\n[Arma3]\ninterval\t=\t0.06\n", encoding="utf-8")
+	timing.save_profile(timing.TimingProfile("ReadyOrNot", 0.04, {"red": 0.03}), str(_path))
+	assert _path.read_text(encoding="utf-8") == "# comment\n\n[ReadyOrNot]\ninterval\t=\t0.04\nred\t=\t0.03\n\n# arma\n[Arma3]\ninterval\t=\t0.06\n"
+	assert timing.load_profile("Arma3", path=str(_path)).interval == 0.06
+
+
+def test_invalid_interval_is_ignored(tmp_path, capsys):
+	_path = tmp_path / "timing.ini"
+	_path.write_text("[Arma3]\ninterval = 0.05\nf1 = fast\n", encoding="utf-8")
+	_profile = timing.load_profile("Arma3", path=str(_path))
+	assert (_profile.interval, _profile.keys) == (0.05, {})
+	assert "WARNING" in capsys.readouterr().out